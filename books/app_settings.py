@@ -23,6 +23,11 @@ from django.conf import settings
 BOOKS_PER_PAGE = getattr(settings, 'BOOKS_PER_PAGE', 2) 
 AUTHORS_PER_PAGE = getattr(settings, 'AUTHORS_PER_PAGE', 10)
 
+# Number of tags shown per page in the OPDS catalogs and in the HTML
+# pages:
+
+TAGS_PER_PAGE = getattr(settings, 'TAGS_PER_PAGE', 100)
+
 # If True, serve static media via Django.  Note that this is not
 # recommended for production:
 
@@ -31,3 +36,43 @@ BOOKS_STATICS_VIA_DJANGO = getattr(settings, 'BOOKS_STATICS_VIA_DJANGO', False)
 # This needs to match the published status
 
 BOOK_PUBLISHED = getattr(settings, 'BOOK_PUBLISHED', 1)
+
+# Maximum number of search box suggestions:
+
+AUTOCOMPLETE_RESULTS = getattr(settings, 'AUTOCOMPLETE_RESULTS', 10)
+
+# Number of values listed for each search facet (language, tag, ...):
+
+FACET_VALUES = getattr(settings, 'FACET_VALUES', 10)
+
+# Number of searches whose results are cached by each server process:
+
+SEARCH_CACHE_SIZE = getattr(settings, 'SEARCH_CACHE_SIZE', 128)
+
+# Total number of book ids of the search results cached by each server
+# process (8 bytes each on most platforms):
+
+SEARCH_CACHE_IDS = getattr(settings, 'SEARCH_CACHE_IDS', 500000)
+
+# Minimum similarity (0 to 1) of the titles and author names suggested
+# when a search finds nothing:
+
+FUZZY_SIMILARITY = getattr(settings, 'FUZZY_SIMILARITY', 0.3)
+
+# Total size in bytes of the rendered OPDS feeds cached by each server
+# process:
+
+FEED_CACHE_BYTES = getattr(settings, 'FEED_CACHE_BYTES', 8 * 1024 * 1024)
+
+# Number of serialized OPDS book entries cached by each server process:
+
+ENTRY_CACHE_SIZE = getattr(settings, 'ENTRY_CACHE_SIZE', 10000)
+
+# XML writer of the OPDS feeds: 'template', or 'sax' for the slower
+# xml.sax based writer:
+
+ATOM_WRITER = getattr(settings, 'ATOM_WRITER', 'template')
+
+# Number of books read by each query of the complete acquisition feed:
+
+COMPLETE_FEED_CHUNK_SIZE = getattr(settings, 'COMPLETE_FEED_CHUNK_SIZE', 500)
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class BooksConfig(AppConfig):
+    name = 'books'
+
+    def ready(self):
+        # connect the signal receivers keeping the search indexes in sync
+        from books import signals  # pylint: disable=unused-variable
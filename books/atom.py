@@ -29,12 +29,18 @@
 # THE SOFTWARE.
 #
 
+import io
 import re
 
-from xml.sax.saxutils import XMLGenerator
+from io import StringIO
+from itertools import chain
+from xml.sax.saxutils import XMLGenerator, escape, quoteattr
 from datetime import datetime
 
 
+# Size in characters of the chunks of a generated feed
+CHUNK_SIZE = 16 * 1024
+
 GENERATOR_TEXT = 'django-atompub'
 GENERATOR_ATTR = {
     'uri': 'http://code.google.com/p/django-atompub/',
@@ -70,6 +76,71 @@ def get_tag_uri(url, date):
     return 'tag:' + tag
 
 
+class TemplateXMLWriter(object):
+    """
+    Drop-in replacement of SimplerXMLGenerator for AtomFeed, writing the
+    same document with a single write of a formatted string for each
+    element, without the SAX machinery.
+    """
+    def __init__(self, out, encoding='UTF-8'):
+        self._encoding = encoding
+        self._write = out.write
+
+    def startDocument(self):
+        self._write('<?xml version="1.0" encoding="%s"?>\n' % self._encoding)
+
+    def endDocument(self):
+        pass
+
+    def startElement(self, name, attrs):
+        self._write('<%s%s>' % (name, _attributes(attrs)))
+
+    def endElement(self, name):
+        self._write('</%s>' % name)
+
+    def characters(self, content):
+        if content:
+            self._write(escape(content))
+
+    def addQuickElement(self, name, contents=None, attrs=None, tabs=1):
+        "Convenience method for adding an element with no children"
+        self._write('%s<%s%s>%s</%s>\n' % (
+            '\t' * tabs, name, _attributes(attrs),
+            escape(contents) if contents else '', name))
+
+
+def _attributes(attrs):
+    if not attrs:
+        return ''
+    return ''.join([' %s=%s' % (name, quoteattr(value))
+                    for name, value in attrs.items()])
+
+
+# XML writers of the feeds, by name
+WRITERS = {
+    'sax': SimplerXMLGenerator,
+    'template': TemplateXMLWriter,
+}
+
+
+class TextChunks(io.TextIOBase):
+    "Text output collected until taken, to write a document by parts"
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        return len(text)
+
+    def take(self, encoding):
+        text = ''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        return text.encode(encoding, 'xmlcharrefreplace')
+
+
 class ValidationError(Exception):
     pass
 
@@ -80,7 +151,8 @@ class AtomFeed(object):
     ns = u'http://www.w3.org/2005/Atom'
 
     def __init__(self, atom_id, title, updated=None, icon=None, logo=None, rights=None, subtitle=None,
-                 authors=None, categories=None, contributors=None, links=None, extra_attrs=None, hide_generator=False):
+                 authors=None, categories=None, contributors=None, links=None, extra_attrs=None, hide_generator=False,
+                 writer=SimplerXMLGenerator, complete=False):
         if atom_id is None:
             raise LookupError('Feed has no feed_id field')
         if title is None:
@@ -105,12 +177,27 @@ class AtomFeed(object):
             'links': links,
             'extra_attrs': extra_attrs,
             'hide_generator': hide_generator,
+            # RFC 5005 complete feed, needs the xmlns:fh attribute
+            'complete': complete,
         }
         self.items = []
+        # class of the XML writer, see WRITERS
+        self.writer = writer
+
+    def add_item(self, *args, **kwargs):
+        self.items.append(self.make_item(*args, **kwargs))
+
+    def add_fragment(self, fragment, updated):
+        """
+        Add an entry already serialized by serialize_item(), `updated`
+        being the date of the entry.
+        """
+        self.items.append({'fragment': fragment, 'updated': updated})
 
-    def add_item(self, atom_id, title, updated, content=None, published=None, rights=None, source=None, summary=None,
-                 authors=None, categories=None, contributors=None, links=None, extra_attrs=None, dc_language=None,
-                 dc_publisher=None, dc_issued=None, dc_identifier=None):
+    @staticmethod
+    def make_item(atom_id, title, updated, content=None, published=None, rights=None, source=None, summary=None,
+                  authors=None, categories=None, contributors=None, links=None, extra_attrs=None, dc_language=None,
+                  dc_publisher=None, dc_issued=None, dc_identifier=None):
         if atom_id is None:
             raise LookupError('Feed has no item_id method')
         if title is None:
@@ -122,7 +209,7 @@ class AtomFeed(object):
         contributors = contributors or []
         links = links or []
         extra_attrs = extra_attrs or {}
-        self.items.append({
+        return {
             'id': atom_id,
             'title': title,
             'updated': updated,
@@ -140,7 +227,7 @@ class AtomFeed(object):
             'dc_publisher': dc_publisher,
             'dc_issued': dc_issued,
             'dc_identifier': dc_identifier,
-        })
+        }
 
     def latest_updated(self):
         """
@@ -228,7 +315,30 @@ class AtomFeed(object):
             handler.addQuickElement(u'content', data)
 
     def write(self, outfile, encoding):
-        handler = SimplerXMLGenerator(outfile, encoding)
+        handler = self.writer(outfile, encoding)
+        self.write_head(handler)
+        self.write_items(handler)
+        handler.endElement(u'feed')
+
+    def generate(self, encoding='UTF-8', items=None, chunk_size=CHUNK_SIZE):
+        """
+        Yield the encoded feed in chunks of about `chunk_size` characters.
+
+        `items`, an iterable of items or fragments, is consumed while the
+        feed is written, after the items added to the feed.  The feed
+        should then be given its `updated` date.
+        """
+        out = TextChunks()
+        handler = self.writer(out, encoding)
+        self.write_head(handler)
+        for item in chain(self.items, items or ()):
+            self.write_items(handler, [item])
+            if out.size >= chunk_size:
+                yield out.take(encoding)
+        handler.endElement(u'feed')
+        yield out.take(encoding)
+
+    def write_head(self, handler):
         handler.startDocument()
         feed_attrs = {u'xmlns': self.ns}
         if self.feed.get('extra_attrs'):
@@ -260,54 +370,64 @@ class AtomFeed(object):
             self.write_text_construct(handler, u'rights', self.feed['rights'])
         if not self.feed.get('hide_generator'):
             handler.addQuickElement(u'generator', GENERATOR_TEXT, GENERATOR_ATTR, tabs=2)
+        if self.feed.get('complete'):
+            handler.addQuickElement(u'fh:complete')
 
-        self.write_items(handler)
+    def write_items(self, handler, items=None):
+        for item in self.items if items is None else items:
+            if 'fragment' in item:
+                handler._write(item['fragment'])
+            else:
+                self.write_item(handler, item)
 
-        handler.endElement(u'feed')
+    def serialize_item(self, item):
+        """Return the XML of an item made by make_item()."""
+        s = StringIO()
+        self.write_item(self.writer(s, 'UTF-8'), item)
+        return s.getvalue()
 
-    def write_items(self, handler):
-        for item in self.items:
-            entry_attrs = item.get('extra_attrs', {})
-            handler.characters("\t")
-            handler.startElement(u'entry', entry_attrs)
+    def write_item(self, handler, item):
+        entry_attrs = item.get('extra_attrs', {})
+        handler.characters("\t")
+        handler.startElement(u'entry', entry_attrs)
 
-            handler.characters("\n")
+        handler.characters("\n")
 
-            handler.addQuickElement(u'id', item['id'], tabs=2)
-            self.write_text_construct(handler, u'title', item['title'], tabs=2)
-            handler.addQuickElement(u'updated', rfc3339_date(item['updated']), tabs=2)
-            if item.get('published'):
-                handler.addQuickElement(u'published', rfc3339_date(item['published']), tabs=2)
-            if item.get('rights'):
-                self.write_text_construct(handler, u'rights', item['rights'], tabs=2)
-            if item.get('source'):
-                self.write_source(handler, item['source'])
-
-            for author in item['authors']:
-                self.write_person_construct(handler, u'author', author)
-            for contributor in item['contributors']:
-                self.write_person_construct(handler, u'contributor', contributor)
-            for category in item['categories']:
-                self.write_category_construct(handler, category)
-            for link in item['links']:
-                self.write_link_construct(handler, link, tabs=2)
-            if item.get('summary'):
-                self.write_text_construct(handler, u'summary', item['summary'])
-            if item.get('content'):
-                self.write_content(handler, item['content'])
-
-            if item.get('dc_language'):
-                handler.addQuickElement(u'dcterms:language', item['dc_language'], tabs=2)
-            if item.get('dc_publisher'):
-                handler.addQuickElement(u'dcterms:publisher', item['dc_publisher'], tabs=2)
-            if item.get('dc_issued'):
-                handler.addQuickElement(u'dcterms:issued', item['dc_issued'], tabs=2)
-            if item.get('dc_identifier'):
-                handler.addQuickElement(u'dcterms:identifier', item['dc_identifier'], tabs=2)
+        handler.addQuickElement(u'id', item['id'], tabs=2)
+        self.write_text_construct(handler, u'title', item['title'], tabs=2)
+        handler.addQuickElement(u'updated', rfc3339_date(item['updated']), tabs=2)
+        if item.get('published'):
+            handler.addQuickElement(u'published', rfc3339_date(item['published']), tabs=2)
+        if item.get('rights'):
+            self.write_text_construct(handler, u'rights', item['rights'], tabs=2)
+        if item.get('source'):
+            self.write_source(handler, item['source'])
+
+        for author in item['authors']:
+            self.write_person_construct(handler, u'author', author)
+        for contributor in item['contributors']:
+            self.write_person_construct(handler, u'contributor', contributor)
+        for category in item['categories']:
+            self.write_category_construct(handler, category)
+        for link in item['links']:
+            self.write_link_construct(handler, link, tabs=2)
+        if item.get('summary'):
+            self.write_text_construct(handler, u'summary', item['summary'])
+        if item.get('content'):
+            self.write_content(handler, item['content'])
+
+        if item.get('dc_language'):
+            handler.addQuickElement(u'dcterms:language', item['dc_language'], tabs=2)
+        if item.get('dc_publisher'):
+            handler.addQuickElement(u'dcterms:publisher', item['dc_publisher'], tabs=2)
+        if item.get('dc_issued'):
+            handler.addQuickElement(u'dcterms:issued', item['dc_issued'], tabs=2)
+        if item.get('dc_identifier'):
+            handler.addQuickElement(u'dcterms:identifier', item['dc_identifier'], tabs=2)
 
-            handler.characters("\t")
-            handler.endElement(u'entry')
-            handler.characters("\n")
+        handler.characters("\t")
+        handler.endElement(u'entry')
+        handler.characters("\n")
 
     def validate(self):
 
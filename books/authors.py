@@ -0,0 +1,81 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Summary of the books of each author: the number of published books
+and of books, and the last update of the published books, kept in the
+AuthorSummary table by the signals (see books.signals).
+
+The author lists read this table alone, in the order of its index,
+instead of looking for the authors of all the books on each page.
+"""
+
+from django.db.models import Count, Max
+
+from books.app_settings import BOOK_PUBLISHED
+from books.models import Author, AuthorSummary, Book
+from books.normalize import normalize_text
+
+
+def _summary(author_id, sort_key, books):
+    """Return the AuthorSummary of an author from its `books` rows."""
+    published = [updated for status, updated in books
+                 if status == BOOK_PUBLISHED]
+    return AuthorSummary(author_id=author_id, sort_key=sort_key,
+                         published_books=len(published),
+                         total_books=len(books),
+                         updated=max(published, default=None))
+
+
+def refresh(author_ids):
+    """Update the summaries of the authors of `author_ids`."""
+    author_ids = set(pk for pk in author_ids if pk is not None)
+    if not author_ids:
+        return
+    books = {}
+    for author_id, status, updated in Book.objects.filter(
+            a_author__in=author_ids).order_by().values_list(
+                'a_author', 'a_status', 'a_updated'):
+        books.setdefault(author_id, []).append((status, updated))
+    for author_id, name in Author.objects.filter(
+            pk__in=author_ids).values_list('pk', 'a_author'):
+        _summary(author_id, normalize_text(name)[:255],
+                 books.get(author_id, [])).save()
+
+
+def build(author_model, book_model, summary_model):
+    """
+    Fill the empty summary table from the books, in three queries.
+    The models are arguments for the migration creating the table.
+    """
+    counts = dict(book_model.objects.order_by().values_list(
+        'a_author').annotate(Count('pk')))
+    published = {author_id: (count, updated) for author_id, count, updated
+                 in book_model.objects.filter(
+                     a_status=BOOK_PUBLISHED).order_by().values_list(
+                         'a_author').annotate(Count('pk'),
+                                              Max('a_updated'))}
+    summary_model.objects.bulk_create(
+        summary_model(author_id=author_id,
+                      sort_key=normalize_text(name)[:255],
+                      total_books=counts.get(author_id, 0),
+                      published_books=published.get(author_id, (0, None))[0],
+                      updated=published.get(author_id, (0, None))[1])
+        for author_id, name in author_model.objects.values_list(
+            'pk', 'a_author').iterator())
+
+
+def rebuild():
+    AuthorSummary.objects.all().delete()
+    build(Author, Book, AuthorSummary)
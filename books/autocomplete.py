@@ -0,0 +1,175 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+In-memory prefix index of the book titles, author names and tags, used
+to answer the search box suggestions.
+
+Each worker process builds its own index on first use, then keeps it up
+to date from the model signals (see books.signals), or rebuilds it when
+another process changed the catalogue (see books.generation).
+"""
+
+import heapq
+from bisect import bisect_left, insort
+from itertools import chain
+
+from taggit.models import Tag
+
+from books import generation
+from books.app_settings import BOOK_PUBLISHED
+from books.models import Book, Author
+from books.normalize import normalize_text, words
+
+# Suggestions of the same quality are listed in this order:
+KINDS = ('tag', 'author', 'book')
+
+# Number of entries matching the most selective word of the query that
+# are considered for the suggestions.
+MAX_CANDIDATES = 1000
+
+
+class PrefixIndex(object):
+    """
+    Entries are found by word prefixes: 'dun hor' matches 'The Dunwich
+    Horror'.  The sorted vocabulary of the normalized words is searched
+    by bisection, each word pointing to the set of entries using it.
+    """
+    def __init__(self):
+        self.vocabulary = []
+        self.postings = {}
+        # (kind, pk) -> (label, normalized label, words, public)
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _add(self, key, label, public):
+        """Add an entry, return the words new to the vocabulary."""
+        entry_words = tuple(sorted(set(words(label))))
+        self.entries[key] = (label, normalize_text(label), entry_words,
+                             public)
+        new_words = []
+        for word in entry_words:
+            keys = self.postings.get(word)
+            if keys is None:
+                keys = self.postings[word] = set()
+                new_words.append(word)
+            keys.add(key)
+        return new_words
+
+    def add(self, kind, pk, label, public=True):
+        self.remove(kind, pk)
+        for word in self._add((kind, pk), label, public):
+            insort(self.vocabulary, word)
+
+    def load(self, entries):
+        """
+        Add (kind, pk, label, public) entries not in the index yet,
+        sorting the vocabulary once rather than for each new word.
+        """
+        for kind, pk, label, public in entries:
+            self._add((kind, pk), label, public)
+        self.vocabulary = sorted(self.postings)
+
+    def remove(self, kind, pk):
+        key = (kind, pk)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for word in entry[2]:
+            keys = self.postings[word]
+            keys.discard(key)
+            if not keys:
+                del self.postings[word]
+                del self.vocabulary[bisect_left(self.vocabulary, word)]
+
+    def _prefixed(self, prefix):
+        keys = set()
+        i = bisect_left(self.vocabulary, prefix)
+        while i < len(self.vocabulary) and \
+                self.vocabulary[i].startswith(prefix):
+            keys |= self.postings[self.vocabulary[i]]
+            if len(keys) >= MAX_CANDIDATES:
+                break
+            i += 1
+        return keys
+
+    def lookup(self, query, limit=10, public_only=False):
+        """
+        Return up to `limit` (kind, pk, label) entries having words
+        starting with each word of `query`.  Entries starting with the
+        whole query come first, then the shortest ones.
+        """
+        query_words = sorted(set(words(query)), key=len, reverse=True)
+        if not query_words:
+            return []
+
+        candidates = self._prefixed(query_words[0])
+        normalized = normalize_text(query)
+        results = []
+        for key in candidates:
+            label, entry_normalized, entry_words, public = self.entries[key]
+            if public_only and not public:
+                continue
+            if not all(any(word.startswith(prefix) for word in entry_words)
+                       for prefix in query_words[1:]):
+                continue
+            results.append((not entry_normalized.startswith(normalized),
+                            len(entry_normalized), KINDS.index(key[0]),
+                            label, key))
+        return [(key[0], key[1], label) for _, _, _, label, key
+                in heapq.nsmallest(limit, results)]
+
+
+def author_entries(author_ids):
+    """
+    Return the (kind, pk, label, public) entries of authors, public if
+    they have published books.
+    """
+    return [('author', pk, name, bool(published)) for pk, name, published
+            in Author.objects.filter(pk__in=author_ids).values_list(
+                'pk', 'a_author', 'summary__published_books')]
+
+
+def tag_entries(tag_ids):
+    """Return the entries of tags, public if they have published books."""
+    return [('tag', pk, name, bool(published)) for pk, name, published
+            in Tag.objects.filter(pk__in=tag_ids).values_list(
+                'pk', 'name', 'summary__published_books')]
+
+
+def build_index():
+    prefix_index = PrefixIndex()
+    books = (('book', pk, title, status == BOOK_PUBLISHED)
+             for pk, title, status in Book.objects.values_list(
+                 'pk', 'a_title', 'a_status'))
+    prefix_index.load(chain(books,
+                            author_entries(Author.objects.values('pk')),
+                            tag_entries(Tag.objects.values('pk'))))
+    return prefix_index
+
+
+index = generation.LocalIndex(build_index)
+
+
+def lookup(query, limit=10, public_only=False):
+    prefix_index = index.get()
+    with index.lock:
+        return prefix_index.lookup(query, limit, public_only)
+
+
+def book_entry(book):
+    """Return the (kind, pk, label, public) entry of a book."""
+    return 'book', book.pk, book.a_title, book.a_status_id == BOOK_PUBLISHED
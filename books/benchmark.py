@@ -0,0 +1,372 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Search benchmark: a synthetic catalogue and a mix of searches replayed
+through the book list views.
+
+Everything is drawn from a seeded random generator, so two runs with
+the same options search the same catalogue with the same queries and
+their reports can be compared.  See the benchmark_search command.
+
+The XML writers of the feeds are measured on synthetic entries, see the
+benchmark_atom command.
+"""
+
+import datetime
+import hashlib
+import io
+import json
+import random
+import time
+from bisect import bisect
+from itertools import accumulate
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from taggit.models import Tag, TaggedItem
+from django.contrib.contenttypes.models import ContentType
+
+from books import fulltext, fuzzy, generation, tagcounts, views
+# generate_corpus has an `authors` argument
+from books import authors as author_summaries
+from books.atom import AtomFeed, WRITERS
+from books.app_settings import BOOK_PUBLISHED
+from books.models import Author, Book, Language
+from books.normalize import normalize_text
+
+# language code -> (label, title words, name parts)
+VOCABULARY = {
+    'en': ('English',
+           ['horror', 'garden', 'river', 'night', 'stories', 'history',
+            'mountain', 'science', 'letters', 'journey', 'island', 'city',
+            'children', 'secret', 'war', 'peace', 'winter', 'house'],
+           ['Smith', 'Walker', 'Harris', 'Lovecraft', 'Austen', 'Dickens']),
+    'fr': ('French',
+           ['éducation', 'misérables', 'été', 'forêt', 'rivière', 'contes',
+            'histoire', 'château', 'mémoires', 'étranger', 'île', 'nuit'],
+           ['Hugo', 'Flaubert', 'Zola', 'Dumas', 'Mérimée', 'Sévigné']),
+    'es': ('Spanish',
+           ['años', 'soledad', 'corazón', 'historia', 'niños', 'montaña',
+            'camino', 'canción', 'mañana', 'río', 'jardín', 'guerra'],
+           ['Cervantes', 'Galdós', 'Martí', 'Neruda', 'Muñoz', 'Pérez']),
+    'hi': ('Hindi',
+           ['कहानियाँ', 'हिन्दी', 'इतिहास', 'गोदान', 'नदी', 'बच्चों',
+            'विज्ञान', 'गीत', 'यात्रा', 'पहाड़', 'शहर', 'रात'],
+           ['प्रेमचंद', 'निराला', 'महादेवी', 'दिनकर', 'बच्चन', 'शर्मा']),
+    'bn': ('Bengali',
+           ['গল্প', 'গীতাঞ্জলি', 'ইতিহাস', 'নদী', 'কবিতা', 'শিশু',
+            'বিজ্ঞান', 'গান', 'রাত', 'শহর', 'পথের', 'পাঁচালী'],
+           ['ঠাকুর', 'চট্টোপাধ্যায়', 'বন্দ্যোপাধ্যায়', 'দাশ', 'সেন', 'রায়']),
+}
+
+SUMMARY_WORDS = ('the of and a to in is was he for it with as his on be at '
+                 'by had not are but from or have an they which one you '
+                 'were her all she there would their we him been has when '
+                 'who will more no if out so said what up its about into '
+                 'than them can only other new some could time these two '
+                 'may then do first any my now such like our over man me '
+                 'even most made after also did many before must through '
+                 'back years where much your way well down should because '
+                 'each just those people how too little state good very '
+                 'make world still own see men work long get here between '
+                 'both life being under never day same another know while '
+                 'last might us great old year off come since against go '
+                 'came right used take three').split()
+
+# (kind, weight): share of each kind of search in the replayed mix
+QUERY_MIX = (
+    ('title_word', 30),
+    ('author_name', 20),
+    ('two_words', 15),
+    ('field_and_lang', 10),
+    ('or_query', 5),
+    ('misspelled', 5),
+    ('simple_title', 8),
+    ('simple_author', 5),
+    ('next_page', 2),
+)
+
+
+def _weighted_choice(rng, items, weights):
+    """
+    Pick an item with the probabilities `weights`, as random.choices(),
+    not available with Python 3.5, does for a single item.
+    """
+    cumulated = list(accumulate(weights))
+    return items[bisect(cumulated, rng.random() * cumulated[-1])]
+
+
+def _zipf_choice(rng, items, exponent=1.1):
+    """Pick an item, the first ones being much more frequent."""
+    weights = [1.0 / (rank ** exponent) for rank in range(1, len(items) + 1)]
+    return _weighted_choice(rng, items, weights)
+
+
+def generate_corpus(books=100000, authors=5000, tags=500, seed=0,
+                    summary_words=(50, 300), batch_size=1000):
+    """
+    Fill the database with a synthetic catalogue, then build the search
+    indexes.  Returns a description of the corpus.
+    """
+    rng = random.Random(seed)
+
+    languages = {}
+    for code, (label, title_words, name_parts) in VOCABULARY.items():
+        languages[code] = Language.objects.get_or_create(label=label)[0]
+    codes = sorted(VOCABULARY)
+
+    author_objects = []
+    names = set()
+    while len(author_objects) < authors:
+        code = rng.choice(codes)
+        parts = VOCABULARY[code][2]
+        name = '%s %s %d' % (rng.choice(parts), rng.choice(parts),
+                             len(author_objects))
+        if name in names:
+            continue
+        names.add(name)
+        author_objects.append(Author(
+            a_author=name, a_author_normalized=normalize_text(name)))
+    Author.objects.bulk_create(author_objects, batch_size=batch_size)
+    author_ids = list(Author.objects.values_list('pk', flat=True))
+
+    tag_objects = [Tag(name='tag %d' % i, slug='tag-%d' % i)
+                   for i in range(tags)]
+    Tag.objects.bulk_create(tag_objects, batch_size=batch_size)
+    tag_ids = list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+
+    first_id = (Book.objects.order_by('-pk').values_list(
+        'pk', flat=True).first() or 0) + 1
+    batch = []
+    for i in range(books):
+        code = _zipf_choice(rng, codes)
+        title_words = VOCABULARY[code][1]
+        title = ' '.join(rng.choice(title_words)
+                         for n in range(rng.randint(1, 5)))
+        summary = ' '.join(rng.choice(SUMMARY_WORDS)
+                           for n in range(rng.randint(*summary_words)))
+        batch.append(Book(
+            pk=first_id + i,
+            book_file='books/synthetic-%d.epub' % i,
+            file_sha256sum=hashlib.sha256(b'%d' % i).hexdigest(),
+            mimetype='application/epub+zip',
+            a_status_id=BOOK_PUBLISHED if rng.random() < 0.9 else 2,
+            a_title=title, a_title_normalized=normalize_text(title),
+            a_author_id=_zipf_choice(rng, author_ids, 0.8),
+            a_summary=summary,
+            dc_language=languages[code],
+            dc_identifier='synthetic-%d' % i))
+        if len(batch) >= batch_size:
+            Book.objects.bulk_create(batch)
+            batch = []
+    Book.objects.bulk_create(batch)
+
+    book_type = ContentType.objects.get_for_model(Book)
+    tagged = []
+    for pk in range(first_id, first_id + books):
+        for tag_id in set(_zipf_choice(rng, tag_ids)
+                          for n in range(rng.randint(0, 3))):
+            tagged.append(TaggedItem(tag_id=tag_id, content_type=book_type,
+                                     object_id=pk))
+        if len(tagged) >= batch_size:
+            TaggedItem.objects.bulk_create(tagged)
+            tagged = []
+    TaggedItem.objects.bulk_create(tagged)
+
+    # bulk_create does not send the signals maintaining the indexes
+    # (as rebuild_search_index does)
+    fulltext.rebuild()
+    fuzzy.rebuild()
+    author_summaries.rebuild()
+    tagcounts.rebuild()
+    generation.bump()
+
+    return {'books': books, 'authors': authors, 'tags': tags, 'seed': seed,
+            'languages': codes}
+
+
+def _misspell(rng, word):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:]
+
+
+def make_queries(count, seed=0):
+    """
+    Return `count` (kind, url name, GET parameters) searches drawn from
+    QUERY_MIX, with words of the synthetic catalogue.
+    """
+    rng = random.Random(seed)
+    kinds = [kind for kind, weight in QUERY_MIX]
+    weights = [weight for kind, weight in QUERY_MIX]
+    codes = sorted(VOCABULARY)
+    queries = []
+    for n in range(count):
+        kind = _weighted_choice(rng, kinds, weights)
+        code = rng.choice(codes)
+        label, title_words, name_parts = VOCABULARY[code]
+        word = rng.choice(title_words)
+        name = rng.choice(name_parts)
+        view = 'latest'
+        params = {}
+        if kind == 'title_word':
+            params['q'] = word
+        elif kind == 'author_name':
+            params['q'] = name
+        elif kind == 'two_words':
+            params['q'] = '%s %s' % (word, rng.choice(title_words))
+        elif kind == 'field_and_lang':
+            params['q'] = 'title:%s lang:%s' % (word, code)
+        elif kind == 'or_query':
+            params['q'] = '%s OR %s' % (word, rng.choice(title_words))
+        elif kind == 'misspelled':
+            params['q'] = _misspell(rng, name)
+        elif kind == 'simple_title':
+            view = 'by_title'
+            params = {'q': word[:rng.randint(3, max(3, len(word)))],
+                      'search-title': 'on'}
+        elif kind == 'simple_author':
+            view = 'by_title'
+            params = {'q': name, 'search-author': 'on'}
+        elif kind == 'next_page':
+            params = {'q': word, 'page': str(rng.randint(2, 5))}
+        queries.append((kind, view, params))
+    return queries
+
+
+def percentile(values, fraction):
+    """Return the `fraction` (0 to 1) percentile of values."""
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def _summary(timings, query_counts):
+    return {
+        'count': len(timings),
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'sql_queries_mean': round(sum(query_counts) / len(query_counts), 2),
+        'sql_queries_max': max(query_counts),
+    }
+
+
+def run_queries(queries, use_cache=True, warmup=5):
+    """
+    Replay the searches through the views, return the latency and SQL
+    query count statistics, overall and by kind of search.
+    """
+    client = Client()
+    for kind, view, params in queries[:warmup]:
+        client.get(reverse(view), params)
+
+    timings = {}
+    query_counts = {}
+    for kind, view, params in queries:
+        if not use_cache:
+            views.search_cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = client.get(reverse(view), params)
+            elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise RuntimeError('%s %r returned %d' % (
+                view, params, response.status_code))
+        timings.setdefault(kind, []).append(elapsed)
+        query_counts.setdefault(kind, []).append(len(context))
+
+    all_timings = [t for values in timings.values() for t in values]
+    all_counts = [c for values in query_counts.values() for c in values]
+    report = {'overall': _summary(all_timings, all_counts), 'by_kind': {}}
+    for kind in sorted(timings):
+        report['by_kind'][kind] = _summary(timings[kind], query_counts[kind])
+    return report
+
+
+def compare(report, baseline):
+    """Return the ratios of the latencies of `report` to `baseline`."""
+    ratios = {}
+    for name in ('p50_ms', 'p95_ms', 'p99_ms'):
+        before = baseline['overall'].get(name)
+        if before:
+            ratios[name] = round(report['overall'][name] / before, 3)
+    return ratios
+
+
+def make_entries(count, seed=0):
+    """Return `count` synthetic Atom items shaped like the book entries."""
+    rng = random.Random(seed)
+    codes = sorted(VOCABULARY)
+    updated = datetime.datetime(2020, 1, 1)
+    items = []
+    for i in range(count):
+        code = rng.choice(codes)
+        label, title_words, name_parts = VOCABULARY[code]
+        title = ' '.join(rng.choice(title_words) for n in range(3))
+        summary = ' '.join(rng.choice(SUMMARY_WORDS) for n in range(60))
+        items.append(AtomFeed.make_item(
+            'urn:uuid:%032x' % i, title + ' & <co>', updated,
+            content=summary,
+            authors=[{'name': ' '.join(rng.choice(name_parts)
+                                       for n in range(2))}],
+            links=[{'rel': 'http://opds-spec.org/acquisition',
+                    'href': '/book/%d/download' % i,
+                    'type': 'application/epub+zip'},
+                   {'rel': 'http://opds-spec.org/cover',
+                    'href': '/static_media/covers/%d.jpg' % i}],
+            dc_language=code, dc_issued='2012-11-07',
+            dc_identifier='http://www.gutenberg.org/ebooks/%d' % i))
+    return items
+
+
+def run_writers(entries=1000, repeat=5, seed=0):
+    """
+    Write a feed of `entries` synthetic entries with each XML writer of
+    books.atom, return the best entries per second of `repeat` runs of
+    each, and whether they all wrote the same document.
+    """
+    items = make_entries(entries, seed)
+    report = {'entries': entries, 'writers': {}}
+    documents = set()
+    for name, writer in sorted(WRITERS.items()):
+        feed = AtomFeed('test', 'Benchmark', updated=items[0]['updated'],
+                        writer=writer)
+        feed.items = items
+        best = None
+        for n in range(repeat):
+            out = io.StringIO()
+            start = time.perf_counter()
+            feed.write(out, 'UTF-8')
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        documents.add(out.getvalue())
+        report['writers'][name] = {
+            'entries_per_s': round(entries / best),
+            'ms': round(best * 1000, 3),
+        }
+    report['identical'] = len(documents) == 1
+    return report
+
+
+def dumps(report):
+    return json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False)
@@ -0,0 +1,295 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+In-memory bitmap index of the books by status, language and tag.
+
+Each bitmap is a Python integer whose bit n is set if the book at
+position n has the status, language or tag, the books being numbered in
+the order of `time_added`, then primary key.  Combined filters are
+bitwise intersections, and the books of a list are read from the
+highest bit down, which is the order of the latest books list, the
+ordering of its keyset pages too (see books.views.KEYSET_ORDERINGS).
+A book added with a `time_added` older than the latest book, e.g. an
+imported one, cannot be numbered in order: the index is then rebuilt.
+
+Each worker process builds its own index on first use, and keeps it
+in sync with the catalogue generation (see books.generation).
+"""
+
+from django.contrib.contenttypes.models import ContentType
+
+from taggit.models import Tag, TaggedItem
+
+from books import generation
+from books.app_settings import BOOK_PUBLISHED
+from books.models import Book, Language, TagGroup
+
+# Number of bits counted at once when skipping to a page
+_SKIP_CHUNK = 4096
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def ids_desc(bits, start, stop):
+    """Return the positions of the set bits, from the highest, sliced."""
+    digits = bin(bits)
+    highest = len(digits) - 3
+    ids = []
+    seen = 0
+    i = 2
+    # skip the leading pages by chunks
+    while True:
+        ones = digits.count('1', i, i + _SKIP_CHUNK)
+        if seen + ones > start or i >= len(digits):
+            break
+        seen += ones
+        i += _SKIP_CHUNK
+    while len(ids) < stop - start:
+        i = digits.find('1', i)
+        if i < 0:
+            break
+        if seen >= start:
+            ids.append(highest - (i - 2))
+        seen += 1
+        i += 1
+    return ids
+
+
+def _set(bitmaps, key, bit):
+    bitmaps[key] = bitmaps.get(key, 0) | bit
+
+
+def _clear(bitmaps, key, bit):
+    bits = bitmaps.get(key, 0) & ~bit
+    if bits:
+        bitmaps[key] = bits
+    else:
+        bitmaps.pop(key, None)
+
+
+class BitmapIndex(object):
+    def __init__(self):
+        self.all = 0
+        self.status = {}
+        self.language = {}
+        self.tag = {}
+        # book id -> [status id, language id, set of tag ids, time_added]
+        self.books = {}
+        self.language_codes = {}
+        self.tag_ids = {}
+        # bit position -> book id, only appended to: the lists keep the
+        # list of the index they were selected from
+        self.order = []
+        # book id -> bit position
+        self.positions = {}
+        # (time_added, id) of the last numbered book
+        self.last = None
+
+    def _bit(self, pk):
+        return 1 << self.positions[pk]
+
+    def book_ids(self, positions):
+        return [self.order[position] for position in positions]
+
+    def set_book(self, pk, status, language, time_added):
+        """
+        Add or update a book.  Raises generation.OutOfSync if the book
+        cannot be numbered in order, or was moved.
+        """
+        book = self.books.get(pk)
+        if book is None:
+            if self.last is not None and (time_added, pk) < self.last:
+                raise generation.OutOfSync()
+            self.last = (time_added, pk)
+            self.positions[pk] = len(self.order)
+            self.order.append(pk)
+            bit = self._bit(pk)
+            book = self.books[pk] = [None, None, set(), time_added]
+            self.all |= bit
+        else:
+            if book[3] != time_added:
+                raise generation.OutOfSync()
+            bit = self._bit(pk)
+            _clear(self.status, book[0], bit)
+            _clear(self.language, book[1], bit)
+        book[0] = status
+        book[1] = language
+        _set(self.status, status, bit)
+        if language is not None:
+            _set(self.language, language, bit)
+
+    def remove_book(self, pk):
+        book = self.books.pop(pk, None)
+        if book is None:
+            return
+        bit = 1 << self.positions.pop(pk)
+        self.all &= ~bit
+        _clear(self.status, book[0], bit)
+        _clear(self.language, book[1], bit)
+        for tag in book[2]:
+            _clear(self.tag, tag, bit)
+
+    def add_tags(self, pk, tags):
+        book = self.books.get(pk)
+        if book is None:
+            return
+        for tag in tags:
+            book[2].add(tag)
+            _set(self.tag, tag, self._bit(pk))
+
+    def remove_tags(self, pk, tags=None):
+        """Remove the given tags, or all of them, from a book."""
+        book = self.books.get(pk)
+        if book is None:
+            return
+        if tags is None:
+            tags = list(book[2])
+        for tag in tags:
+            book[2].discard(tag)
+            _clear(self.tag, tag, self._bit(pk))
+
+    def _forget_tag_name(self, pk):
+        for name in [name for name, tag_id in self.tag_ids.items()
+                     if tag_id == pk]:
+            del self.tag_ids[name]
+
+    def set_tag(self, pk, name):
+        """Add or rename a tag."""
+        self._forget_tag_name(pk)
+        self.tag_ids[name] = pk
+
+    def remove_tag(self, pk):
+        self._forget_tag_name(pk)
+        bits = self.tag.pop(pk, 0)
+        for book_id in self.book_ids(ids_desc(bits, 0, popcount(bits))):
+            self.books[book_id][2].discard(pk)
+
+    def book_counts(self):
+        """Return the number of published and unpublished books."""
+        published = popcount(self.status.get(BOOK_PUBLISHED, 0))
+        return published, len(self.books) - published
+
+    def select(self, status=None, language_code=None, tag=None,
+               tags_any=None):
+        """
+        Return the bitmap of the books matching all the given criteria:
+        a status id, a language code, a tag name and a list of tag ids
+        of which the books must have at least one.
+        """
+        bits = self.all
+        if status is not None:
+            bits &= self.status.get(status, 0)
+        if language_code:
+            languages = 0
+            for language, code in self.language_codes.items():
+                if code == language_code:
+                    languages |= self.language.get(language, 0)
+            bits &= languages
+        if tag is not None:
+            bits &= self.tag.get(self.tag_ids.get(tag), 0)
+        if tags_any is not None:
+            tags = 0
+            for tag_id in tags_any:
+                tags |= self.tag.get(tag_id, 0)
+            bits &= tags
+        return bits
+
+
+class BitmapBookList(object):
+    """
+    Books of a bitmap, latest first, sliceable by Paginator without
+    running COUNT or OFFSET queries.  `order` is the BitmapIndex.order
+    of the bitmap.
+    """
+    def __init__(self, bits, order):
+        self.bits = bits
+        self.order = order
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = popcount(self.bits)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+        return fetch_books([self.order[position] for position
+                            in ids_desc(self.bits, start, stop)])
+
+
+def fetch_books(ids):
+    """Return the books of a list of ids, in the same order."""
+    books = Book.objects.select_related('a_author').in_bulk(ids)
+    return [books[pk] for pk in ids if pk in books]
+
+
+def build_index():
+    index = BitmapIndex()
+    for pk, status, language, time_added in Book.objects.order_by(
+            'time_added', 'pk').values_list('pk', 'a_status', 'dc_language',
+                                            'time_added'):
+        index.set_book(pk, status, language, time_added)
+    book_type = ContentType.objects.get_for_model(Book)
+    for pk, tag in TaggedItem.objects.filter(
+            content_type=book_type).values_list('object_id', 'tag'):
+        index.add_tags(pk, [tag])
+    index.language_codes = dict(Language.objects.values_list('pk', 'code'))
+    index.tag_ids = dict(Tag.objects.values_list('name', 'pk'))
+    return index
+
+
+index = generation.LocalIndex(build_index)
+
+
+def book_list(params, published_only, tag=None):
+    """
+    Return the latest books matching the facet parameters `params`
+    (see books.facets) as a BitmapBookList, or None if the parameters
+    need a query.
+    """
+    if params.get('author'):
+        return None
+
+    status = None
+    if params.get('status'):
+        try:
+            status = int(params['status'])
+        except ValueError:
+            pass
+    tags_any = None
+    if params.get('group'):
+        group = TagGroup.objects.filter(slug=params['group']).first()
+        tags_any = list(group.tags.values_list('pk', flat=True)) \
+            if group else []
+
+    bitmap_index = index.get()
+    with index.lock:
+        bits = bitmap_index.select(status=status, tags_any=tags_any,
+                                   language_code=params.get('lang'))
+        if published_only:
+            bits &= bitmap_index.select(status=BOOK_PUBLISHED)
+        if tag is not None:
+            bits &= bitmap_index.select(tag=tag.name)
+        if params.get('tag'):
+            bits &= bitmap_index.select(tag=params['tag'])
+        return BitmapBookList(bits, bitmap_index.order)
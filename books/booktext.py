@@ -0,0 +1,176 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Full-text index of the contents of the EPUB books.
+
+The text of the spine documents is cut in chunks, each chunk is a row
+of a FTS5 table with the id of its book.  A BookText row records which
+file of each book was indexed, so the index_book_text command can be
+interrupted and run again, and only indexes new or changed books.
+
+Indexing reads whole books: it runs from the management commands, not
+when serving requests.
+"""
+
+import os
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from books import fulltext
+from books.epub import Epub
+from books.models import BookText
+
+TEXT_TABLE = 'books_booktext_fts'
+
+# Number of characters of a row of the index
+CHUNK_SIZE = 16 * 1024
+
+# Number of words of the snippets shown in the results
+SNIPPET_WORDS = 24
+
+EPUB_MIMETYPE = 'application/epub+zip'
+
+# Markers of the matches in the snippets, replaced after HTML escaping
+_MATCH_START = '\x02'
+_MATCH_END = '\x03'
+
+
+def create_table_sql():
+    return ("CREATE VIRTUAL TABLE %s USING fts5(book_id UNINDEXED, text, "
+            "tokenize='unicode61 remove_diacritics 1')" % TEXT_TABLE)
+
+
+def is_available():
+    return fulltext.table_exists(TEXT_TABLE)
+
+
+def unindex_book(book_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE book_id = %%s' % TEXT_TABLE,
+                       [book_id])
+
+
+def _book_chunks(book):
+    if book.mimetype != EPUB_MIMETYPE:
+        return
+    epub = Epub(os.path.join(settings.MEDIA_ROOT, book.book_file.name))
+    try:
+        for chunk in epub.iter_text(CHUNK_SIZE):
+            yield chunk
+    finally:
+        epub.close()
+
+
+def index_book(book):
+    """
+    Index the text of a book, replacing the previous one.
+
+    Returns the number of chunks indexed.
+    """
+    if not is_available():
+        return 0
+    with transaction.atomic():
+        unindex_book(book.pk)
+        chunks = 0
+        with connection.cursor() as cursor:
+            for chunk in _book_chunks(book):
+                cursor.execute('INSERT INTO %s (book_id, text) '
+                               'VALUES (%%s, %%s)' % TEXT_TABLE,
+                               [book.pk, chunk])
+                chunks += 1
+        BookText.objects.update_or_create(
+            book=book, defaults={'file_sha256sum': book.file_sha256sum,
+                                 'chunks': chunks})
+    return chunks
+
+
+def forget_replaced_file(book):
+    """Drop the indexed text of a book if its file was replaced."""
+    replaced = BookText.objects.filter(book=book.pk).exclude(
+        file_sha256sum=book.file_sha256sum)
+    if replaced.exists():
+        unindex_book(book.pk)
+        replaced.delete()
+
+
+def pending_books(queryset):
+    """
+    Restrict a Book queryset to the books whose text is not indexed, or
+    was indexed from another file.
+    """
+    return queryset.exclude(pk__in=BookText.objects.filter(
+        book__file_sha256sum=F('file_sha256sum')).values('book'))
+
+
+def filter_queryset(queryset, expression, ranked=False):
+    """
+    Restrict a Book queryset to the books whose text matches
+    `expression`, ordered by their best matching chunk if `ranked`.
+    """
+    queryset = queryset.filter(pk__in=fulltext.RowidSubquery(
+        'SELECT book_id FROM %s WHERE %s MATCH %%s' % (TEXT_TABLE,
+                                                        TEXT_TABLE),
+        [expression]))
+    if ranked:
+        rank = RawSQL(
+            'SELECT rank FROM %s WHERE %s MATCH %%s AND book_id = %s.id '
+            'ORDER BY rank LIMIT 1' % (TEXT_TABLE, TEXT_TABLE,
+                                       queryset.model._meta.db_table),
+            [expression])
+        queryset = queryset.annotate(search_rank=rank).order_by('search_rank')
+    return queryset
+
+
+def search(queryset, searchterms, ranked=False):
+    """Search the text of the books, see filter_queryset()."""
+    expression = fulltext.match_expression(searchterms.split())
+    if expression is None or not is_available():
+        return queryset.none()
+    return filter_queryset(queryset, expression, ranked)
+
+
+def add_snippets(books, searchterms):
+    """
+    Set the `text_snippet` attribute of the books to an extract of
+    their best matching chunk, as HTML with the matches in <mark>.
+    """
+    expression = fulltext.match_expression(searchterms.split())
+    books = list(books)
+    if expression is None or not books or not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT book_id, snippet(%s, 1, %%s, %%s, %%s, %%s) FROM %s '
+            'WHERE %s MATCH %%s AND book_id IN (%s) ORDER BY rank' %
+            (TEXT_TABLE, TEXT_TABLE, TEXT_TABLE,
+             ', '.join(['%s'] * len(books))),
+            [_MATCH_START, _MATCH_END, '…', SNIPPET_WORDS, expression] +
+            [book.pk for book in books])
+        snippets = {}
+        for book_id, snippet in cursor.fetchall():
+            snippets.setdefault(int(book_id), snippet)
+    for book in books:
+        snippet = snippets.get(book.pk)
+        if snippet is not None:
+            snippet = escape(snippet).replace(_MATCH_START, '<mark>') \
+                .replace(_MATCH_END, '</mark>')
+            book.text_snippet = mark_safe(snippet)
@@ -0,0 +1,102 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Conditional GET of the OPDS feeds.
+
+The validator comes from the catalogue state (see books.generation):
+the ETag hashes the generation token, the request URL and whether the
+user is authenticated.  A client polling an unchanged feed gets a 304
+answered with the single query reading the state.  There is no
+Last-Modified: at a one second resolution, a client sending only
+If-Modified-Since would miss the changes made in the second it fetched
+the feed.
+
+The rendered feeds are cached by ETag, and served compressed when the
+client accepts it (see books.feedcache).
+"""
+
+import hashlib
+from functools import wraps
+
+from django.utils.cache import patch_vary_headers
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
+
+from books import feedcache, generation
+
+
+# `qtype` of the views returning a feed, Atom or OPDS 2.0 JSON
+FEED_TYPES = ('feed', 'json')
+
+
+def _state(request):
+    # read once for the validation and the cache
+    if not hasattr(request, '_catalog_state'):
+        request._catalog_state = generation.state()
+    return request._catalog_state
+
+
+def feed_etag(request, downloads=False):
+    token, updated, download_count = _state(request)
+    parts = [token, request.build_absolute_uri(),
+             str(request.user.is_authenticated())]
+    if downloads:
+        parts.append(str(download_count))
+    return hashlib.md5('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def conditional_feed(view=None, downloads=False, feed_only=False,
+                     cached=True):
+    """
+    Decorate a view to answer the conditional GET requests of its feeds,
+    and cache them: when its `qtype` argument is in FEED_TYPES, or always
+    if `feed_only`.
+    `downloads` is for the feeds sorted by number of downloads.  The
+    feeds which are never small enough to be cached are not, with
+    `cached` False: they are streamed to each request.
+    """
+    def decorator(view):
+        def cached_view(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+            accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+            etag = feed_etag(request, downloads)
+            if cached:
+                response = feedcache.cache.response(
+                    etag, _state(request)[0],
+                    lambda: view(request, *args, **kwargs), accept_encoding)
+            else:
+                response = feedcache.stream_response(
+                    view(request, *args, **kwargs), accept_encoding)
+            patch_vary_headers(response, ('Accept-Encoding',))
+            if response.has_header('Content-Encoding'):
+                # the compressed bytes differ, the feed is the same
+                response['ETag'] = 'W/' + quote_etag(etag)
+            return response
+
+        conditional_view = condition(
+            etag_func=lambda request, *args, **kwargs:
+            feed_etag(request, downloads))(cached_view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if feed_only or kwargs.get('qtype') in FEED_TYPES:
+                return conditional_view(request, *args, **kwargs)
+            return view(request, *args, **kwargs)
+        return wrapper
+
+    if view is not None:
+        return decorator(view)
+    return decorator
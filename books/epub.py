@@ -18,12 +18,58 @@
 import zipfile
 import tempfile
 import os
+import posixpath
+from urllib.parse import unquote
 from lxml import etree
 import shutil
 
 from books import epubinfo
 
 
+# Size of the blocks read from the zip members when extracting the text
+_READ_SIZE = 16 * 1024
+
+# XHTML elements whose content is not text of the book
+_SKIPPED_ELEMENTS = ('head', 'script', 'style')
+
+# XHTML elements separating words
+_BLOCK_ELEMENTS = ('address', 'article', 'aside', 'blockquote', 'br', 'dd',
+                   'div', 'dl', 'dt', 'figcaption', 'figure', 'footer', 'h1',
+                   'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'ol',
+                   'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul')
+
+
+class _TextTarget(object):
+    """lxml parser target collecting the text of a XHTML document."""
+    def __init__(self):
+        self.parts = []
+        self._skip = 0
+
+    def start(self, tag, attrib):
+        name = tag.rpartition('}')[2]
+        if name in _SKIPPED_ELEMENTS:
+            self._skip += 1
+        elif name in _BLOCK_ELEMENTS:
+            self.parts.append(' ')
+
+    def end(self, tag):
+        name = tag.rpartition('}')[2]
+        if name in _SKIPPED_ELEMENTS:
+            self._skip -= 1
+        elif name in _BLOCK_ELEMENTS:
+            self.parts.append(' ')
+
+    def data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        pass
+
+
 class Epub(object):
     def __init__(self, _file):
         """
@@ -125,6 +171,69 @@ class Epub(object):
                 return self._zobject.open(path), ext
         return None, None
 
+    def get_spine_paths(self):
+        '''
+        Returns the paths in the zip file of the documents of the spine,
+        in reading order
+        '''
+        opffile = self._zobject.open(self._opfpath)
+        root = etree.parse(opffile).getroot()
+        opffile.close()
+
+        hrefs = {}
+        for element in root.iterfind('.//{http://www.idpf.org/2007/opf}item'):
+            hrefs[element.get('id')] = element.get('href')
+
+        names = set(self._zobject.namelist())
+        paths = []
+        for element in root.iterfind(
+                './/{http://www.idpf.org/2007/opf}spine'
+                '/{http://www.idpf.org/2007/opf}itemref'):
+            href = hrefs.get(element.get('idref'))
+            if not href:
+                continue
+            path = posixpath.normpath(
+                self._basepath + unquote(href.partition('#')[0]))
+            if path in names and path not in paths:
+                paths.append(path)
+        return paths
+
+    def iter_text(self, chunk_size=64 * 1024):
+        '''
+        Yields the text of the spine documents in chunks of about
+        `chunk_size` characters, cut between words.
+
+        The documents are parsed as they are read from the zip file, so
+        only one block of each document is held in memory at once.
+        '''
+        for path in self.get_spine_paths():
+            target = _TextTarget()
+            parser = etree.XMLParser(target=target, recover=True,
+                                     resolve_entities=False, no_network=True)
+            pending = ''
+            with self._zobject.open(path) as document:
+                while True:
+                    block = document.read(_READ_SIZE)
+                    if block:
+                        parser.feed(block)
+                    else:
+                        parser.close()
+                    pending += ''.join(target.parts)
+                    del target.parts[:]
+                    while len(pending) >= chunk_size:
+                        cut = pending.rfind(' ', 0, chunk_size)
+                        if cut <= 0:
+                            cut = chunk_size
+                        chunk = ' '.join(pending[:cut].split())
+                        pending = pending[cut:]
+                        if chunk:
+                            yield chunk
+                    if not block:
+                        break
+            chunk = ' '.join(pending.split())
+            if chunk:
+                yield chunk
+
     def close(self):
         '''
         Cleans up (closes open zip files and deletes uncompressed content of Epub.
@@ -0,0 +1,162 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Facet counts (language, tag, author, status) of a list of books.
+
+The language, status and author counts come from a single GROUP BY
+query over the books, the tag counts from a single GROUP BY query over
+the tagged items.
+"""
+
+from collections import Counter
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
+
+from taggit.models import TaggedItem
+
+from books import bitmaps
+from books.app_settings import FACET_VALUES
+from books.models import Book, TagGroup
+
+# (GET parameter, title) of the facet groups, in display order
+FACET_GROUPS = (
+    ('lang', 'Language'),
+    ('tag', 'Tag'),
+    ('author', 'Author'),
+    ('status', 'Status'),
+)
+FACET_PARAMS = [param for param, title in FACET_GROUPS]
+
+# GET parameters filtering the books: the facets, and the slug of a tag
+# group whose books have at least one tag
+FILTER_PARAMS = FACET_PARAMS + ['group']
+
+
+def book_counts():
+    """Return the number of published and unpublished books."""
+    bitmap_index = bitmaps.index.get()
+    with bitmaps.index.lock:
+        return bitmap_index.book_counts()
+
+
+def _int_param(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def apply_filters(queryset, params):
+    """Restrict a Book queryset to the facet values selected in params."""
+    if params.get('lang'):
+        queryset = queryset.filter(dc_language__code=params['lang'])
+    if params.get('tag'):
+        queryset = queryset.filter(tags__name=params['tag'])
+    author = _int_param(params.get('author'))
+    if author is not None:
+        queryset = queryset.filter(a_author=author)
+    status = _int_param(params.get('status'))
+    if status is not None:
+        queryset = queryset.filter(a_status=status)
+    if params.get('group'):
+        group_tags = TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(TagGroup),
+            object_id__in=TagGroup.objects.filter(
+                slug=params['group']).values('pk')).values('tag')
+        queryset = queryset.filter(pk__in=TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Book),
+            tag__in=group_tags).values('object_id'))
+    return queryset
+
+
+def is_filtered(params):
+    return any(params.get(param) for param in FILTER_PARAMS)
+
+
+def selected_qstring(params):
+    """Return the urlencoded filters selected in params."""
+    qdict = params.copy()
+    for key in list(qdict.keys()):
+        if key not in FILTER_PARAMS:
+            del qdict[key]
+    return qdict.urlencode()
+
+
+def facet_qstring(params, param, value):
+    """Return the query string selecting `value` for the facet `param`."""
+    qdict = params.copy()
+    qdict[param] = value
+    qdict.pop('page', None)
+    qdict.pop('cursor', None)
+    return '?' + qdict.urlencode()
+
+
+def _top(counter, labels):
+    return [(value, labels[value], count)
+            for value, count in counter.most_common(FACET_VALUES)]
+
+
+def compute_facets(queryset, params, with_status=False):
+    """
+    Count the books of `queryset` by facet value.
+
+    Returns a list of groups {'param', 'title', 'values'}, values being
+    lists of {'value', 'label', 'count', 'active', 'qstring'} sorted by
+    decreasing count.  Only the FACET_VALUES most used values of each
+    facet are kept.
+    """
+    languages, authors, statuses = Counter(), Counter(), Counter()
+    labels = {'lang': {}, 'author': {}, 'status': {}, 'tag': {}}
+
+    rows = queryset.order_by().values_list(
+        'dc_language__code', 'dc_language__label',
+        'a_author', 'a_author__a_author',
+        'a_status', 'a_status__status').annotate(count=Count('pk'))
+    for lang, lang_label, author, author_name, status, status_name, count \
+            in rows:
+        if lang:
+            languages[lang] += count
+            labels['lang'][lang] = lang_label
+        authors[str(author)] += count
+        labels['author'][str(author)] = author_name
+        statuses[str(status)] += count
+        labels['status'][str(status)] = status_name
+
+    tags = Counter()
+    tag_rows = TaggedItem.objects.filter(
+        content_type=ContentType.objects.get_for_model(Book),
+        object_id__in=queryset.order_by().values('pk')
+    ).values_list('tag__name').annotate(count=Count('pk')) \
+        .order_by('-count')[:FACET_VALUES]
+    for name, count in tag_rows:
+        tags[name] = count
+        labels['tag'][name] = name
+
+    counters = {'lang': languages, 'tag': tags, 'author': authors,
+                'status': statuses}
+    groups = []
+    for param, title in FACET_GROUPS:
+        if param == 'status' and not with_status:
+            continue
+        values = [{'value': value, 'label': label, 'count': count,
+                   'active': params.get(param) == value,
+                   'qstring': facet_qstring(params, param, value)}
+                  for value, label, count
+                  in _top(counters[param], labels[param])]
+        if values:
+            groups.append({'param': param, 'title': title,
+                           'values': values})
+    return groups
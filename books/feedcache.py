@@ -0,0 +1,299 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Per-process cache of the rendered OPDS feeds.
+
+A feed is the same for every request with the same validators (see
+books.conditional), so the rendered feeds are kept by ETag, up to a
+total size in bytes, least recently used first out.  The cache is
+dropped when the catalogue changes (see books.signals) or when another
+process changed it (see books.generation).
+
+Concurrent requests of a feed which is not cached yet, such as all the
+readers refreshing `latest.atom` after an import, wait for the first
+one to render it instead of rendering it each.  The first request reads
+a streamed feed entirely before sending it, so the waiting ones are
+answered as soon as it is rendered, whatever the speed of its client.
+The price is the first byte of that first request, sent after the whole
+rendering rather than with the first entries: streaming it while it is
+cached would hold the waiting requests until its client has read it.
+A feed too large to be cached is sent while it is rendered, the waiting
+requests rendering their own, and the complete feed, larger than the
+cache on most catalogues, is always streamed (see books.views).
+
+The cached feeds are compressed once, with gzip and, if the brotli
+module is installed, brotli, and served compressed to the clients
+accepting it.  The feeds too large to be cached are compressed with
+gzip while they are sent.
+"""
+
+import gzip
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from itertools import chain
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from django.http import HttpResponse
+
+from books.app_settings import FEED_CACHE_BYTES
+
+# Seconds a request waits for another one rendering the same feed
+# before rendering it itself:
+RENDER_TIMEOUT = 30
+
+# Content codings of the cached feeds, by order of preference
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def _gzip(content):
+    out = BytesIO()
+    # no timestamp, the same feed compresses to the same bytes
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9,
+                       mtime=0) as gzip_file:
+        gzip_file.write(content)
+    return out.getvalue()
+
+
+def gzip_chunks(chunks):
+    """
+    Yield the gzip compression of a stream of chunks as the compressor
+    outputs it, so the memory used does not depend on the stream size.
+    """
+    out = BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6,
+                       mtime=0) as gzip_file:
+        for chunk in chunks:
+            gzip_file.write(chunk)
+            if out.tell():
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
+    yield out.getvalue()
+
+
+def compress(content):
+    """Return the compressed variants of `content`, by content coding."""
+    variants = {'gzip': _gzip(content)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(content)
+    return {coding: data for coding, data in variants.items()
+            if len(data) < len(content)}
+
+
+def accepted_encodings(header):
+    """Return the content codings accepted by an Accept-Encoding header."""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        coding = coding.strip().lower()
+        if coding and quality > 0:
+            accepted.add(coding)
+    return accepted
+
+
+class CachedFeed(object):
+    def __init__(self, content, content_type):
+        self.content = content
+        self.content_type = content_type
+        # content coding -> compressed content
+        self.variants = compress(content)
+
+    def __len__(self):
+        return len(self.content) + sum(
+            len(data) for data in self.variants.values())
+
+    def response(self, accept_encoding=''):
+        """Return a response with the best variant for Accept-Encoding."""
+        accepted = accepted_encodings(accept_encoding)
+        for coding in ENCODINGS:
+            if coding in accepted and coding in self.variants:
+                response = HttpResponse(self.variants[coding],
+                                        content_type=self.content_type)
+                response['Content-Encoding'] = coding
+                break
+        else:
+            response = HttpResponse(self.content,
+                                    content_type=self.content_type)
+        response['Content-Length'] = str(len(response.content))
+        return response
+
+
+class FeedCache(object):
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.generation = None
+        self.size = 0
+        # key -> CachedFeed
+        self._entries = OrderedDict()
+        # key -> Event set when the rendering of the key is over
+        self._renderings = {}
+        # keys of the feeds of the generation too large to be cached,
+        # rendered by each request without waiting for the others
+        self._too_large = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _sync(self, token):
+        # with the lock held
+        if token != self.generation:
+            self._entries.clear()
+            self._too_large.clear()
+            self.size = 0
+            self.generation = token
+
+    def get(self, key, token):
+        """Return the CachedFeed of `key`, or None."""
+        with self._lock:
+            self._sync(token)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, token, content, content_type):
+        """
+        Store a feed rendered when the generation was `token`.  Feeds
+        larger than the whole cache are not kept.
+        """
+        if len(content) > self.max_bytes:
+            return
+        entry = CachedFeed(content, content_type)
+        if len(entry) > self.max_bytes:
+            return
+        with self._lock:
+            if token != self.generation:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = entry
+            self.size += len(entry)
+            while self.size > self.max_bytes:
+                old_key, old = self._entries.popitem(last=False)
+                self.size -= len(old)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._too_large.clear()
+            self.size = 0
+
+    def response(self, key, token, render, accept_encoding=''):
+        """
+        Return the cached response of `key`, compressed as accepted by
+        `accept_encoding`, or the response returned by `render()`, which
+        is cached if it is a successful one.  Only one request at a time
+        renders a given key, unless it was too large to be cached.
+        """
+        entry = self.get(key, token)
+        if entry is not None:
+            return entry.response(accept_encoding)
+
+        with self._lock:
+            too_large = token == self.generation and key in self._too_large
+            rendering = self._renderings.get(key)
+            leader = rendering is None and not too_large
+            if leader:
+                rendering = self._renderings[key] = threading.Event()
+
+        if too_large:
+            return stream_response(render(), accept_encoding)
+
+        if not leader:
+            rendering.wait(RENDER_TIMEOUT)
+            entry = self.get(key, token)
+            if entry is not None:
+                return entry.response(accept_encoding)
+            # the other request failed, did not finish in time, or the
+            # feed is too large to be cached
+            return stream_response(render(), accept_encoding)
+
+        try:
+            response = render()
+            if response.status_code != 200:
+                return response
+            if response.streaming:
+                content = _read(response, self.max_bytes)
+                if content is None:
+                    # too large, sent while it is rendered
+                    with self._lock:
+                        if token == self.generation:
+                            self._too_large.add(key)
+                    return stream_response(response, accept_encoding)
+            else:
+                content = response.content
+            self.put(key, token, content, response['Content-Type'])
+        finally:
+            # the waiting requests do not wait for the feed to be sent
+            self._rendered(key, rendering)
+
+        entry = self.get(key, token)
+        if entry is not None:
+            return entry.response(accept_encoding)
+        return HttpResponse(content, content_type=response['Content-Type'])
+
+    def _rendered(self, key, rendering):
+        with self._lock:
+            if self._renderings.get(key) is rendering:
+                del self._renderings[key]
+        rendering.set()
+
+
+def _read(response, max_bytes):
+    """
+    Return the content of a streaming response, or None if it is larger
+    than `max_bytes`, the chunks read being then put back in front of
+    the stream.
+    """
+    chunks = iter(response.streaming_content)
+    parts = []
+    size = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size > max_bytes:
+            response.streaming_content = chain(parts, chunks)
+            return None
+    return b''.join(parts)
+
+
+def stream_response(response, accept_encoding=''):
+    """
+    Compress a successful streaming response with gzip while it is
+    sent, if accepted by `accept_encoding`.
+    """
+    if response.streaming and response.status_code == 200 and \
+            'gzip' in accepted_encodings(accept_encoding):
+        response.streaming_content = gzip_chunks(response.streaming_content)
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+
+cache = FeedCache(FEED_CACHE_BYTES)
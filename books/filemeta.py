@@ -0,0 +1,143 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Metadata of the book and cover files, read once when a file is added
+and stored on the Book, so the feeds and the book pages are rendered
+without touching the files: the size and the MIME type of the book
+file, checked against its first bytes, and the MIME type and size in
+pixels of the cover, read from the image header.
+"""
+
+import mimetypes
+import struct
+import zipfile
+from contextlib import contextmanager
+
+# Bytes read to recognize a file, and the size of an image:
+HEADER_SIZE = 32
+# Bytes of a JPEG file searched for the frame header giving its size:
+JPEG_SCAN_SIZE = 256 * 1024
+
+_MAGIC = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+)
+
+# JPEG start of frame markers, giving the size of the image
+_SOF_MARKERS = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+
+
+@contextmanager
+def _opened(field_file):
+    """
+    Open a FieldFile at its start, and close it afterwards unless it
+    was already open, in which case it is rewound.
+    """
+    was_closed = field_file.closed
+    field_file.open('rb')
+    try:
+        field_file.seek(0)
+        yield field_file
+    finally:
+        if was_closed:
+            field_file.close()
+        else:
+            field_file.seek(0)
+
+
+def _sniff(header):
+    for magic, mimetype in _MAGIC:
+        if header.startswith(magic):
+            return mimetype
+    return None
+
+
+def _zip_mimetype(field_file):
+    """Return the content of the mimetype entry of a zip (EPUB) file."""
+    try:
+        with zipfile.ZipFile(field_file) as archive:
+            if 'mimetype' in archive.namelist():
+                return archive.read('mimetype').decode(
+                    'ascii', 'replace').strip() or None
+    except zipfile.BadZipfile:
+        pass
+    return None
+
+
+def book_metadata(field_file):
+    """
+    Return the {'file_size', 'mimetype'} of a book file.  The MIME type
+    is None if the content is not recognized nor the file extension.
+    """
+    with _opened(field_file):
+        header = field_file.read(HEADER_SIZE)
+        mimetype = _sniff(header)
+        if header.startswith(b'PK\x03\x04'):
+            field_file.seek(0)
+            mimetype = _zip_mimetype(field_file)
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(field_file.name)[0]
+    return {'file_size': field_file.size, 'mimetype': mimetype}
+
+
+def _jpeg_size(data):
+    data = bytearray(data)
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xff:
+            return None
+        marker = data[i + 1]
+        if marker == 0xff:
+            # padding
+            i += 1
+            continue
+        if marker in _SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        i += 2 + length
+    return None
+
+
+def image_size(mimetype, data):
+    """Return the (width, height) of an image from its first bytes."""
+    if mimetype == 'image/png' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    if mimetype == 'image/gif' and len(data) >= 10:
+        return struct.unpack('<HH', data[6:10])
+    if mimetype == 'image/jpeg':
+        return _jpeg_size(data)
+    return None
+
+
+def cover_metadata(field_file):
+    """
+    Return the {'cover_mimetype', 'cover_width', 'cover_height'} of a
+    cover image, the size None if it cannot be read.
+    """
+    with _opened(field_file):
+        data = field_file.read(JPEG_SCAN_SIZE)
+    mimetype = _sniff(data[:HEADER_SIZE]) \
+        or mimetypes.guess_type(field_file.name)[0] or ''
+    width, height = image_size(mimetype, data) or (None, None)
+    return {'cover_mimetype': mimetype, 'cover_width': width,
+            'cover_height': height}
+
+
+def no_cover():
+    return {'cover_mimetype': '', 'cover_width': None, 'cover_height': None}
@@ -0,0 +1,70 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Per-process caches of the serialized Atom entries and OPDS 2.0
+publications of the books.
+
+An entry only depends on the fields of its book, its author name and
+its language code, so it is kept with the `a_updated` date of the book
+and reused until the book is saved again.  Renaming an author or
+changing a language code touches the `a_updated` date of their books
+(see books.signals), so the entries are never stale, even in another
+process.
+"""
+
+import threading
+from collections import OrderedDict
+
+from books.app_settings import ENTRY_CACHE_SIZE
+
+
+class EntryCache(object):
+    def __init__(self, size):
+        self.size = size
+        # book id -> (a_updated, fragment)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, pk, updated):
+        """Return the fragment of the book `pk` saved at `updated`."""
+        with self._lock:
+            entry = self._entries.get(pk)
+            if entry is None or entry[0] != updated:
+                return None
+            self._entries.move_to_end(pk)
+            return entry[1]
+
+    def put(self, pk, updated, fragment):
+        with self._lock:
+            self._entries[pk] = (updated, fragment)
+            self._entries.move_to_end(pk)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return fragment
+
+    def forget(self, pk):
+        with self._lock:
+            self._entries.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+entries = EntryCache(ENTRY_CACHE_SIZE)
+publications = EntryCache(ENTRY_CACHE_SIZE)
@@ -0,0 +1,197 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+SQLite FTS5 full-text index over the searchable fields of the books.
+
+The index is a FTS5 virtual table whose rowid is the book
+primary key.  It is created by a migration when the database backend
+supports it, and kept in sync from the model signals (see
+books.signals).  When the table is not available, callers must fall
+back to the LIKE based search.
+"""
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'books_book_fts'
+
+# Indexed columns, in table order:
+FTS_COLUMNS = ('a_title', 'a_author', 'dc_publisher', 'dc_identifier',
+               'a_summary')
+
+# bm25() weights for FTS_COLUMNS: a match in the title is worth more
+# than a match in the summary.
+FTS_WEIGHTS = (10.0, 5.0, 2.0, 2.0, 1.0)
+
+_available = {}
+
+
+def create_table_sql():
+    return ("CREATE VIRTUAL TABLE %s USING fts5(%s, "
+            "tokenize='unicode61 remove_diacritics 1')" %
+            (FTS_TABLE, ', '.join(FTS_COLUMNS)))
+
+
+def backend_supports_fts(conn):
+    """Return True if the database behind `conn` can host the index."""
+    if conn.vendor != 'sqlite':
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        options = [row[0] for row in cursor.fetchall()]
+    return 'ENABLE_FTS5' in options
+
+
+def table_exists(table):
+    """
+    Return True if the full-text `table` exists in the database.
+
+    The result is cached per process, call reset() after creating or
+    dropping the table.
+    """
+    key = (connection.alias, table)
+    if key not in _available:
+        if connection.vendor != 'sqlite':
+            _available[key] = False
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master "
+                               "WHERE type = 'table' AND name = %s",
+                               [table])
+                _available[key] = cursor.fetchone() is not None
+    return _available[key]
+
+
+def is_available():
+    """Return True if the full-text table of the books exists."""
+    return table_exists(FTS_TABLE)
+
+
+def reset():
+    _available.clear()
+
+
+def _book_row(book):
+    return [book.pk, book.a_title, book.a_author.a_author,
+            book.dc_publisher, book.dc_identifier, book.a_summary]
+
+
+def index_book(book):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE,
+                       [book.pk])
+        cursor.execute('INSERT INTO %s (rowid, %s) VALUES (%s)' %
+                       (FTS_TABLE, ', '.join(FTS_COLUMNS),
+                        ', '.join(['%s'] * (len(FTS_COLUMNS) + 1))),
+                       _book_row(book))
+
+
+def unindex_book(book_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE,
+                       [book_id])
+
+
+def reindex_author(author):
+    """The author name is denormalized in the index, refresh it."""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('UPDATE %s SET a_author = %%s WHERE rowid IN '
+                       '(SELECT id FROM books_book WHERE a_author_id = %%s)'
+                       % FTS_TABLE, [author.a_author, author.pk])
+
+
+def populate(cursor):
+    cursor.execute(
+        'INSERT INTO %s (rowid, %s) '
+        'SELECT b.id, b.a_title, a.a_author, b.dc_publisher, '
+        'b.dc_identifier, b.a_summary '
+        'FROM books_book b INNER JOIN books_author a ON a.id = b.a_author_id'
+        % (FTS_TABLE, ', '.join(FTS_COLUMNS)))
+
+
+def rebuild():
+    """
+    Drop and fill again the index from the books table.
+
+    Returns False if the database cannot host the index.
+    """
+    if not backend_supports_fts(connection):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+        cursor.execute(create_table_sql())
+        populate(cursor)
+    reset()
+    return True
+
+
+def quote_term(term):
+    """Quote a user term as a FTS5 prefix string."""
+    return '"%s"*' % term.replace('"', '""')
+
+
+def match_expression(terms, columns=None):
+    """
+    Build a FTS5 MATCH expression requiring every term, as a prefix,
+    in any of `columns` (all the columns if None).
+
+    Returns None if there is nothing to match.
+    """
+    terms = [quote_term(term) for term in terms if term.strip()]
+    if not terms:
+        return None
+    expression = ' '.join(terms)
+    if columns:
+        expression = '{%s} : (%s)' % (' '.join(columns), expression)
+    return expression
+
+
+class RowidSubquery(RawSQL):
+    """
+    A raw subquery usable as the right hand side of an `__in` lookup.
+
+    The `in` lookup already wraps its right hand side in parenthesis,
+    with RawSQL it would end up as `IN ((SELECT ...))`, which SQLite
+    reads as a single scalar value.
+    """
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def filter_queryset(queryset, expression, ranked=False):
+    """
+    Restrict a Book queryset to the rows matching `expression`.
+
+    If `ranked` is True, the rows get a `search_rank` attribute (lower
+    is better) and are ordered by it.
+    """
+    queryset = queryset.filter(pk__in=RowidSubquery(
+        'SELECT rowid FROM %s WHERE %s MATCH %%s' % (FTS_TABLE, FTS_TABLE),
+        [expression]))
+    if ranked:
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        rank = RawSQL(
+            'SELECT bm25(%s, %s) FROM %s WHERE %s MATCH %%s '
+            'AND rowid = %s.id' % (FTS_TABLE, weights, FTS_TABLE, FTS_TABLE,
+                                   queryset.model._meta.db_table),
+            [expression])
+        queryset = queryset.annotate(search_rank=rank).order_by('search_rank')
+    return queryset
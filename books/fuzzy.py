@@ -0,0 +1,132 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Trigram index of the book titles and author names, for the searches
+which find nothing because of a misspelling.
+
+Each normalized word is padded ('  lovecraft ') and cut in trigrams
+('  l', ' lo', 'lov', ...).  The similarity of two texts is the number
+of trigrams they share divided by the number of distinct trigrams of
+both.  The Trigram table holds one row per trigram of each title or
+name; candidates are found from the rows of the trigrams of the query,
+with enough of them in common to reach the minimum similarity.
+"""
+
+import math
+
+from django.db.models import Count, Max
+
+from books.app_settings import FUZZY_SIMILARITY
+from books.models import Author, Book, Trigram
+from books.normalize import words
+
+KINDS = ('book', 'author')
+
+# Number of titles and names, sharing the most trigrams with the query,
+# whose similarity is computed.
+MAX_CANDIDATES = 200
+
+
+def trigrams(text):
+    """Return the set of trigrams of the words of `text`."""
+    result = set()
+    for word in words(text):
+        padded = '  %s ' % word
+        for i in range(len(padded) - 2):
+            result.add(padded[i:i + 3])
+    return result
+
+
+def rows(model, kind, pk, text):
+    """Return the unsaved `model` rows indexing `text`."""
+    text_trigrams = trigrams(text)
+    return [model(trigram=trigram, kind=kind, object_id=pk,
+                  total=len(text_trigrams))
+            for trigram in text_trigrams]
+
+
+def index(kind, pk, text):
+    unindex(kind, pk)
+    Trigram.objects.bulk_create(rows(Trigram, kind, pk, text))
+
+
+def unindex(kind, pk):
+    Trigram.objects.filter(kind=kind, object_id=pk).delete()
+
+
+def similar(text, kinds=KINDS, minimum=None):
+    """
+    Return the (kind, pk, similarity) of the titles and names similar
+    to `text`, the most similar first.
+    """
+    if minimum is None:
+        minimum = FUZZY_SIMILARITY
+    text_trigrams = trigrams(text)
+    if not text_trigrams:
+        return []
+    # the similarity cannot reach `minimum` with fewer shared trigrams
+    shared_minimum = max(1, int(math.ceil(minimum * len(text_trigrams))))
+    candidates = Trigram.objects.filter(
+        trigram__in=text_trigrams, kind__in=kinds,
+    ).values_list('kind', 'object_id').annotate(
+        shared=Count('pk'), total=Max('total'),
+    ).filter(shared__gte=shared_minimum).order_by('-shared')[:MAX_CANDIDATES]
+
+    results = []
+    for kind, pk, shared, total in candidates:
+        similarity = shared / (len(text_trigrams) + total - shared)
+        if similarity >= minimum:
+            results.append((kind, pk, similarity))
+    results.sort(key=lambda result: -result[2])
+    return results
+
+
+def similar_books(queryset, text, kinds=KINDS):
+    """
+    Return the ids of the books of `queryset` whose title, or author
+    name, is similar to `text`, the most similar first.
+    """
+    scores = {}
+    authors = {}
+    for kind, pk, similarity in similar(text, kinds):
+        if kind == 'book':
+            scores[pk] = similarity
+        else:
+            authors[pk] = similarity
+    if authors:
+        for pk, author in queryset.filter(a_author__in=list(authors)) \
+                .values_list('pk', 'a_author'):
+            scores[pk] = max(scores.get(pk, 0), authors[author])
+    ids = queryset.filter(pk__in=list(scores)).values_list('pk', flat=True)
+    return sorted(ids, key=lambda pk: (-scores[pk], pk))
+
+
+def populate(trigram_model, book_model, author_model):
+    """Index the titles and names, models are given for the migrations."""
+    for kind, model, field in (('book', book_model, 'a_title'),
+                               ('author', author_model, 'a_author')):
+        batch = []
+        for pk, text in model.objects.values_list('pk', field).iterator():
+            batch.extend(rows(trigram_model, kind, pk, text))
+            if len(batch) >= 1000:
+                trigram_model.objects.bulk_create(batch)
+                batch = []
+        trigram_model.objects.bulk_create(batch)
+
+
+def rebuild():
+    """Fill again the index from the books and authors tables."""
+    Trigram.objects.all().delete()
+    populate(Trigram, Book, Author)
@@ -0,0 +1,135 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Catalogue generation: an opaque token, stored in the database, which
+changes on every change of the books, authors or tags.
+
+A process keeping an in-memory structure derived from the catalogue
+remembers the generation it was built for.  When it applies a change
+itself, it moves its structure to the new generation if, and only if,
+its structure was in sync just before the change (see bump()).  Any
+other mismatch means another process, or a rolled back transaction,
+changed the catalogue: the structure must be rebuilt.
+
+Random tokens are used rather than a counter so a value is never seen
+twice, even after a rollback.
+"""
+
+import threading
+import uuid
+
+from django.db.models import F
+from django.utils import timezone
+
+from books.models import CatalogState
+
+
+def current():
+    """Return the current generation token."""
+    try:
+        return CatalogState.objects.values_list(
+            'generation', flat=True).get(pk=1)
+    except CatalogState.DoesNotExist:
+        state = CatalogState.objects.create(pk=1,
+                                            generation=uuid.uuid4().hex)
+        return state.generation
+
+
+def state():
+    """Return the (generation, updated, downloads) of the catalogue."""
+    try:
+        return CatalogState.objects.values_list(
+            'generation', 'updated', 'downloads').get(pk=1)
+    except CatalogState.DoesNotExist:
+        current()
+        return state()
+
+
+def bump():
+    """
+    Record a change of the catalogue.
+
+    Returns (previous, new): the generation the change was applied on
+    and the new generation.  `previous` is None when another process
+    changed the generation concurrently.
+    """
+    previous = current()
+    new = uuid.uuid4().hex
+    now = timezone.now()
+    updated = CatalogState.objects.filter(
+        pk=1, generation=previous).update(generation=new, updated=now)
+    if not updated:
+        CatalogState.objects.filter(pk=1).update(generation=new, updated=now)
+        previous = None
+    return previous, new
+
+
+def count_download():
+    """Record a download, for the validators of the popularity feed."""
+    CatalogState.objects.filter(pk=1).update(downloads=F('downloads') + 1)
+
+
+class OutOfSync(Exception):
+    """
+    Raised by a change which cannot be applied to a structure, which is
+    then rebuilt (see LocalIndex.apply).
+    """
+
+
+class LocalIndex(object):
+    """
+    Holder of a per-process structure derived from the catalogue.
+
+    `build` is called to (re)build the structure when it is first
+    needed or out of date.  Readers and writers of the structure must
+    hold `lock`.
+    """
+    def __init__(self, build):
+        self.build = build
+        self.lock = threading.Lock()
+        self._index = None
+        self._generation = None
+
+    def get(self):
+        """Return the structure, rebuilt if the catalogue changed."""
+        token = current()
+        with self.lock:
+            if self._index is None or self._generation != token:
+                self._index = self.build()
+                self._generation = token
+            return self._index
+
+    def reset(self):
+        with self.lock:
+            self._index = None
+
+    def apply(self, previous, new, change):
+        """
+        Call `change(structure)` for a change of the catalogue from the
+        generation `previous` to `new` (see bump()), or drop the
+        structure if it was not in sync or `change` raised OutOfSync.
+        """
+        with self.lock:
+            if self._index is None:
+                return
+            if previous is not None and self._generation == previous:
+                try:
+                    change(self._index)
+                except OutOfSync:
+                    self._index = None
+                    return
+                self._generation = new
+            else:
+                self._index = None
@@ -4,6 +4,7 @@ from django.db.utils import IntegrityError
 
 import os
 
+from books import booktext
 from books.models import Language, Book, Status, Author, sha256_sum
 from books.epub import Epub
 from books.langlist import langs
@@ -36,6 +37,12 @@ class Command(BaseCommand):
                             dest='ignore_tags',
                             default=False,
                             help='Ignore tags from EPUB file')
+        parser.add_argument('--no-text',
+                            action='store_true',
+                            dest='no_text',
+                            default=False,
+                            help='Do not index the text of the books, '
+                            'see the index_book_text command')
         parser.add_argument('path', help='PATH')
 
     def handle(self, *args, **options):
@@ -113,6 +120,8 @@ class Command(BaseCommand):
                 book.book_file.save(os.path.basename(name), File(f))
                 book.validate_unique()
                 book.save()
+                if not options['no_text']:
+                    booktext.index_book(book)
                 if not options['ignore_tags']:
                     book.tags.add(*info.subject)
             except IntegrityError as e:
@@ -0,0 +1,38 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from django.core.management.base import BaseCommand
+
+from books import benchmark
+
+
+class Command(BaseCommand):
+    help = ("Measure the entries written per second by each XML writer of "
+            "the OPDS feeds, and print a JSON report")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=1000,
+                            help='Number of entries of the feed '
+                            '(default: 1000)')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of runs of each writer, the best '
+                            'one is reported (default: 5)')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the entries')
+
+    def handle(self, *args, **options):
+        report = benchmark.run_writers(entries=options['entries'],
+                                       repeat=options['repeat'],
+                                       seed=options['seed'])
+        self.stdout.write(benchmark.dumps(report))
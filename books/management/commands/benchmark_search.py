@@ -0,0 +1,80 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment
+from django.test.utils import teardown_test_environment
+
+from books import benchmark
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the searches on a synthetic catalogue, created in "
+            "a test database, and print a JSON report")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=100000,
+                            help='Number of books (default: 100000)')
+        parser.add_argument('--authors', type=int, default=5000,
+                            help='Number of authors (default: 5000)')
+        parser.add_argument('--tags', type=int, default=500,
+                            help='Number of tags (default: 500)')
+        parser.add_argument('--queries', type=int, default=1000,
+                            help='Number of searches (default: 1000)')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the corpus and of the searches')
+        parser.add_argument('--no-cache', action='store_true',
+                            dest='no_cache', default=False,
+                            help='Clear the search results cache before '
+                            'each search')
+        parser.add_argument('--output',
+                            help='Also write the report to this file')
+        parser.add_argument('--baseline',
+                            help='Report to compare with')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            start = time.time()
+            corpus = benchmark.generate_corpus(
+                books=options['books'], authors=options['authors'],
+                tags=options['tags'], seed=options['seed'])
+            corpus['generation_s'] = round(time.time() - start, 1)
+
+            queries = benchmark.make_queries(options['queries'],
+                                             seed=options['seed'])
+            report = benchmark.run_queries(
+                queries, use_cache=not options['no_cache'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report['corpus'] = corpus
+        report['cache'] = not options['no_cache']
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                report['baseline_ratio'] = benchmark.compare(
+                    report, json.load(baseline))
+
+        output = benchmark.dumps(report)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+        self.stdout.write(output)
@@ -0,0 +1,50 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books import mirror
+
+
+class Command(BaseCommand):
+    help = ("Export the public catalogue (OPDS feeds, HTML pages, covers "
+            "and books) as static files to a directory.  Only the pages "
+            "changed since the previous export are rendered again")
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory',
+                            help='Directory of the mirror')
+        parser.add_argument('--processes', type=int,
+                            default=os.cpu_count() or 1,
+                            help='Number of rendering processes '
+                            '(default: number of CPUs)')
+        parser.add_argument('--full', action='store_true',
+                            help='Render all the pages')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError('--processes must be at least 1')
+        stats, errors = mirror.export(options['directory'],
+                                      processes=options['processes'],
+                                      full=options['full'])
+        for url, status in errors:
+            self.stderr.write('%s: HTTP %d' % (url, status))
+        self.stdout.write(
+            '%(rendered)d of %(pages)d pages rendered, %(copied)d of '
+            '%(files)d files copied, %(removed)d files removed' % stats)
+        if errors:
+            raise CommandError('%d pages could not be rendered'
+                               % len(errors))
@@ -0,0 +1,96 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from books import booktext, generation
+from books.models import Book, BookText
+
+# Books read at once, before their text is indexed
+BATCH_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = ("Index the text of the EPUB books not indexed yet, can be "
+            "interrupted and run again")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild',
+                            action='store_true',
+                            dest='rebuild',
+                            default=False,
+                            help='Index again all the books')
+        parser.add_argument('--limit',
+                            type=int,
+                            dest='limit',
+                            default=None,
+                            help='Index at most LIMIT books')
+
+    def handle(self, *args, **options):
+        if not booktext.is_available():
+            self.stdout.write(
+                self.style.WARNING(
+                    "Full-text search is not supported by the database, "
+                    "the text of the books cannot be indexed"))
+            return
+
+        if options['rebuild']:
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM %s' % booktext.TEXT_TABLE)
+            BookText.objects.all().delete()
+
+        pending = booktext.pending_books(Book.objects.order_by('pk'))
+        limit = options['limit']
+
+        indexed = 0
+        last_pk = 0
+        while limit is None or limit > 0:
+            # the books are read by batches rather than with an open
+            # cursor, which would see the rows written meanwhile
+            size = BATCH_SIZE if limit is None else min(limit, BATCH_SIZE)
+            books = list(pending.filter(pk__gt=last_pk)[:size])
+            if not books:
+                break
+            last_pk = books[-1].pk
+            if limit is not None:
+                limit -= len(books)
+            indexed += self.index_books(books)
+
+        if indexed:
+            # cached search results are out of date
+            generation.bump()
+        self.stdout.write("{0} books indexed".format(indexed))
+
+    def index_books(self, books):
+        """Index the text of `books`, return the number indexed."""
+        indexed = 0
+        for book in books:
+            try:
+                chunks = booktext.index_book(book)
+            except Exception as e:
+                self.stdout.write(
+                    self.style.WARNING(
+                        "The text of {0} was not indexed: {1}".format(
+                            book.book_file, str(e))))
+                # do not try again on next run, see --rebuild
+                BookText.objects.update_or_create(
+                    book=book,
+                    defaults={'file_sha256sum': book.file_sha256sum,
+                              'chunks': 0})
+                continue
+            indexed += 1
+            self.stdout.write("Indexed {0} ({1} chunks)".format(
+                book.a_title, chunks))
+        return indexed
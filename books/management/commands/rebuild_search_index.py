@@ -0,0 +1,41 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from django.core.management.base import BaseCommand
+
+from books import authors, fulltext, fuzzy, generation, tagcounts
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the search indexes, and the author and tag "
+            "summaries, from the books table")
+
+    def handle(self, *args, **options):
+        if fulltext.rebuild():
+            self.stdout.write("Full-text index rebuilt")
+        else:
+            self.stdout.write(
+                self.style.WARNING(
+                    "Full-text search is not supported by the database, "
+                    "search will use LIKE queries"))
+
+        fuzzy.rebuild()
+        self.stdout.write("Trigram index rebuilt")
+
+        authors.rebuild()
+        tagcounts.rebuild()
+        self.stdout.write("Author and tag summaries rebuilt")
+
+        # Running servers rebuild their in-memory indexes on next use:
+        generation.bump()
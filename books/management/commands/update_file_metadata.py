@@ -0,0 +1,67 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from books import authors, filemeta, generation
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = ("Store the size and MIME type of the book files and the size "
+            "of the covers, for the books added before they were stored")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all',
+                            action='store_true',
+                            dest='all',
+                            default=False,
+                            help='Read again the files of all the books')
+
+    def handle(self, *args, **options):
+        books = Book.objects.order_by('pk')
+        if not options['all']:
+            books = books.filter(file_size__isnull=True)
+
+        updated = 0
+        author_ids = set()
+        for book in books.iterator():
+            try:
+                fields = filemeta.book_metadata(book.book_file)
+                if book.cover_img:
+                    fields.update(filemeta.cover_metadata(book.cover_img))
+                else:
+                    fields.update(filemeta.no_cover())
+            except (IOError, OSError) as e:
+                self.stdout.write(
+                    self.style.WARNING(
+                        "The files of {0} cannot be read: {1}".format(
+                            book.a_title, str(e))))
+                continue
+            if fields['mimetype'] is None:
+                del fields['mimetype']
+            # an UPDATE rather than save() so the signals do not refresh
+            # the indexes, but a_updated so the cached entries are
+            # written again
+            Book.objects.filter(pk=book.pk).update(a_updated=timezone.now(),
+                                                   **fields)
+            author_ids.add(book.a_author_id)
+            updated += 1
+
+        if updated:
+            # the entry dates of the authors follow a_updated
+            authors.refresh(author_ids)
+            generation.bump()
+        self.stdout.write("{0} books updated".format(updated))
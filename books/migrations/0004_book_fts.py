@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from books import fulltext
+
+
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if not fulltext.backend_supports_fts(connection):
+        # search falls back to LIKE queries
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(fulltext.create_table_sql())
+        fulltext.populate(cursor)
+    fulltext.reset()
+
+
+def drop_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS %s' % fulltext.FTS_TABLE)
+    fulltext.reset()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_taggroup_tags'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
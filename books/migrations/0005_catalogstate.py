@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import uuid
+
+from django.db import migrations, models
+
+
+def catalogstate_insert_row(apps, schema_editor):
+    CatalogState = apps.get_model("books", "CatalogState")
+    db_alias = schema_editor.connection.alias
+    CatalogState.objects.using(db_alias).create(
+        pk=1, generation=uuid.uuid4().hex)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.CharField(max_length=32)),
+            ],
+        ),
+        migrations.RunPython(catalogstate_insert_row,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 15:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from books import booktext, fulltext
+
+
+def create_text_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if not fulltext.backend_supports_fts(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(booktext.create_table_sql())
+    fulltext.reset()
+
+
+def drop_text_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS %s' % booktext.TEXT_TABLE)
+    fulltext.reset()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_catalogstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookText',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='text_index', serialize=False, to='books.Book')),
+                ('file_sha256sum', models.CharField(max_length=64)),
+                ('chunks', models.PositiveIntegerField(default=0)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_text_table, drop_text_table),
+    ]
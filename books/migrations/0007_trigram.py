@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 15:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from books import fuzzy
+
+
+def trigram_populate(apps, schema_editor):
+    fuzzy.populate(apps.get_model('books', 'Trigram'),
+                   apps.get_model('books', 'Book'),
+                   apps.get_model('books', 'Author'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_booktext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Trigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(db_index=True, max_length=3)),
+                ('kind', models.CharField(max_length=6)),
+                ('object_id', models.PositiveIntegerField()),
+                ('total', models.PositiveSmallIntegerField()),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='trigram',
+            index_together=set([('kind', 'object_id')]),
+        ),
+        migrations.RunPython(trigram_populate, migrations.RunPython.noop),
+    ]
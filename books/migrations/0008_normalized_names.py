@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 15:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from books.normalize import normalize_text
+
+
+def normalized_names_backfill(apps, schema_editor):
+    for model_name, field in (('Book', 'a_title'), ('Author', 'a_author')):
+        model = apps.get_model('books', model_name)
+        for pk, text in model.objects.values_list('pk', field).iterator():
+            model.objects.filter(pk=pk).update(
+                **{field + '_normalized': normalize_text(text)[:255]})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_trigram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='a_author_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='a_title_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(normalized_names_backfill,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 15:55
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_catalogstate_validators'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='book',
+            index_together=set([('time_added', 'id'), ('downloads', 'id'), ('a_title', 'id')]),
+        ),
+    ]
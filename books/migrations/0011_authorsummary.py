@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 15:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from books import authors
+
+
+def author_summaries_backfill(apps, schema_editor):
+    authors.build(apps.get_model('books', 'Author'),
+                  apps.get_model('books', 'Book'),
+                  apps.get_model('books', 'AuthorSummary'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_book_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorSummary',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='books.Author')),
+                ('sort_key', models.CharField(default='', max_length=255)),
+                ('published_books', models.PositiveIntegerField(default=0)),
+                ('total_books', models.PositiveIntegerField(default=0)),
+                ('updated', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='authorsummary',
+            index_together=set([('sort_key', 'author')]),
+        ),
+        migrations.RunPython(author_summaries_backfill,
+                             migrations.RunPython.noop),
+    ]
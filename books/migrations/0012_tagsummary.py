@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 16:01
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from books import tagcounts
+
+
+def tag_summaries_backfill(apps, schema_editor):
+    content_type = apps.get_model('contenttypes', 'ContentType')
+    tagcounts.build(apps.get_model('taggit', 'Tag'),
+                    apps.get_model('books', 'Book'),
+                    apps.get_model('taggit', 'TaggedItem'),
+                    content_type.objects.filter(app_label='books',
+                                                model='book').first(),
+                    apps.get_model('books', 'TagSummary'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0002_auto_20150616_2121'),
+        ('books', '0011_authorsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagSummary',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='taggit.Tag')),
+                ('sort_key', models.CharField(default='', max_length=255)),
+                ('published_books', models.PositiveIntegerField(default=0)),
+                ('total_books', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='tagsummary',
+            index_together=set([('published_books', 'tag'), ('total_books', 'tag'), ('sort_key', 'tag')]),
+        ),
+        migrations.RunPython(tag_summaries_backfill,
+                             migrations.RunPython.noop),
+    ]
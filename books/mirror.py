@@ -0,0 +1,403 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Static mirror of the public catalogue: the OPDS feeds (Atom and JSON),
+the HTML lists and book pages, the covers and the book files, written
+to a directory any static file server, or a USB stick, can serve.
+
+The pages are rendered by the views, their links to the other pages
+of the mirror rewritten to relative file paths.  Each page has a
+signature computed from the database: the books it lists with their
+`a_updated` date and tags, the authors, the tags.  A new export only
+renders the pages whose signature changed since the previous one,
+recorded in the STATE_FILE of the directory, and removes the pages
+which are gone.  See the export_mirror command.
+"""
+
+import hashlib
+import html
+import json
+import multiprocessing
+import os
+import re
+import shutil
+from urllib.parse import quote, unquote, urljoin, urlsplit
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+
+from taggit.models import TaggedItem
+
+from books import navfeeds, views
+from books.app_settings import BOOK_PUBLISHED
+from books.facets import book_counts
+from books.models import AuthorSummary, Book, TagGroup, TagSummary
+
+STATE_FILE = '.pathagar-mirror.json'
+
+# the pages are rendered by the test client, with absolute links to:
+SERVER = 'http://testserver'
+
+# (HTML, Atom, JSON) url names of the book lists
+LATEST = ('latest', 'latest_feed', 'latest_json')
+BY_TITLE = ('by_title', 'by_title_feed', 'by_title_json')
+MOST_DOWNLOADED = ('most_downloaded', 'most_downloaded_feed',
+                   'most_downloaded_json')
+BY_TAG = ('by_tag', 'by_tag_feed', 'by_tag_json')
+AUTHOR_BOOKS = ('books_by_author', 'by_title_author_feed',
+                'by_title_author_json')
+BY_AUTHOR = ('by_author', 'by_author_feed', 'by_author_json')
+TAGS = ('tags', 'tags_feed', 'tags_json')
+GROUP_TAGS = ('tag_groups', 'tag_groups_feed', 'tag_groups_json')
+
+_LINK = re.compile(r'''((?:href|src)=)(["'])(.*?)\2|("href":)"(.*?)"''')
+
+
+def _digest(signature):
+    return hashlib.sha1(json.dumps(signature, sort_keys=True).encode(
+        'utf-8')).hexdigest()
+
+
+def _page_url(url, number):
+    # numbered, even the first one: the first page of a feed is
+    # otherwise linked to the next ones by cursor (see books.pagination)
+    return '%s?page=%d' % (url, number)
+
+
+def _file_path(url):
+    """
+    Return the path in the mirror of a page URL, or None if it would
+    be outside the mirror.
+    """
+    parts = urlsplit(url)
+    path = unquote(parts.path)
+    if path.endswith('/'):
+        base, ext = path + 'index', '.html'
+    else:
+        base, ext = os.path.splitext(path)
+        if ext not in ('.atom', '.json'):
+            base, ext = path, '.html'
+    if parts.query and parts.query != 'page=1':
+        base += '-' + parts.query.replace('=', '')
+    return _safe_path(base + ext)
+
+
+def _safe_path(path):
+    path = os.path.normpath(path.lstrip('/'))
+    if path.startswith('..') or os.path.isabs(path):
+        return None
+    return path
+
+
+class Plan(object):
+    """
+    The pages and files of the mirror: URL -> (path in the mirror,
+    signature) for the pages, URL -> (path, source file) for the files.
+    """
+    def __init__(self):
+        self.pages = {}
+        self.files = {}
+        # other URLs of the pages
+        self.aliases = {}
+
+    def add_page(self, url, signature):
+        path = _file_path(url)
+        if path is not None:
+            self.pages[url] = (path, _digest(signature))
+        return path
+
+    def add_file(self, url, path, source):
+        path = _safe_path(path)
+        if path is not None and os.path.exists(source):
+            self.files[url] = (path, source)
+
+    def add_list(self, names, kwargs, ids, signatures, per_page, html_extra):
+        """
+        Add the pages of a book or author list, in the three formats.
+        `ids` are the listed objects in order, `signatures` their
+        signatures by id; the HTML pages also show `html_extra`.
+        """
+        pages = max(1, (len(ids) + per_page - 1) // per_page)
+        for number in range(1, pages + 1):
+            page_ids = ids[(number - 1) * per_page:number * per_page]
+            signature = [pages, [(pk, signatures[pk]) for pk in page_ids]]
+            for i, name in enumerate(names):
+                url = reverse(name, kwargs=kwargs)
+                path = self.add_page(_page_url(url, number),
+                                     signature + [html_extra] if i == 0
+                                     else signature)
+                if number == 1 and path is not None:
+                    self.aliases[url] = path
+
+    def link_map(self):
+        links = {url: path for url, (path, signature) in self.pages.items()}
+        links.update((url, path) for url, (path, source)
+                     in self.files.items())
+        links.update(self.aliases)
+        return links
+
+
+def make_plan():
+    """Return the Plan of the public catalogue."""
+    plan = Plan()
+    per_page = views.BOOKS_PER_PAGE
+    books = Book.objects.filter(a_status=BOOK_PUBLISHED)
+
+    tags = {}
+    for pk, name in TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Book)
+    ).values_list('object_id', 'tag__name'):
+        tags.setdefault(pk, []).append(name)
+    signatures = {}
+    for book in books.select_related('a_author'):
+        signatures[book.pk] = [book.a_updated.isoformat(),
+                               sorted(tags.get(book.pk, []))]
+        plan.add_page(reverse('book_detail', kwargs=dict(pk=book.pk)),
+                      signatures[book.pk])
+        download = reverse('book_download', kwargs=dict(book_id=book.pk))
+        ext = os.path.splitext(book.book_file.name)[1]
+        plan.add_file(download, download.lstrip('/') + ext,
+                      book.book_file.path)
+        if book.cover_img:
+            plan.add_file(book.cover_img.url, unquote(book.cover_img.url),
+                          book.cover_img.path)
+    counts = list(book_counts())
+
+    def ids(queryset):
+        return list(queryset.values_list('pk', flat=True))
+
+    latest = views.KEYSET_ORDERINGS['latest']
+    plan.add_list(LATEST, {}, ids(books.order_by(*latest)), signatures,
+                  per_page, counts)
+    plan.add_list(BY_TITLE, {}, ids(books.order_by('a_title')), signatures,
+                  per_page, counts)
+    plan.add_list(MOST_DOWNLOADED, {}, ids(books.order_by('-downloads')),
+                  signatures, per_page, counts)
+
+    dates = navfeeds.dates()
+    tags = {}
+    for summary in TagSummary.objects.filter(
+            published_books__gt=0).select_related('tag').order_by(
+                *views.TAG_ORDERINGS['name', False]):
+        name = summary.tag.name
+        tags[summary.pk] = [name, summary.published_books,
+                            dates.tag(name).isoformat()]
+        plan.add_list(BY_TAG, {'tag': name},
+                      ids(books.filter(tags__name=name).order_by(*latest)),
+                      signatures, per_page, counts)
+
+    authors = {}
+    for summary in AuthorSummary.objects.filter(
+            published_books__gt=0).select_related('author').order_by(
+                'sort_key', 'pk'):
+        authors[summary.pk] = [summary.author.a_author,
+                               summary.published_books,
+                               summary.updated.isoformat()]
+        plan.add_list(AUTHOR_BOOKS, {'author_id': summary.pk},
+                      ids(books.filter(a_author=summary.pk).order_by(
+                          'a_title')),
+                      signatures, per_page, counts)
+    plan.add_list(BY_AUTHOR, {}, list(authors), authors,
+                  views.AUTHORS_PER_PAGE, counts)
+
+    groups = list(TagGroup.objects.values_list('pk', 'slug', 'name'))
+    plan.add_list(TAGS, {}, list(tags), tags, views.TAGS_PER_PAGE, groups)
+    group_tags = {}
+    for group, tag in TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(TagGroup)
+    ).values_list('object_id', 'tag'):
+        group_tags.setdefault(group, set()).add(tag)
+    for pk, slug, group_name in groups:
+        plan.add_list(GROUP_TAGS, {'group_slug': slug},
+                      [tag for tag in tags if tag in group_tags.get(pk, ())],
+                      tags, views.TAGS_PER_PAGE, [group_name, groups])
+
+    root = [dates.books.isoformat(), dates.tags_newest.isoformat(),
+            dates.groups_newest.isoformat()]
+    for name in ('root_feed', 'root_json'):
+        plan.add_page(reverse(name), root)
+    plan.add_page(reverse('complete_feed'), sorted(signatures.items()))
+    for name in ('tags_listgroups', 'tags_listgroups_json'):
+        plan.add_page(reverse(name), [groups, root,
+                                      [dates.group(slug).isoformat()
+                                       for pk, slug, group_name in groups]])
+
+    for static_dir in settings.STATICFILES_DIRS:
+        for root, dirs, files in os.walk(static_dir):
+            for filename in files:
+                source = os.path.join(root, filename)
+                path = os.path.relpath(source, static_dir).replace(
+                    os.sep, '/')
+                plan.add_file(settings.STATIC_URL + path,
+                              settings.STATIC_URL.lstrip('/') + path, source)
+    return plan
+
+
+def rewrite_links(content, url, path, links):
+    """
+    Replace the links of a page at `url`, written to `path`, to the
+    pages and files of the mirror by relative links.
+    """
+    directory = os.path.dirname(path)
+
+    def replace(match):
+        if match.group(1):
+            prefix, quote_char, href = match.group(1), match.group(2), \
+                match.group(3)
+        else:
+            prefix, quote_char, href = match.group(4), '"', match.group(5)
+        target = urljoin(url, html.unescape(href))
+        if target.startswith(SERVER):
+            target = target[len(SERVER):]
+        target = links.get(target)
+        if target is None:
+            return match.group(0)
+        relative = os.path.relpath(target, directory or '.').replace(
+            os.sep, '/')
+        return '%s%s%s%s' % (prefix, quote_char, quote(relative), quote_char)
+
+    return _LINK.sub(replace, content)
+
+
+# links of the pages, set in the rendering processes
+_links = None
+
+
+def _init_worker(links):
+    global _links
+    _links = links
+
+
+def render_page(job):
+    """
+    Render the page `url` to `directory`/`path`.  Returns None, or the
+    (url, status code) of an error.
+    """
+    url, path, directory = job
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        response = Client().get(url)
+    if response.status_code != 200:
+        return url, response.status_code
+    content = response.getvalue().decode('utf-8')
+    content = rewrite_links(content, url, path, _links)
+    _write(os.path.join(directory, path), content.encode('utf-8'))
+    return None
+
+
+def _write(filename, content):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(content)
+    os.replace(temporary, filename)
+
+
+def _copy(source, filename):
+    """Copy a file unless the copy has the same size and date."""
+    try:
+        stat = os.stat(filename)
+        source_stat = os.stat(source)
+        if stat.st_size == source_stat.st_size and \
+                stat.st_mtime >= source_stat.st_mtime:
+            return False
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    shutil.copy2(source, filename)
+    return True
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def export(directory, processes=1, full=False):
+    """
+    Write the mirror of the catalogue to `directory`, rendering the
+    pages in `processes` processes.  Unless `full`, only the pages
+    changed since the previous export are rendered.  The pages and
+    files of the previous export no longer in the catalogue are removed
+    in any case.
+
+    Returns the statistics of the export and the (url, status code) of
+    the pages which could not be rendered.
+    """
+    state_file = os.path.join(directory, STATE_FILE)
+    previous = {'pages': {}, 'files': {}}
+    if os.path.exists(state_file):
+        with open(state_file) as state:
+            previous = json.load(state)
+
+    plan = make_plan()
+    jobs = []
+    for url, (path, signature) in sorted(plan.pages.items()):
+        if full or previous['pages'].get(url) != [path, signature] or \
+                not os.path.exists(os.path.join(directory, path)):
+            jobs.append((url, path, directory))
+
+    links = plan.link_map()
+    if processes > 1 and len(jobs) > 1:
+        # the processes open their own database connections
+        connections.close_all()
+        with multiprocessing.Pool(processes, _init_worker,
+                                  (links,)) as pool:
+            errors = pool.map(render_page, jobs, chunksize=16)
+    else:
+        _init_worker(links)
+        errors = [render_page(job) for job in jobs]
+    errors = [error for error in errors if error]
+
+    copied = 0
+    for url, (path, source) in plan.files.items():
+        copied += _copy(source, os.path.join(directory, path))
+
+    removed = 0
+    kept = set(path for path, signature in plan.pages.values())
+    kept.update(path for path, source in plan.files.values())
+    for old in list(previous['pages'].values()) + \
+            list(previous['files'].values()):
+        if old[0] not in kept:
+            _remove(os.path.join(directory, old[0]))
+            removed += 1
+
+    index = os.path.join(directory, 'index.html')
+    if not os.path.exists(index):
+        _write(index, b'<!DOCTYPE html><meta http-equiv="refresh" '
+               b'content="0; url=latest/index.html">')
+
+    # the pages which failed keep their previous state, to be rendered
+    # again, or removed, by the next export
+    failed = set(url for url, status in errors)
+    pages = {url: list(page) for url, page in plan.pages.items()
+             if url not in failed}
+    pages.update((url, previous['pages'][url]) for url in failed
+                 if url in previous['pages'])
+    state = {
+        'pages': pages,
+        'files': {url: [path, source] for url, (path, source)
+                  in plan.files.items()},
+    }
+    _write(state_file, json.dumps(state).encode('utf-8'))
+
+    return {'pages': len(plan.pages), 'rendered': len(jobs) - len(errors),
+            'files': len(plan.files), 'copied': copied,
+            'removed': removed}, errors
@@ -23,14 +23,18 @@ from django.core.files import File
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from django.forms.forms import NON_FIELD_ERRORS
+from django.utils import timezone
 
 from hashlib import sha256
 
 from taggit.managers import TaggableManager #NEW
+from taggit.models import Tag
 
 from books.uuidfield import UUIDField
 from books.langlist import langs
 from books.epub import Epub
+from books.filemeta import book_metadata, cover_metadata, no_cover
+from books.normalize import normalize_text
 
 def sha256_sum(_file): # used to generate sha256 sum of book files
     s = sha256()
@@ -94,6 +98,13 @@ class Status(models.Model):
 
 class Author(models.Model):
     a_author = models.CharField('atom:author', max_length=200, unique=True)
+    # a_author case-folded and without accents, for indexed lookups:
+    a_author_normalized = models.CharField(max_length=255, editable=False,
+                                           db_index=True, default='')
+
+    def save(self, *args, **kwargs):
+        self.a_author_normalized = normalize_text(self.a_author)[:255]
+        super(Author, self).save(*args, **kwargs)
 
     def __unicode__(self):
         return self.a_author
@@ -114,12 +125,18 @@ class Book(models.Model):
     book_file = models.FileField(upload_to='books')
     file_sha256sum = models.CharField(max_length=64, unique=True)
     mimetype = models.CharField(max_length=200, null=True)
+    # size in bytes of book_file, stored with the metadata of the cover
+    # so the feeds are written without reading the files:
+    file_size = models.BigIntegerField(null=True, editable=False)
     time_added = models.DateTimeField(auto_now_add=True)
     tags = TaggableManager(blank=True)
     downloads = models.IntegerField(default=0)
     a_id = UUIDField('atom:id')
     a_status = models.ForeignKey(Status, blank=False, null=False, default=settings.DEFAULT_BOOK_STATUS)
     a_title = models.CharField('atom:title', max_length=200)
+    # a_title case-folded and without accents, for indexed lookups:
+    a_title_normalized = models.CharField(max_length=255, editable=False,
+                                          db_index=True, default='')
     a_author = models.ForeignKey(Author, blank=False, null=False)
     a_updated = models.DateTimeField('atom:updated', auto_now=True)
     a_summary = models.TextField('atom:summary', blank=True)
@@ -131,6 +148,10 @@ class Book(models.Model):
     dc_identifier = models.CharField('dc:identifier', max_length=50, \
     help_text='Use ISBN for this', blank=True)
     cover_img = models.FileField(blank=True, upload_to='covers')
+    cover_mimetype = models.CharField(max_length=100, blank=True,
+                                      editable=False)
+    cover_width = models.PositiveIntegerField(null=True, editable=False)
+    cover_height = models.PositiveIntegerField(null=True, editable=False)
 
     def validate_unique(self, *args, **kwargs):
         if not self.file_sha256sum:
@@ -144,6 +165,7 @@ class Book(models.Model):
 
     def save(self, *args, **kwargs):
         assert self.file_sha256sum
+        self.a_title_normalized = normalize_text(self.a_title)[:255]
         if not self.cover_img:
             # FIXME: we should use mimetype
             if self.book_file.name.endswith('.epub'):
@@ -156,11 +178,33 @@ class Book(models.Model):
                                         cover_file)
                 epub_file.close()
 
+        # read the metadata of the files added or replaced; the books
+        # added before it was stored are left to update_file_metadata,
+        # so they are saved even if their files cannot be read
+        adding = self._state.adding
+        if not self.book_file._committed or (adding and
+                                             self.file_size is None):
+            metadata = book_metadata(self.book_file)
+            self.file_size = metadata['file_size']
+            self.mimetype = metadata['mimetype'] or self.mimetype
+        cover = None
+        if not self.cover_img:
+            cover = no_cover()
+        elif not self.cover_img._committed or (adding and
+                                               not self.cover_mimetype):
+            cover = cover_metadata(self.cover_img)
+        for name, value in (cover or {}).items():
+            setattr(self, name, value)
+
         super(Book, self).save(*args, **kwargs)
 
     class Meta:
         ordering = ('-time_added',)
         get_latest_by = "time_added"
+        # orderings of the feeds paginated by keyset (see
+        # books.pagination), with the primary key as tiebreak
+        index_together = [('time_added', 'id'), ('a_title', 'id'),
+                          ('downloads', 'id')]
 
     def __unicode__(self):
         return self.a_title
@@ -171,3 +215,80 @@ class Book(models.Model):
     @models.permalink
     def get_absolute_url(self):
         return ('book_detail', [self.pk])
+
+
+class CatalogState(models.Model):
+    """
+    Single row table holding a token which changes on every change of
+    the catalogue (books, authors, tags), shared by all the processes
+    serving the catalogue to notice when their in-memory indexes and
+    caches are out of date.
+    """
+    generation = models.CharField(max_length=32)
+    # time of the last change of the generation
+    updated = models.DateTimeField(default=timezone.now)
+    # number of downloads, which do not change the generation
+    downloads = models.PositiveIntegerField(default=0)
+
+
+class BookText(models.Model):
+    """
+    Records that the text of a book file was added to the full-text
+    index of the book contents (see books.booktext).
+    """
+    book = models.OneToOneField(Book, primary_key=True,
+                                related_name='text_index')
+    file_sha256sum = models.CharField(max_length=64)
+    chunks = models.PositiveIntegerField(default=0)
+    indexed_at = models.DateTimeField(auto_now=True)
+
+
+class Trigram(models.Model):
+    """
+    Posting of the trigram index of the book titles and author names,
+    used to find misspelled words (see books.fuzzy).
+    """
+    trigram = models.CharField(max_length=3, db_index=True)
+    kind = models.CharField(max_length=6)
+    object_id = models.PositiveIntegerField()
+    # number of trigrams of the title or name
+    total = models.PositiveSmallIntegerField()
+
+    class Meta:
+        index_together = [('kind', 'object_id')]
+
+
+class AuthorSummary(models.Model):
+    """
+    Books of an author, maintained by the signals (see books.authors)
+    so the author lists are read from this table alone.
+    """
+    author = models.OneToOneField(Author, primary_key=True,
+                                  related_name='summary')
+    # a_author case-folded and without accents, the order of the lists
+    sort_key = models.CharField(max_length=255, default='')
+    published_books = models.PositiveIntegerField(default=0)
+    total_books = models.PositiveIntegerField(default=0)
+    # last update of the published books
+    updated = models.DateTimeField(null=True)
+
+    class Meta:
+        index_together = [('sort_key', 'author')]
+
+
+class TagSummary(models.Model):
+    """
+    Number of books of a tag, maintained by the signals (see
+    books.tagcounts) so the tag lists are read from this table alone.
+    """
+    tag = models.OneToOneField(Tag, primary_key=True,
+                               related_name='summary')
+    # the tag name case-folded and without accents, the order of the
+    # lists by name
+    sort_key = models.CharField(max_length=255, default='')
+    published_books = models.PositiveIntegerField(default=0)
+    total_books = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        index_together = [('sort_key', 'tag'), ('published_books', 'tag'),
+                          ('total_books', 'tag')]
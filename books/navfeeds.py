@@ -0,0 +1,129 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Navigation feeds: the root catalog and the list of the tag groups, in
+Atom and OPDS 2.0 JSON.
+
+They only change with the catalogue, so each process builds them once
+per catalogue generation (see books.generation) and serves them from
+memory.  Their dates are not the time of the request, which no client
+could cache, but the date of the newest published book of each
+section: the SectionDates, also used by the feeds of the tags.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Max
+
+from taggit.models import TaggedItem
+
+from books import generation, opds, opds2
+from books.app_settings import BOOK_PUBLISHED
+from books.models import Book, TagGroup
+
+
+class SectionDates(object):
+    """
+    Last update of the published books of the catalogue, of each tag
+    and of each tag group, defaulting to the date of the last change
+    of the catalogue.
+    """
+    def __init__(self, books, tags, groups, default):
+        self.default = default
+        self.books = books or default
+        self.tags = tags
+        self.groups = groups
+        self.tags_newest = max(tags.values(), default=default)
+        self.groups_newest = max(groups.values(), default=default)
+        self.newest = max(self.books, self.tags_newest, self.groups_newest)
+
+    def tag(self, name):
+        return self.tags.get(name, self.default)
+
+    def group(self, slug):
+        return self.groups.get(slug, self.default)
+
+
+def section_dates():
+    """Return the SectionDates of the catalogue, in four queries."""
+    default = generation.state()[1]
+    published = Book.objects.filter(a_status=BOOK_PUBLISHED).order_by()
+    books = published.aggregate(updated=Max('a_updated'))['updated']
+    tags = dict(published.filter(tags__isnull=False).values_list(
+        'tags__name').annotate(updated=Max('a_updated')))
+
+    groups = {}
+    group_tags = TaggedItem.objects.filter(
+        content_type=ContentType.objects.get_for_model(TagGroup))
+    slugs = dict(TagGroup.objects.values_list('pk', 'slug'))
+    for group, tag in group_tags.values_list('object_id', 'tag__name'):
+        if tag in tags and group in slugs:
+            slug = slugs[group]
+            groups[slug] = max(groups.get(slug, tags[tag]), tags[tag])
+    return SectionDates(books, tags, groups, default)
+
+
+class NavFeeds(object):
+    """The SectionDates and the feeds of a catalogue generation."""
+    def __init__(self):
+        self.dates = section_dates()
+        self.feeds = {}
+
+
+def _render_root_feed(dates):
+    return b''.join(opds.generate_root_catalog(dates))
+
+
+def _render_root_json(dates):
+    return opds2.generate_root_catalog(dates)
+
+
+def _render_taggroups_feed(dates):
+    return b''.join(opds.generate_taggroups_catalog(
+        TagGroup.objects.iterator(), dates))
+
+
+def _render_taggroups_json(dates):
+    return opds2.generate_taggroups_catalog(TagGroup.objects.iterator(),
+                                            dates)
+
+
+# url name -> (content type, render function)
+FEEDS = {
+    'root_feed': ('application/atom+xml', _render_root_feed),
+    'root_json': (opds2.CONTENT_TYPE, _render_root_json),
+    'tags_listgroups': ('application/atom+xml', _render_taggroups_feed),
+    'tags_listgroups_json': (opds2.CONTENT_TYPE, _render_taggroups_json),
+}
+
+index = generation.LocalIndex(NavFeeds)
+
+
+def dates():
+    """Return the SectionDates of the current catalogue generation."""
+    return index.get().dates
+
+
+def feed(name):
+    """Return the (content, content type) of the navigation feed `name`."""
+    nav = index.get()
+    content_type, render = FEEDS[name]
+    with index.lock:
+        content = nav.feeds.get(name)
+    if content is None:
+        # rendered without the lock: the feeds read the database
+        content = render(nav.dates)
+        with index.lock:
+            nav.feeds[name] = content
+    return content, content_type
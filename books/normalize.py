@@ -0,0 +1,42 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import re
+import unicodedata
+
+# Only the combining marks used as accents on latin, greek and cyrillic
+# letters are dropped: the vowel signs of the indic scripts are
+# combining marks too, removing them would change the words.
+_ACCENTS_RE = re.compile('[\u0300-\u036f]')
+
+# \w does not match the combining marks, build the class of the ones
+# of the basic multilingual plane to keep words like 'हिन्दी' whole.
+_MARKS = ''.join(chr(c) for c in range(0x300, 0x10000)
+                 if unicodedata.category(chr(c)).startswith('M'))
+_WORD_RE = re.compile('[\\w%s]+' % re.escape(_MARKS))
+
+
+def normalize_text(text):
+    """
+    Case-fold `text` and strip its accents, for comparisons and
+    lookups: 'Café  Noir' -> 'cafe noir'.
+    """
+    text = unicodedata.normalize('NFD', text.casefold())
+    text = _ACCENTS_RE.sub('', text)
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def words(text):
+    """Return the normalized words of `text`."""
+    return _WORD_RE.findall(normalize_text(text))
@@ -15,22 +15,28 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-# from cStringIO import StringIO
-from io import StringIO
-
-
 from django.core.urlresolvers import reverse
 
-from books.atom import AtomFeed
+from books.app_settings import ATOM_WRITER
+from books.atom import AtomFeed, WRITERS
+from books.fragments import entries
 import mimetypes
 
 import datetime
 
+WRITER = WRITERS[ATOM_WRITER]
+
 ATTRS = {}
 ATTRS[u'xmlns:dcterms'] = u'http://purl.org/dc/terms/'
 ATTRS[u'xmlns:opds'] = u'http://opds-spec.org/'
 ATTRS[u'xmlns:dc'] = u'http://purl.org/dc/elements/1.1/'
 ATTRS[u'xmlns:opensearch'] = 'http://a9.com/-/spec/opensearch/1.1/'
+ATTRS[u'xmlns:thr'] = 'http://purl.org/syndication/thread/1.0'
+
+# Feed paging and archiving (RFC 5005), for the complete feed
+FH_NS = 'http://purl.org/syndication/history/1.0'
+CRAWLABLE = 'http://opds-spec.org/crawlable'
+ACQUISITION_TYPE = 'application/atom+xml;profile=opds-catalog;kind=acquisition'
 
 
 def __get_mimetype(item):
@@ -45,15 +51,20 @@ def __get_mimetype(item):
     else:
         return 'Unknown'
 
-def page_qstring(request, page_number=None):
+def page_qstring(request, page_number=None, cursor=None):
     """
     Return the query string for the URL.
 
-    If page_number is given, modify the query for that page.
+    If page_number, or the cursor of a keyset page, is given, modify
+    the query for that page.
     """
     qdict = dict(request.GET.items())
     if page_number is not None:
+        qdict.pop('cursor', None)
         qdict['page'] = str(page_number)
+    if cursor is not None:
+        qdict.pop('page', None)
+        qdict['cursor'] = cursor
 
     if len(qdict) > 0:
         qstring = '?'+'&'.join(('%s=%s' % (k, v) for k, v in qdict.items()))
@@ -62,8 +73,27 @@ def page_qstring(request, page_number=None):
 
     return qstring
 
-def generate_nav_catalog(subsections, is_root=False):
-    links = []
+def sibling_qstring(request, page_obj, rel):
+    """
+    Return the query string of the 'previous' or 'next' page of
+    page_obj, numbered or keyset (see books.pagination).
+    """
+    if page_obj.number is None:
+        if rel == 'previous':
+            return page_qstring(request, cursor=page_obj.previous_cursor())
+        return page_qstring(request, cursor=page_obj.next_cursor())
+    if rel == 'previous':
+        return page_qstring(request, page_obj.previous_page_number())
+    return page_qstring(request, page_obj.next_page_number())
+
+def search_link():
+    return {'title': 'Search', 'rel': 'search',
+            'type': 'application/opensearchdescription+xml',
+            'href': reverse('opensearch')}
+
+def generate_nav_catalog(subsections, is_root=False, updated=None,
+                         page_links=()):
+    links = [search_link()]
 
     if is_root:
         links.append({'type': 'application/atom+xml',
@@ -73,155 +103,242 @@ def generate_nav_catalog(subsections, is_root=False):
     links.append({'title': 'Home', 'type': 'application/atom+xml',
                   'rel': 'start',
                   'href': reverse('root_feed')})
+    links.extend(page_links)
 
     feed = AtomFeed(title = 'Pathagar Bookserver OPDS feed', \
         atom_id = 'pathagar:full-catalog', subtitle = \
         'OPDS catalog for the Pathagar book server', \
-        extra_attrs = ATTRS, hide_generator=True, links=links)
+        extra_attrs = ATTRS, hide_generator=True, links=links,
+        writer=WRITER, updated=updated or datetime.datetime.now())
 
+    # the subsections are only read while the feed is written
+    items = (AtomFeed.make_item(subsec['id'], subsec['title'],
+                                subsec['updated'], links=subsec['links'])
+             for subsec in subsections)
+    return feed.generate('UTF-8', items)
 
-    for subsec in subsections:
-        feed.add_item(subsec['id'], subsec['title'],
-                      subsec['updated'], links=subsec['links'])
-
-    s = StringIO()
-    feed.write(s, 'UTF-8')
-    return s.getvalue()
+def generate_root_catalog(dates):
+    """
+    Return the root catalog, dated by `dates`, the SectionDates of
+    books.navfeeds.
+    """
+    def subsection(id_, title, updated, url_name):
+        return {'id': id_, 'title': title, 'updated': updated,
+                'links': [{'rel': 'subsection', 'type': 'application/atom+xml',
+                           'href': reverse(url_name)}]}
 
-def generate_root_catalog():
     subsections = [
-        {'id': 'latest', 'title': 'Latest', 'updated': datetime.datetime.now(),
-         'links': [{'rel': 'subsection', 'type': 'application/atom+xml', \
-                    'href': reverse('latest_feed')}]},
-        {'id': 'by-title', 'title': 'By Title', 'updated': datetime.datetime.now(),
-         'links': [{'rel': 'subsection', 'type': 'application/atom+xml', \
-                    'href': reverse('by_title_feed')}]},
-        {'id': 'by-author', 'title': 'By Author', 'updated': datetime.datetime.now(),
-         'links': [{'rel': 'subsection', 'type': 'application/atom+xml', \
-                    'href': reverse('by_author_feed')}]},
-        {'id': 'by-popularity', 'title': 'Most downloaded', 'updated': datetime.datetime.now(),
-         'links': [{'rel': 'subsection', 'type': 'application/atom+xml', \
-                    'href': reverse('most_downloaded_feed')}]},
-        {'id': 'tags', 'title': 'Tags', 'updated': datetime.datetime.now(),
-         'links': [{'rel': 'subsection', 'type': 'application/atom+xml', \
-                    'href': reverse('tags_feed')}]},
-        {'id': 'tag-groups', 'title': 'Tag groups', 'updated': datetime.datetime.now(),
-         'links': [{'rel': 'subsection', 'type': 'application/atom+xml', \
-                    'href': reverse('tags_listgroups')}]},
+        subsection('latest', 'Latest', dates.books, 'latest_feed'),
+        subsection('by-title', 'By Title', dates.books, 'by_title_feed'),
+        subsection('by-author', 'By Author', dates.books, 'by_author_feed'),
+        subsection('by-popularity', 'Most downloaded', dates.books,
+                   'most_downloaded_feed'),
+        subsection('tags', 'Tags', dates.tags_newest, 'tags_feed'),
+        subsection('tag-groups', 'Tag groups', dates.groups_newest,
+                   'tags_listgroups'),
     ]
-    return generate_nav_catalog(subsections)
-
-def generate_tags_catalog(tags):
-    def convert_tag(tag):
-        return {'id': tag.name, 'title': tag.name,  'updated': datetime.datetime.now(),
+    # the complete acquisition feed, for the mirrors and crawlers
+    crawlable = {'title': 'All books', 'rel': CRAWLABLE,
+                 'type': ACQUISITION_TYPE,
+                 'href': reverse('complete_feed')}
+    return generate_nav_catalog(subsections, updated=dates.newest,
+                                page_links=[crawlable])
+
+def generate_tags_catalog(request, page_obj, dates):
+    """
+    Return the catalog of a page of tags, listed from their TagSummary
+    (see books.tagcounts).
+    """
+    def convert_tag(summary):
+        name = summary.tag.name
+        return {'id': name, 'title': name,
+                'updated': dates.tag(name),
                 'links': [{'rel': 'subsection', 'type': 'application/atom+xml', \
-                           'href': reverse('by_tag_feed', kwargs=dict(tag=tag.name))}]}
+                           'href': reverse('by_tag_feed', kwargs=dict(tag=name)),
+                           'thr:count': str(visible_books(request, summary))}]}
 
-    tags_subsections = map(convert_tag, tags)
-    return generate_nav_catalog(tags_subsections)
+    page_links = []
+    if page_obj.has_previous():
+        page_links.append({'title': 'Previous results',
+                           'type': 'application/atom+xml', 'rel': 'previous',
+                           'href': sibling_qstring(request, page_obj,
+                                                   'previous')})
+    if page_obj.has_next():
+        page_links.append({'title': 'Next results',
+                           'type': 'application/atom+xml', 'rel': 'next',
+                           'href': sibling_qstring(request, page_obj, 'next')})
+
+    tags_subsections = map(convert_tag, page_obj.object_list)
+    return generate_nav_catalog(tags_subsections, updated=dates.tags_newest,
+                                page_links=page_links)
 
-def generate_taggroups_catalog(tag_groups):
+def generate_taggroups_catalog(tag_groups, dates):
     def convert_group(group):
-        return {'id': group.slug, 'title': group.name,  'updated': datetime.datetime.now(),
+        return {'id': group.slug, 'title': group.name,
+                'updated': dates.group(group.slug),
                 'links': [{'rel': 'subsection', 'type': 'application/atom+xml', \
                            'href': reverse('tag_groups_feed', kwargs=dict(group_slug=group.slug))}]}
 
     tags_subsections = map(convert_group, tag_groups)
-    return generate_nav_catalog(tags_subsections)
+    return generate_nav_catalog(tags_subsections,
+                                updated=dates.groups_newest)
 
 
-def generate_catalog(request, page_obj):
+def facet_links(facets):
     links = []
+    for group in facets:
+        for facet in group['values']:
+            link = {'title': facet['label'], 'type': 'application/atom+xml',
+                    'rel': 'http://opds-spec.org/facet',
+                    'href': facet['qstring'],
+                    'opds:facetGroup': group['title'],
+                    'thr:count': str(facet['count'])}
+            if facet['active']:
+                link['opds:activeFacet'] = 'true'
+            links.append(link)
+    return links
+
+def book_item(book):
+    """Return the Atom item of a book (see AtomFeed.make_item)."""
+    acquisition = {'rel': 'http://opds-spec.org/acquisition',
+                   'href': reverse('book_download',
+                                   kwargs=dict(book_id=book.pk)),
+                   'type': __get_mimetype(book)}
+    if book.file_size is not None:
+        acquisition['length'] = book.file_size
+    linklist = [acquisition]
+    if book.cover_img:
+        cover = {'rel': 'http://opds-spec.org/cover',
+                 'href': book.cover_img.url}
+        if book.cover_mimetype:
+            cover['type'] = book.cover_mimetype
+        linklist.append(cover)
+    add_kwargs = {
+        'content': book.a_summary,
+        'links': linklist,
+        'authors': [{'name' : str(book.a_author)}],
+        'dc_publisher': book.dc_publisher,
+        'dc_issued': book.dc_issued,
+        'dc_identifier': book.dc_identifier,
+    }
+
+    if book.dc_language is not None:
+        add_kwargs['dc_language'] = book.dc_language.code
+
+    return AtomFeed.make_item(book.a_id, book.a_title, book.a_updated,
+                              **add_kwargs)
+
+def generate_catalog(request, page_obj, facets=None):
+    links = [search_link()]
     links.append({'title': 'Home', 'type': 'application/atom+xml',
                   'rel': 'start',
                   'href': reverse('root_feed')})
 
     if page_obj.has_previous():
-        previous_page = page_obj.previous_page_number()
         links.append({'title': 'Previous results', 'type': 'application/atom+xml',
                       'rel': 'previous',
-                      'href': page_qstring(request, previous_page)})
+                      'href': sibling_qstring(request, page_obj, 'previous')})
 
     if page_obj.has_next():
-        next_page = page_obj.next_page_number()
         links.append({'title': 'Next results', 'type': 'application/atom+xml',
                       'rel': 'next',
-                      'href': page_qstring(request, next_page)})
+                      'href': sibling_qstring(request, page_obj, 'next')})
+
+    if facets:
+        links.extend(facet_links(facets))
 
     feed = AtomFeed(title = 'Pathagar Bookserver OPDS feed', \
         atom_id = 'pathagar:full-catalog', subtitle = \
         'OPDS catalog for the Pathagar book server', \
-        extra_attrs = ATTRS, hide_generator=True, links=links)
+        extra_attrs = ATTRS, hide_generator=True, links=links,
+        writer=WRITER)
 
     for book in page_obj.object_list:
-        if book.cover_img:
-            linklist = [{'rel': \
-                    'http://opds-spec.org/acquisition', 'href': \
-                    reverse('book_download',
-                            kwargs=dict(book_id=book.pk)),
-                    'type': __get_mimetype(book)}, {'rel': \
-                    'http://opds-spec.org/cover', 'href': \
-                    book.cover_img.url }]
-        else:
-            linklist = [{'rel': \
-                    'http://opds-spec.org/acquisition', 'href': \
-                    reverse('book_download',
-                            kwargs=dict(book_id=book.pk)),
-                    'type': __get_mimetype(book)}]
-        add_kwargs = {
-            'content': book.a_summary,
-            'links': linklist,
-            'authors': [{'name' : str(book.a_author)}],
-            'dc_publisher': book.dc_publisher,
-            'dc_issued': book.dc_issued,
-            'dc_identifier': book.dc_identifier,
-        }
-
-        if book.dc_language is not None:
-            add_kwargs['dc_language'] = book.dc_language.code
+        fragment = entries.get(book.pk, book.a_updated)
+        if fragment is None:
+            fragment = entries.put(book.pk, book.a_updated,
+                                   feed.serialize_item(book_item(book)))
+        feed.add_fragment(fragment, book.a_updated)
 
-        feed.add_item(book.a_id, book.a_title, book.a_updated, **add_kwargs)
+    return feed.generate('UTF-8')
 
-    s = StringIO()
-    feed.write(s, 'UTF-8')
-    return s.getvalue()
+def generate_complete_catalog(books, updated):
+    """
+    Return the complete acquisition feed (RFC 5005) of `books`, an
+    iterable only read while the feed is written, `updated` being the
+    date of the latest book.
+    """
+    links = [search_link(),
+             {'title': 'Home', 'type': 'application/atom+xml',
+              'rel': 'start', 'href': reverse('root_feed')},
+             {'type': ACQUISITION_TYPE, 'rel': 'self',
+              'href': reverse('complete_feed')}]
+
+    attrs = dict(ATTRS)
+    attrs[u'xmlns:fh'] = FH_NS
+    feed = AtomFeed(title = 'Pathagar Bookserver OPDS feed', \
+        atom_id = 'pathagar:complete-catalog', subtitle = \
+        'All the books of the Pathagar book server', \
+        extra_attrs = attrs, hide_generator=True, links=links,
+        writer=WRITER, updated=updated, complete=True)
+
+    def items():
+        for book in books:
+            # the entries of the harvested books are not cached, they
+            # would evict those of the browsed pages
+            fragment = entries.get(book.pk, book.a_updated) or \
+                feed.serialize_item(book_item(book))
+            yield {'fragment': fragment, 'updated': book.a_updated}
+
+    return feed.generate('UTF-8', items())
+
+def visible_books(request, summary):
+    """
+    Return the number of books of an AuthorSummary or a TagSummary the
+    user can see.
+    """
+    if request.user.is_authenticated():
+        return summary.total_books
+    return summary.published_books
 
-def generate_author_catalog(request, page_obj):
+def generate_author_catalog(request, page_obj, dates):
     nav = 'application/atom+xml' #;profile=opds-catalog;kind=navigation'
-    links = []
+    links = [search_link()]
     links.append({'title': 'Home', 'type': nav, #'application/atom+xml',
                   'rel': 'start',
                   'href': reverse('root_feed')})
 
     if page_obj.has_previous():
-        previous_page = page_obj.previous_page_number()
         links.append({'title': 'Previous results', 'type': nav, #'application/atom+xml',
                       'rel': 'previous',
-                      'href': page_qstring(request, previous_page)})
+                      'href': sibling_qstring(request, page_obj, 'previous')})
 
     if page_obj.has_next():
-        next_page = page_obj.next_page_number()
         links.append({'title': 'Next results', 'type': nav, #'application/atom+xml',
                       'rel': 'next',
-                      'href': page_qstring(request, next_page)})
+                      'href': sibling_qstring(request, page_obj, 'next')})
 
     feed = AtomFeed(title = 'Pathagar Bookserver OPDS feed', \
         atom_id = 'pathagar:full-catalog', subtitle = \
         'OPDS catalog for the Pathagar book server', \
-        extra_attrs = ATTRS, hide_generator=True, links=links)
+        extra_attrs = ATTRS, hide_generator=True, links=links,
+        writer=WRITER)
 
-    for author in page_obj.object_list:
+    # the authors are listed from their AuthorSummary
+    for summary in page_obj.object_list:
         linklist = [{'rel': 'subsection',
                      'href': reverse('by_title_author_feed',
-                                     kwargs=dict(author_id=author.pk)),
-                     'type': nav}]
+                                     kwargs=dict(author_id=summary.pk)),
+                     'type': nav,
+                     'thr:count': str(visible_books(request, summary))}]
         add_kwargs = {
             'content': '', #book.a_summary,
             'links': linklist,
         }
 
-        feed.add_item(str(author.pk), author.a_author, datetime.datetime.now(), **add_kwargs)
+        feed.add_item(str(summary.pk), summary.author.a_author,
+                      # no published books: the catalogue date
+                      summary.updated or dates.default,
+                      **add_kwargs)
 
-    s = StringIO()
-    feed.write(s, 'UTF-8')
-    return s.getvalue()
+    return feed.generate('UTF-8')
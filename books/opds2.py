@@ -0,0 +1,230 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+OPDS 2.0 (JSON) catalogs, the equivalents of the Atom catalogs of
+books.opds built from the same pages of books, authors and tags.
+
+The documents are encoded by the C accelerated JSON encoder, without
+indentation nor escaping of the non ASCII characters.  The publication
+of each book is encoded once and reused until the book is saved again,
+like the Atom entries (see books.fragments).
+"""
+
+import json
+import mimetypes
+
+from django.core.urlresolvers import reverse
+
+from books.atom import rfc3339_date
+from books.fragments import publications
+from books.opds import sibling_qstring, visible_books
+
+CONTENT_TYPE = 'application/opds+json'
+TITLE = 'Pathagar Bookserver'
+
+_encoder = json.JSONEncoder(ensure_ascii=False, check_circular=False,
+                            separators=(',', ':'))
+
+
+def _link(rel, href, type_=CONTENT_TYPE, **extra):
+    link = {'rel': rel, 'href': href, 'type': type_}
+    link.update(extra)
+    return link
+
+
+def _common_links(self_href):
+    return [
+        _link('self', self_href),
+        _link('start', reverse('root_json')),
+        _link('search', reverse('search_json') + '{?query}', templated=True),
+    ]
+
+
+def _page_links(request, page_obj):
+    links = []
+    if page_obj.has_previous():
+        links.append(_link('previous', request.path + sibling_qstring(
+            request, page_obj, 'previous')))
+    if page_obj.has_next():
+        links.append(_link('next', request.path + sibling_qstring(
+            request, page_obj, 'next')))
+    return links
+
+
+def _metadata(page_obj, title=TITLE):
+    metadata = {'title': title}
+    # keyset pages are not numbered
+    if page_obj.number is not None:
+        metadata['currentPage'] = page_obj.number
+    return metadata
+
+
+def _encode(feed, publication_list=None):
+    """
+    Return the encoded `feed`, with the already encoded publications
+    of `publication_list` if given.
+    """
+    encoded = _encoder.encode(feed)
+    if publication_list is not None:
+        encoded = '%s,"publications":[%s]}' % (encoded[:-1],
+                                               ','.join(publication_list))
+    return encoded.encode('utf-8')
+
+
+def _mimetype(book):
+    if book.mimetype is not None:
+        return book.mimetype
+    return mimetypes.guess_type(book.book_file.url)[0] or 'Unknown'
+
+
+def book_publication(book):
+    """Return the OPDS 2.0 publication of a book."""
+    metadata = {
+        '@type': 'http://schema.org/Book',
+        'identifier': 'urn:uuid:%s' % book.a_id,
+        'title': book.a_title,
+        'author': {'name': str(book.a_author)},
+        'modified': rfc3339_date(book.a_updated),
+    }
+    if book.a_summary:
+        metadata['description'] = book.a_summary
+    if book.dc_language is not None:
+        metadata['language'] = book.dc_language.code
+    if book.dc_publisher:
+        metadata['publisher'] = book.dc_publisher
+    if book.dc_issued:
+        metadata['published'] = book.dc_issued
+    publication = {
+        'metadata': metadata,
+        'links': [_link('http://opds-spec.org/acquisition',
+                        reverse('book_download',
+                                kwargs=dict(book_id=book.pk)),
+                        _mimetype(book))],
+    }
+    if book.file_size is not None:
+        publication['links'][0]['length'] = book.file_size
+    if book.cover_img:
+        image = {'href': book.cover_img.url,
+                 'type': book.cover_mimetype
+                 or mimetypes.guess_type(book.cover_img.name)[0]
+                 or 'image/jpeg'}
+        if book.cover_width and book.cover_height:
+            image['width'] = book.cover_width
+            image['height'] = book.cover_height
+        publication['images'] = [image]
+    return publication
+
+
+def _facets(facets):
+    groups = []
+    for group in facets or ():
+        groups.append({
+            'metadata': {'title': group['title']},
+            'links': [_link('self' if facet['active'] else 'alternate',
+                            facet['qstring'], title=facet['label'],
+                            properties={'numberOfItems': facet['count']})
+                      for facet in group['values']],
+        })
+    return groups
+
+
+def generate_catalog(request, page_obj, facets=None, title=TITLE):
+    """Return the encoded publications feed of a page of books."""
+    feed = {
+        'metadata': _metadata(page_obj, title),
+        'links': _common_links(request.get_full_path())
+        + _page_links(request, page_obj),
+    }
+    if facets:
+        feed['facets'] = _facets(facets)
+
+    publication_list = []
+    for book in page_obj.object_list:
+        encoded = publications.get(book.pk, book.a_updated)
+        if encoded is None:
+            encoded = publications.put(
+                book.pk, book.a_updated,
+                _encoder.encode(book_publication(book)))
+        publication_list.append(encoded)
+    return _encode(feed, publication_list)
+
+
+def generate_nav_catalog(self_href, navigation, title=TITLE,
+                         modified=None):
+    """
+    Return the encoded navigation feed of `navigation`, an iterable of
+    (title, href) pairs, last modified at `modified` if given.
+    """
+    metadata = {'title': title}
+    if modified is not None:
+        metadata['modified'] = rfc3339_date(modified)
+    return _encode({
+        'metadata': metadata,
+        'links': _common_links(self_href),
+        'navigation': [_link('subsection', href, title=label)
+                       for label, href in navigation],
+    })
+
+
+def generate_root_catalog(dates):
+    """Return the root catalog, `dates` being the SectionDates."""
+    return generate_nav_catalog(reverse('root_json'), [
+        ('Latest', reverse('latest_json')),
+        ('By Title', reverse('by_title_json')),
+        ('By Author', reverse('by_author_json')),
+        ('Most downloaded', reverse('most_downloaded_json')),
+        ('Tags', reverse('tags_json')),
+        ('Tag groups', reverse('tags_listgroups_json')),
+    ], modified=dates.newest)
+
+
+def generate_tags_catalog(request, page_obj):
+    """Return the catalog of a page of tags, from their TagSummary."""
+    return _encode({
+        'metadata': _metadata(page_obj),
+        'links': _common_links(request.get_full_path())
+        + _page_links(request, page_obj),
+        'navigation': [
+            _link('subsection',
+                  reverse('by_tag_json', kwargs=dict(tag=summary.tag.name)),
+                  title=summary.tag.name,
+                  properties={'numberOfItems': visible_books(request,
+                                                             summary)})
+            for summary in page_obj.object_list],
+    })
+
+
+def generate_taggroups_catalog(tag_groups, dates):
+    return generate_nav_catalog(reverse('tags_listgroups_json'), (
+        (group.name, reverse('tag_groups_json',
+                             kwargs=dict(group_slug=group.slug)))
+        for group in tag_groups), modified=dates.groups_newest)
+
+
+def generate_author_catalog(request, page_obj):
+    feed = {
+        'metadata': _metadata(page_obj),
+        'links': _common_links(request.get_full_path())
+        + _page_links(request, page_obj),
+        'navigation': [
+            _link('subsection',
+                  reverse('by_title_author_json',
+                          kwargs=dict(author_id=summary.pk)),
+                  title=summary.author.a_author,
+                  properties={'numberOfItems': visible_books(request,
+                                                             summary)})
+            for summary in page_obj.object_list],
+    }
+    return _encode(feed)
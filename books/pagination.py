@@ -0,0 +1,232 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Pagination without counting the objects.
+
+The page reads one object more than it shows: if it is there, there is
+a next page.  Unlike django.core.paginator, the number of pages is not
+known, which saves the COUNT query.
+
+Keyset pages go further: instead of skipping the objects of the
+previous pages with OFFSET, which reads them all, a page starts after
+the ordering values of the last object of the previous page.  With an
+index on the ordering, any page costs the same as the first one.  The
+position is passed between pages as an opaque cursor.
+"""
+
+import base64
+import json
+
+from django.db import models
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class PeekPage(object):
+    """A page with the interface used by the OPDS catalogs."""
+    def __init__(self, object_list, number, has_next):
+        self.object_list = object_list
+        self.number = number
+        self._has_next = has_next
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self.number > 1
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+def peek_page(queryset, number, per_page):
+    """Return the PeekPage `number` (from 1) of queryset, one query."""
+    try:
+        number = max(1, int(number))
+    except (TypeError, ValueError):
+        number = 1
+    offset = (number - 1) * per_page
+    object_list = list(queryset[offset:offset + per_page + 1])
+    return PeekPage(object_list[:per_page], number,
+                    len(object_list) > per_page)
+
+
+class KeysetPage(object):
+    """
+    A page of a keyset pagination, with the interface of PeekPage but
+    no page number: the links to the previous and next pages use the
+    cursors of next_cursor() and previous_cursor().
+    """
+    number = None
+
+    def __init__(self, object_list, ordering, has_previous, has_next):
+        self.object_list = object_list
+        self.ordering = ordering
+        # no cursor to go from an empty page, e.g. past the last object
+        self._has_previous = has_previous and bool(object_list)
+        self._has_next = has_next and bool(object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_cursor(self):
+        return encode_cursor('next', self.object_list[-1], self.ordering)
+
+    def previous_cursor(self):
+        return encode_cursor('previous', self.object_list[0], self.ordering)
+
+
+def _field_names(ordering):
+    return [field.lstrip('-') for field in ordering]
+
+
+def encode_cursor(direction, obj, ordering):
+    """
+    Return the cursor of the page before ('previous') or after ('next')
+    `obj` in `ordering`.
+    """
+    values = []
+    for name in _field_names(ordering):
+        value = getattr(obj, name)
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        values.append(value)
+    data = json.dumps([direction[0]] + values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode(
+        'ascii').rstrip('=')
+
+
+def _integer_field(field):
+    if field.is_relation:
+        # e.g. the primary key of the summaries, a OneToOneField
+        field = field.target_field
+    return field.get_internal_type() in (
+        'AutoField', 'BigAutoField', 'IntegerField', 'BigIntegerField',
+        'SmallIntegerField', 'PositiveIntegerField',
+        'PositiveSmallIntegerField')
+
+
+def decode_cursor(cursor, model, ordering):
+    """
+    Return the (direction, values) of a cursor, or None if it is not a
+    valid cursor of `ordering`.
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+        direction, values = {'n': 'next', 'p': 'previous'}[data[0]], \
+            data[1:]
+    except (ValueError, TypeError, KeyError, IndexError):
+        return None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    for i, name in enumerate(_field_names(ordering)):
+        field = model._meta.pk if name == 'pk' else model._meta.get_field(
+            name)
+        value = values[i]
+        if _integer_field(field):
+            # bool is an int too
+            if not isinstance(value, int) or isinstance(value, bool):
+                return None
+        elif not isinstance(value, str):
+            return None
+        elif isinstance(field, models.DateTimeField):
+            try:
+                values[i] = parse_datetime(value)
+            except ValueError:
+                return None
+            if values[i] is None:
+                return None
+    return direction, values
+
+
+def _after(ordering, values, reverse=False):
+    """
+    Return the filter of the objects after `values` in `ordering`, or
+    before them if `reverse`.
+    """
+    names = _field_names(ordering)
+    condition = Q()
+    for i, field in enumerate(ordering):
+        descending = field.startswith('-') != reverse
+        lookup = '%s__%s' % (names[i], 'lt' if descending else 'gt')
+        step = Q(**{lookup: values[i]})
+        for name, value in zip(names[:i], values[:i]):
+            step &= Q(**{name: value})
+        condition |= step
+    return condition
+
+
+def _reversed(ordering):
+    return [field[1:] if field.startswith('-') else '-' + field
+            for field in ordering]
+
+
+def keyset_page(queryset, ordering, cursor, per_page):
+    """
+    Return the KeysetPage of queryset, sorted by `ordering` (whose last
+    field must be unique, e.g. 'pk'), at `cursor`, or the first page if
+    the cursor is missing or invalid.  Runs one query.
+    """
+    position = decode_cursor(cursor, queryset.model, ordering) \
+        if cursor else None
+    if position is None:
+        object_list = list(queryset.order_by(*ordering)[:per_page + 1])
+        return KeysetPage(object_list[:per_page], ordering, False,
+                          len(object_list) > per_page)
+
+    direction, values = position
+    if direction == 'next':
+        object_list = list(queryset.filter(_after(ordering, values))
+                           .order_by(*ordering)[:per_page + 1])
+        return KeysetPage(object_list[:per_page], ordering, True,
+                          len(object_list) > per_page)
+    object_list = list(queryset.filter(_after(ordering, values, True))
+                       .order_by(*_reversed(ordering))[:per_page + 1])
+    return KeysetPage(object_list[:per_page][::-1], ordering,
+                      len(object_list) > per_page, True)
+
+
+def keyset_iterator(queryset, ordering, chunk_size):
+    """
+    Yield the objects of queryset sorted by `ordering` (whose last field
+    must be unique), reading them by chunks of `chunk_size` objects, each
+    chunk starting after the last object of the previous one.  Unlike
+    QuerySet.iterator(), the memory used does not depend on the number
+    of objects with any database, and no query stays open while the
+    objects are used.
+    """
+    names = _field_names(ordering)
+    queryset = queryset.order_by(*ordering)
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        for obj in chunk:
+            yield obj
+        if len(chunk) < chunk_size:
+            return
+        values = [getattr(chunk[-1], name) for name in names]
+        chunk = list(queryset.filter(_after(ordering, values))[:chunk_size])
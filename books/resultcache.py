@@ -0,0 +1,135 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Per-process LRU cache of the search results.
+
+OPDS clients page through a search by repeating it with a `page`
+parameter.  The ordered ids of the matching books, and their facet
+counts, are kept for the first page so the next ones only fetch the
+books they show.  The whole cache is dropped when the catalogue
+generation changes (see books.generation).
+
+The cache is bounded by a number of searches and a total number of ids,
+stored as machine integers; the results of a search matching more ids
+than the whole cache are not kept.
+"""
+
+import threading
+from array import array
+from collections import OrderedDict
+
+from books import bitmaps
+from books.searchquery import normalize
+
+
+def make_key(params, list_by, url_kwargs=None, authenticated=False):
+    """
+    Return the cache key of a book list request: the list and its URL
+    arguments (tag, author), the GET parameters but the page, and
+    whether private books are visible.
+    """
+    url_kwargs = sorted((name, value) for name, value
+                        in (url_kwargs or {}).items() if name != 'qtype')
+    items = []
+    for name in sorted(params.keys()):
+        if name == 'page':
+            continue
+        values = params.getlist(name)
+        if name == 'q':
+            values = [normalize(value) for value in values]
+        items.append((name, tuple(values)))
+    return (list_by, tuple(url_kwargs), bool(authenticated), tuple(items))
+
+
+class Results(object):
+    def __init__(self, ids, facets, approximate=False):
+        # array of the book ids
+        self.ids = array('l', ids)
+        self.facets = facets
+        # True if the ids are of books similar to the query
+        self.approximate = approximate
+
+
+class ResultCache(object):
+    def __init__(self, size, max_ids):
+        self.size = size
+        self.max_ids = max_ids
+        self.generation = None
+        # total number of ids of the entries
+        self.ids_count = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, token):
+        """Return the Results of `key` for the generation `token`."""
+        with self._lock:
+            if token != self.generation:
+                self._clear()
+                self.generation = token
+                return None
+            results = self._entries.get(key)
+            if results is not None:
+                self._entries.move_to_end(key)
+            return results
+
+    def put(self, key, token, ids, facets, approximate=False):
+        """
+        Store the results of a query run when the generation was
+        `token`, which must have been read before running the query.
+        """
+        results = Results(ids, facets, approximate)
+        if len(results.ids) > self.max_ids:
+            return results
+        with self._lock:
+            if token == self.generation:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self.ids_count -= len(old.ids)
+                self._entries[key] = results
+                self.ids_count += len(results.ids)
+                while len(self._entries) > self.size or \
+                        self.ids_count > self.max_ids:
+                    old_key, old = self._entries.popitem(last=False)
+                    self.ids_count -= len(old.ids)
+        return results
+
+    def _clear(self):
+        # with the lock held
+        self._entries.clear()
+        self.ids_count = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+
+class BookIdList(object):
+    """Books of a list of ids, in order, sliceable by Paginator."""
+    def __init__(self, ids):
+        self.ids = ids
+
+    def count(self):
+        return len(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        return bitmaps.fetch_books(self.ids[key].tolist())
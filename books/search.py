@@ -15,62 +15,80 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-from django.db.models import Q
-from books.models import Book
+from django.db.models import Case, IntegerField, Q, Value, When
+from books import fulltext
+from books.models import Author
+from books.normalize import normalize_text
+from books.searchquery import get_plan
 
+# Greater than any character, ends the index ranges of prefixes
+_MAX_CHAR = '\U0010ffff'
 
-def simple_search(queryset, searchterms,
-                  search_title=False, search_author=False):
-    q_objects = []
-    results = queryset
 
-    subterms = searchterms.split(' ')
-    for subterm in subterms:
-        word = subterm
+def prefix_q(field, prefix):
+    """
+    Match the values of `field` starting with `prefix`, with a range
+    the index of the field can answer (a LIKE 'prefix%' cannot with
+    SQLite).
+    """
+    return Q(**{field + '__gte': prefix, field + '__lt': prefix + _MAX_CHAR})
+
+
+def simple_search(queryset, searchterms,
+                  search_title=False, search_author=False, ranked=False):
+    if fulltext.is_available():
+        columns = []
         if search_title:
-            q_objects.append(Q(a_title__icontains = word))
+            columns.append('a_title')
         if search_author:
-            q_objects.append(Q(a_author__a_author__icontains = word))
+            columns.append('a_author')
+        if not columns:
+            return queryset
+        expression = fulltext.match_expression(searchterms.split(), columns)
+        if expression is None:
+            return queryset
+        return fulltext.filter_queryset(queryset, expression, ranked)
 
-    for q_object in q_objects:
+    normalized = normalize_text(searchterms)
+    if not normalized or not (search_title or search_author):
+        return queryset
+
+    # The words starting the title or name are found from the indexes
+    # of the normalized columns, the LIKE scan is only needed for the
+    # words further in them:
+    results = queryset
+    for word in normalized.split():
+        q_object = Q()
+        if search_title:
+            q_object |= prefix_q('a_title_normalized', word)
+            q_object |= Q(a_title_normalized__contains=' ' + word)
+        if search_author:
+            q_object |= Q(a_author__in=Author.objects.filter(
+                prefix_q('a_author_normalized', word)))
+            q_object |= Q(a_author__a_author_normalized__contains=' ' + word)
         results = results.filter(q_object)
-    return results
+    if not ranked:
+        return results
 
-def advanced_search(queryset, searchterms):
+    # Titles or names starting with the query first
+    starting = Q()
+    if search_title:
+        starting |= prefix_q('a_title_normalized', normalized)
+    if search_author:
+        starting |= Q(a_author__in=Author.objects.filter(
+            prefix_q('a_author_normalized', normalized)))
+    ordering = results.query.order_by or results.model._meta.ordering
+    return results.annotate(starts_with_query=Case(
+        When(starting, then=Value(0)), default=Value(1),
+        output_field=IntegerField())).order_by('starts_with_query',
+                                               *ordering)
+
+def advanced_search(queryset, searchterms, ranked=False):
     """
     Does an advanced search in several fields of the books.
-    """
-    q_objects = []
-    results = queryset
-
-    subterms = searchterms.split('AND')
-    for subterm in subterms:
-        if ':' in subterm:
-            key, word = subterm.split(':')
-            key = key.strip()
-            if key == 'title':
-                q_objects.append(Q(a_title__icontains = word))
-            if key == 'author':
-                q_objects.append(Q(a_author__a_author__icontains = word))
-            if key == 'publisher':
-                q_objects.append(Q(dc_publisher__icontains = word))
-            if key == 'identifier':
-                q_objects.append(Q(dc_identifier__icontains = word))
-            if key == 'summary':
-                q_objects.append(Q(a_summary__icontains = word))
-            if key == 'lang':
-                q_objects.append(Q(dc_language__code = word))
-        else:
-            word = subterm
-            try:
-                results = results.filter(Q(a_title__icontains = word) | \
-                    Q(a_author__a_author__icontains = word) | \
-                    Q(dc_publisher__icontains = word) | \
-                    Q(dc_identifier__icontains = word) | \
-                    Q(a_summary__icontains = word))
-            except Book.DoesNotExist:
-                results = Book.objects.none()
 
-    for q_object in q_objects:
-        results = results.filter(q_object)
-    return results
+    See books.searchquery for the query language.  The full-text index
+    is used when available, LIKE queries otherwise.  If `ranked` is
+    True, full-text results are ordered by relevance.
+    """
+    return get_plan(searchterms).apply(queryset, ranked)
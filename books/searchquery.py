@@ -0,0 +1,390 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Query language of the advanced search.
+
+    query   := or_expr
+    or_expr := and_expr ('OR' and_expr)*
+    and_expr:= unary (['AND'] unary)*
+    unary   := ('NOT' | '-') unary | primary
+    primary := '(' or_expr ')' | [field ':'] (word | '"phrase"' | '(' or_expr ')')
+
+Known fields are title, author, publisher, summary, identifier and lang.
+A colon after any other word is kept as part of the word, so titles
+with a colon can be searched.  Operators must be upper case, "war and
+peace" searches for the three words.
+
+A query is parsed into a tree of Term, And, Or and Not nodes, then
+compiled into a Plan: exact lookups on indexed columns (lang,
+identifier) are applied first, then the full-text part, then whatever
+needs LIKE queries.  Plans are cached by normalized query string.
+"""
+
+import re
+from functools import lru_cache
+
+from django.db.models import Q
+
+from books import fulltext
+from books.models import Language
+from books.normalize import normalize_text
+
+# field name in queries -> (ORM lookup, full-text column)
+TEXT_FIELDS = {
+    'title': ('a_title_normalized', 'a_title'),
+    'author': ('a_author__a_author_normalized', 'a_author'),
+    'publisher': ('dc_publisher', 'dc_publisher'),
+    'summary': ('a_summary', 'a_summary'),
+}
+EXACT_FIELDS = ('lang', 'identifier')
+FIELD_ALIASES = {'language': 'lang'}
+
+PLAN_CACHE_SIZE = 256
+
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"?|([^\s()"]+))')
+
+
+class Term(object):
+    def __init__(self, text, field=None, phrase=False):
+        self.text = text
+        self.field = field
+        self.phrase = phrase
+
+    def __str__(self):
+        text = '"%s"' % self.text if self.phrase else self.text
+        if self.field:
+            return '%s:%s' % (self.field, text)
+        return text
+
+
+class Not(object):
+    def __init__(self, child):
+        self.child = child
+
+    def __str__(self):
+        return 'NOT %s' % self.child
+
+
+class _Group(object):
+    operator = None
+
+    def __init__(self, children):
+        self.children = children
+
+    def __str__(self):
+        return '(%s)' % (' %s ' % self.operator).join(
+            str(child) for child in self.children)
+
+
+class And(_Group):
+    operator = 'AND'
+
+
+class Or(_Group):
+    operator = 'OR'
+
+
+def tokenize(query):
+    """
+    Split a query into ('(' | ')' | 'phrase' | 'word', value) tokens.
+    An unterminated quote runs up to the end of the query.
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(query):
+        lparen, rparen, phrase, word = match.groups()
+        if lparen:
+            tokens.append(('(', lparen))
+        elif rparen:
+            tokens.append((')', rparen))
+        elif phrase is not None:
+            tokens.append(('phrase', phrase))
+        elif word:
+            tokens.append(('word', word))
+    return tokens
+
+
+class _Parser(object):
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def is_operator(self, name):
+        return self.peek() == ('word', name)
+
+    def parse(self):
+        nodes = []
+        while self.pos < len(self.tokens):
+            node = self.or_expr()
+            if node is not None:
+                nodes.append(node)
+            elif self.peek()[0] == ')':
+                # unbalanced parenthesis, ignore it
+                self.next()
+        return _simplify(And(nodes))
+
+    def or_expr(self):
+        nodes = [self.and_expr()]
+        while self.is_operator('OR'):
+            self.next()
+            nodes.append(self.and_expr())
+        return _simplify(Or([node for node in nodes if node is not None]))
+
+    def and_expr(self):
+        nodes = []
+        while True:
+            kind, value = self.peek()
+            if kind is None or kind == ')' or self.is_operator('OR'):
+                break
+            if self.is_operator('AND'):
+                self.next()
+                continue
+            node = self.unary()
+            if node is not None:
+                nodes.append(node)
+        return _simplify(And(nodes))
+
+    def unary(self):
+        kind, value = self.peek()
+        if self.is_operator('NOT'):
+            self.next()
+            child = self.unary()
+            return Not(child) if child is not None else None
+        if kind == 'word' and value.startswith('-') and len(value) > 1:
+            self.tokens[self.pos] = ('word', value[1:])
+            child = self.unary()
+            return Not(child) if child is not None else None
+        return self.primary()
+
+    def primary(self, field=None):
+        kind, value = self.next()
+        if kind == '(':
+            node = self.or_expr()
+            if self.peek()[0] == ')':
+                self.next()
+            if node is not None and field is not None:
+                node = _with_field(node, field)
+            return node
+        if kind == 'phrase':
+            return Term(value, field, phrase=True) if value.strip() else None
+        if kind == 'word':
+            if field is None and ':' in value:
+                name, rest = value.split(':', 1)
+                name = FIELD_ALIASES.get(name.lower(), name.lower())
+                if name in TEXT_FIELDS or name in EXACT_FIELDS:
+                    if rest:
+                        return Term(rest, name)
+                    if self.peek()[0] in ('(', 'phrase', 'word'):
+                        return self.primary(field=name)
+                    return None
+            return Term(value, field)
+        return None
+
+
+def _with_field(node, field):
+    """Scope every term of a `field:(...)` group to `field`."""
+    if isinstance(node, Term):
+        return Term(node.text, node.field or field, node.phrase)
+    if isinstance(node, Not):
+        return Not(_with_field(node.child, field))
+    return node.__class__([_with_field(child, field)
+                           for child in node.children])
+
+
+def _simplify(node):
+    """Flatten nested groups of the same kind, drop empty groups."""
+    if not isinstance(node, _Group):
+        return node
+    children = []
+    for child in node.children:
+        if isinstance(child, node.__class__):
+            children.extend(child.children)
+        else:
+            children.append(child)
+    if not children:
+        return None
+    if len(children) == 1:
+        return children[0]
+    return node.__class__(children)
+
+
+def parse(query):
+    """Parse a query string, returns the root node or None if empty."""
+    return _Parser(tokenize(query)).parse()
+
+
+def positive_terms(node):
+    """Return the text terms of a query which are not negated."""
+    if node is None or isinstance(node, Not):
+        return []
+    if isinstance(node, Term):
+        return [] if node.field in EXACT_FIELDS else [node]
+    return [term for child in node.children
+            for term in positive_terms(child)]
+
+
+def normalize(query):
+    return ' '.join(query.split())
+
+
+# Compilation
+
+def _is_exact(node):
+    return isinstance(node, Term) and node.field in EXACT_FIELDS
+
+
+def _has_exact(node):
+    if isinstance(node, Term):
+        return node.field in EXACT_FIELDS
+    if isinstance(node, Not):
+        return _has_exact(node.child)
+    return any(_has_exact(child) for child in node.children)
+
+
+def _exact_q(term):
+    if term.field == 'lang':
+        # FK equality on books_book.dc_language_id, no join
+        return Q(dc_language__in=Language.objects.filter(code=term.text))
+    return Q(dc_identifier=term.text)
+
+
+def compile_q(node):
+    """Compile a node into a Q object using LIKE queries."""
+    if isinstance(node, Term):
+        if node.field in EXACT_FIELDS:
+            return _exact_q(node)
+        if node.field is not None:
+            lookups = [TEXT_FIELDS[node.field][0]]
+        else:
+            lookups = [lookup for lookup, column in TEXT_FIELDS.values()]
+            lookups.append('dc_identifier')
+        q_object = Q()
+        for lookup in lookups:
+            if lookup.endswith('_normalized'):
+                # case-folded column, compared to the case-folded term
+                q_object |= Q(**{lookup + '__contains':
+                                 normalize_text(node.text)})
+            else:
+                q_object |= Q(**{lookup + '__icontains': node.text})
+        return q_object
+    if isinstance(node, Not):
+        return ~compile_q(node.child)
+    q_object = Q()
+    for child in node.children:
+        if isinstance(node, And):
+            q_object &= compile_q(child)
+        else:
+            q_object |= compile_q(child)
+    return q_object
+
+
+def compile_fts(node):
+    """
+    Compile a node into a FTS5 MATCH expression.
+
+    Returns None if the node cannot be expressed in FTS5: it involves
+    the exact fields, or negations with nothing to subtract from.
+    """
+    if isinstance(node, Term):
+        if node.field in EXACT_FIELDS:
+            return None
+        if node.phrase:
+            expression = '"%s"' % node.text.replace('"', '""')
+        else:
+            expression = fulltext.quote_term(node.text)
+        if node.field is not None:
+            expression = '{%s} : %s' % (TEXT_FIELDS[node.field][1], expression)
+        return expression
+    if isinstance(node, Not):
+        return None
+    if isinstance(node, Or):
+        parts = [compile_fts(child) for child in node.children]
+        if None in parts:
+            return None
+        return '(%s)' % ' OR '.join(parts)
+    positives = [child for child in node.children
+                 if not isinstance(child, Not)]
+    negatives = [child.child for child in node.children
+                 if isinstance(child, Not)]
+    if not positives:
+        return None
+    parts = [compile_fts(child) for child in positives]
+    excluded = [compile_fts(child) for child in negatives]
+    if None in parts or None in excluded:
+        return None
+    expression = '(%s)' % ' AND '.join(parts)
+    for part in excluded:
+        expression = '(%s NOT %s)' % (expression, part)
+    return expression
+
+
+class Plan(object):
+    """
+    Ordered filters for a query: `exact` Q objects on indexed columns,
+    then a full-text `expression`, then LIKE based Q objects.
+    """
+    def __init__(self, exact=None, expression=None, like=None):
+        self.exact = exact or []
+        self.expression = expression
+        self.like = like or []
+
+    def apply(self, queryset, ranked=False):
+        for q_object in self.exact:
+            queryset = queryset.filter(q_object)
+        if self.expression is not None:
+            queryset = fulltext.filter_queryset(queryset, self.expression,
+                                                ranked)
+        for q_object in self.like:
+            queryset = queryset.filter(q_object)
+        return queryset
+
+
+def build_plan(node, use_fts):
+    if node is None:
+        return Plan()
+    clauses = node.children if isinstance(node, And) else [node]
+
+    exact = [_exact_q(clause) for clause in clauses if _is_exact(clause)]
+    rest = [clause for clause in clauses if not _is_exact(clause)]
+
+    expression = None
+    like = []
+    if use_fts:
+        text = [clause for clause in rest if not _has_exact(clause)]
+        if text:
+            expression = compile_fts(_simplify(And(text)))
+        if expression is not None:
+            rest = [clause for clause in rest if _has_exact(clause)]
+    like = [compile_q(clause) for clause in rest]
+    return Plan(exact, expression, like)
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _cached_plan(query, use_fts):
+    return build_plan(parse(query), use_fts)
+
+
+def get_plan(query):
+    """Return the (cached) Plan of a query string."""
+    return _cached_plan(normalize(query), fulltext.is_available())
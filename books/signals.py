@@ -0,0 +1,208 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Signal receivers keeping the search structures, and the author and
+tag summaries, in sync with the models.  Connected from
+books.apps.BooksConfig.ready().
+
+Every change of the catalogue moves it to a new generation (see
+books.generation); the in-memory indexes of this process follow the
+change, those of the other processes rebuild on their next use.
+"""
+
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.db.models.signals import pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from taggit.models import Tag, TaggedItem
+
+from books import authors, autocomplete, bitmaps, booktext, fulltext, fuzzy
+from books import feedcache, fragments, generation, tagcounts
+from books.models import Book, Author, Language, TagGroup
+
+
+def _catalog_changed(bitmap_change=None, autocomplete_change=None):
+    """
+    Bump the catalogue generation and apply the change to the in-memory
+    indexes.  A missing change drops the index.
+    """
+    previous, new = generation.bump()
+    feedcache.cache.clear()
+    if bitmap_change is None:
+        bitmaps.index.reset()
+    else:
+        bitmaps.index.apply(previous, new, bitmap_change)
+    if autocomplete_change is None:
+        autocomplete.index.reset()
+    else:
+        autocomplete.index.apply(previous, new, autocomplete_change)
+
+
+def _unchanged(index):
+    pass
+
+
+def _add_entries(entries):
+    """Return the autocomplete change adding or updating `entries`."""
+    def change(index):
+        for entry in entries:
+            index.add(*entry)
+    return change
+
+
+@receiver(pre_save, sender=Book)
+def book_saving(sender, instance, raw=False, **kwargs):
+    # the summary of the previous author changes too, and those of the
+    # tags if the status changes
+    instance._previous = (None, None)
+    if instance.pk is not None and not raw:
+        instance._previous = Book.objects.filter(pk=instance.pk).values_list(
+            'a_author', 'a_status').first() or (None, None)
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        # fixtures loading, use the rebuild_search_index command
+        _catalog_changed()
+        return
+    previous_author_id, previous_status_id = instance._previous
+    author_ids = [instance.a_author_id, previous_author_id]
+    authors.refresh(author_ids)
+    # authors and tags are suggested publicly if they have published books
+    entries = [autocomplete.book_entry(instance)] + \
+        autocomplete.author_entries(author_ids)
+    if previous_status_id not in (None, instance.a_status_id):
+        tag_ids = tagcounts.book_tag_ids(instance)
+        tagcounts.refresh(tag_ids)
+        entries += autocomplete.tag_entries(tag_ids)
+    fulltext.index_book(instance)
+    fuzzy.index('book', instance.pk, instance.a_title)
+    booktext.forget_replaced_file(instance)
+    _catalog_changed(
+        lambda index: index.set_book(instance.pk, instance.a_status_id,
+                                     instance.dc_language_id,
+                                     instance.time_added),
+        _add_entries(entries))
+
+
+@receiver(pre_delete, sender=Book)
+def book_deleting(sender, instance, **kwargs):
+    # the tagged items are deleted with the book
+    instance._tag_ids = tagcounts.book_tag_ids(instance)
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    fragments.entries.forget(instance.pk)
+    fragments.publications.forget(instance.pk)
+    authors.refresh([instance.a_author_id])
+    tag_ids = getattr(instance, '_tag_ids', [])
+    tagcounts.refresh(tag_ids)
+    entries = autocomplete.author_entries([instance.a_author_id]) + \
+        autocomplete.tag_entries(tag_ids)
+    fulltext.unindex_book(instance.pk)
+    booktext.unindex_book(instance.pk)
+    fuzzy.unindex('book', instance.pk)
+
+    def autocomplete_change(index):
+        index.remove('book', instance.pk)
+        _add_entries(entries)(index)
+
+    _catalog_changed(lambda index: index.remove_book(instance.pk),
+                     autocomplete_change)
+
+
+@receiver(m2m_changed, sender=TaggedItem)
+def book_tags_changed(sender, instance, action, pk_set=None, **kwargs):
+    if action == 'pre_clear' and isinstance(instance, Book):
+        instance._tag_ids = tagcounts.book_tag_ids(instance)
+    if not action.startswith('post_'):
+        return
+    if not isinstance(instance, Book):
+        # the tags of a tag group
+        _catalog_changed(_unchanged, _unchanged)
+        return
+    if action == 'post_add':
+        change = lambda index: index.add_tags(instance.pk, pk_set)
+    elif action == 'post_remove':
+        change = lambda index: index.remove_tags(instance.pk, pk_set)
+    elif action == 'post_clear':
+        change = lambda index: index.remove_tags(instance.pk)
+        pk_set = getattr(instance, '_tag_ids', [])
+    else:
+        return
+    tagcounts.refresh(pk_set)
+    _catalog_changed(change, _add_entries(autocomplete.tag_entries(pk_set)))
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        _catalog_changed()
+        return
+    fuzzy.index('author', instance.pk, instance.a_author)
+    if not created:
+        fulltext.reindex_author(instance)
+        # the entries of the books show the author name
+        Book.objects.filter(a_author=instance).update(
+            a_updated=timezone.now())
+    authors.refresh([instance.pk])
+    _catalog_changed(
+        _unchanged, _add_entries(autocomplete.author_entries([instance.pk])))
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, **kwargs):
+    fuzzy.unindex('author', instance.pk)
+    _catalog_changed(
+        _unchanged, lambda index: index.remove('author', instance.pk))
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        _catalog_changed()
+        return
+    tagcounts.refresh([instance.pk])
+    _catalog_changed(
+        lambda index: index.set_tag(instance.pk, instance.name),
+        _add_entries(autocomplete.tag_entries([instance.pk])))
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    _catalog_changed(
+        lambda index: index.remove_tag(instance.pk),
+        lambda index: index.remove('tag', instance.pk))
+
+
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def language_changed(sender, instance, signal, **kwargs):
+    if signal is post_save:
+        # the entries of the books show the language code
+        books = Book.objects.filter(dc_language=instance)
+        books.update(a_updated=timezone.now())
+        authors.refresh(books.values_list('a_author', flat=True))
+    # rare, rebuild the language codes with the index
+    _catalog_changed(None, _unchanged)
+
+
+@receiver(post_save, sender=TagGroup)
+@receiver(post_delete, sender=TagGroup)
+def tag_group_changed(sender, **kwargs):
+    _catalog_changed(_unchanged, _unchanged)
@@ -0,0 +1,94 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Number of published books, and of books, of each tag, kept in the
+TagSummary table by the signals (see books.signals).
+
+The tag lists read this table alone, sorted by name or by number of
+books off its indexes, instead of listing every tag, even the ones
+without books.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
+
+from taggit.models import Tag, TaggedItem
+
+from books.app_settings import BOOK_PUBLISHED
+from books.models import Book, TagSummary
+from books.normalize import normalize_text
+
+
+def _counts(tagged_items, books):
+    """
+    Return the number of books and of published books by tag id, of
+    the `tagged_items` of the `books` model, in two queries.  The items
+    of a deleted book may still be there, they are not counted.
+    """
+    totals = dict(tagged_items.filter(
+        object_id__in=books.objects.values('pk')
+    ).order_by().values_list('tag').annotate(Count('pk')))
+    published = dict(tagged_items.filter(
+        object_id__in=books.objects.filter(
+            a_status=BOOK_PUBLISHED).values('pk')
+    ).order_by().values_list('tag').annotate(Count('pk')))
+    return totals, published
+
+
+def book_tag_ids(book):
+    """Return the ids of the tags of a book."""
+    return list(TaggedItem.objects.filter(
+        content_type=ContentType.objects.get_for_model(Book),
+        object_id=book.pk).values_list('tag', flat=True))
+
+
+def refresh(tag_ids):
+    """Update the summaries of the tags of `tag_ids`."""
+    tag_ids = set(tag_ids)
+    if not tag_ids:
+        return
+    totals, published = _counts(TaggedItem.objects.filter(
+        content_type=ContentType.objects.get_for_model(Book),
+        tag__in=tag_ids), Book)
+    for tag_id, name in Tag.objects.filter(pk__in=tag_ids).values_list(
+            'pk', 'name'):
+        TagSummary(tag_id=tag_id, sort_key=normalize_text(name)[:255],
+                   published_books=published.get(tag_id, 0),
+                   total_books=totals.get(tag_id, 0)).save()
+
+
+def build(tag_model, book_model, tagged_item_model, book_type,
+          summary_model):
+    """
+    Fill the empty summary table from the tagged books, `book_type`
+    being the ContentType of the books, or None if there is none yet.
+    The models are arguments for the migration creating the table.
+    """
+    totals, published = {}, {}
+    if book_type is not None:
+        totals, published = _counts(tagged_item_model.objects.filter(
+            content_type=book_type), book_model)
+    summary_model.objects.bulk_create(
+        summary_model(tag_id=tag_id, sort_key=normalize_text(name)[:255],
+                      published_books=published.get(tag_id, 0),
+                      total_books=totals.get(tag_id, 0))
+        for tag_id, name in tag_model.objects.values_list(
+            'pk', 'name').iterator())
+
+
+def rebuild():
+    TagSummary.objects.all().delete()
+    build(Tag, Book, TaggedItem, ContentType.objects.get_for_model(Book),
+          TagSummary)
@@ -1,11 +1,18 @@
+import json
 import os
+import shutil
+import tempfile
+from io import StringIO
 from time import sleep
 
 from django.test import TestCase
 from django.core.management import call_command, CommandError
 
+from taggit.models import Tag
+
+from books import filemeta, mirror
 from books.epub import Epub
-from books.models import Book
+from books.models import AuthorSummary, Book, TagGroup
 
 
 class AddBooksTest(TestCase):
@@ -54,3 +61,141 @@ class AddBooksTest(TestCase):
         opts = {"copy_file": 1}
         call_command('exportbooks', *args, **opts)
 
+
+
+class ExportMirrorTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid/The Dunwich Horror.epub')
+        self.book = Book.objects.get(pk=1)
+        self.book.tags.add('horror')
+        group = TagGroup.objects.create(name='lovecraft', slug='lovecraft')
+        group.tags.add('horror')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def export(self, **kwargs):
+        stats, errors = mirror.export(self.directory, processes=1, **kwargs)
+        self.assertEqual(errors, [])
+        return stats
+
+    def read(self, path):
+        with open(os.path.join(self.directory, path),
+                  encoding='utf-8') as page:
+            return page.read()
+
+    def test_export(self):
+        stats = self.export()
+        self.assertEqual(stats['rendered'], stats['pages'])
+        for path in ('index.html', 'latest/index.html', 'latest.atom',
+                     'latest.json', 'catalog.atom', 'tags/horror.atom',
+                     'by-tag/horror/index.html', 'book/1/view.html',
+                     'tags-groups/lovecraft.json', 'book/1/download.epub'):
+            self.assertTrue(os.path.exists(os.path.join(self.directory,
+                                                        path)), path)
+
+        # the links to the mirror are relative
+        self.assertIn('href="../book/1/view.html"',
+                      self.read('latest/index.html'))
+        self.assertIn('href="latest.atom"', self.read('catalog.atom'))
+        self.assertIn('"href":"book/1/download.epub"',
+                      self.read('latest.json'))
+        self.assertIn('href="../tags/horror.atom"',
+                      self.read('tags-groups/lovecraft.atom'))
+
+    def test_incremental(self):
+        self.export()
+        self.assertEqual(self.export()['rendered'], 0)
+
+        # a new tag changes the book, its lists and the tag lists
+        self.book.tags.add('weird')
+        stats = self.export()
+        self.assertTrue(0 < stats['rendered'] < stats['pages'])
+        self.assertIn('weird', self.read('book/1/view.html'))
+        self.assertTrue(os.path.exists(os.path.join(self.directory,
+                                                    'tags/weird.atom')))
+
+        Tag.objects.get(name='weird').delete()
+        self.assertEqual(self.export()['removed'], 3)
+        self.assertFalse(os.path.exists(os.path.join(self.directory,
+                                                     'tags/weird.atom')))
+
+        self.assertEqual(self.export(full=True)['rendered'],
+                         stats['pages'] - 3)
+
+    def test_full_removes(self):
+        self.book.tags.add('weird')
+        self.export()
+        Tag.objects.get(name='weird').delete()
+        stats = self.export(full=True)
+        self.assertEqual(stats['rendered'], stats['pages'])
+        self.assertEqual(stats['removed'], 3)
+        self.assertFalse(os.path.exists(os.path.join(self.directory,
+                                                     'tags/weird.atom')))
+
+    def test_command(self):
+        call_command('export_mirror', self.directory, processes=1,
+                     stdout=StringIO())
+        self.assertTrue(os.path.exists(os.path.join(self.directory,
+                                                    'catalog.json')))
+        self.assertRaises(CommandError, call_command, 'export_mirror',
+                          self.directory, processes=0)
+
+
+class FileMetadataTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid/The Dunwich Horror.epub')
+        self.book = Book.objects.get(pk=1)
+
+    def test_addepub(self):
+        self.assertEqual(self.book.file_size, os.path.getsize(
+            'examples/valid/The Dunwich Horror.epub'))
+        self.assertEqual(self.book.mimetype, 'application/epub+zip')
+        self.assertTrue(self.book.cover_mimetype.startswith('image/'))
+        self.assertTrue(self.book.cover_width and self.book.cover_height)
+
+    def test_image_size(self):
+        with open('examples/valid/The_Dunwich_Horror_cover.jpg', 'rb') as f:
+            data = f.read()
+        self.assertEqual(filemeta.image_size('image/jpeg', data), (329, 500))
+        png = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR'
+               b'\x00\x00\x01\x00\x00\x00\x00\x80')
+        self.assertEqual(filemeta.image_size('image/png', png), (256, 128))
+        self.assertIsNone(filemeta.image_size('image/jpeg', b'\xff\xd8'))
+
+    def test_feeds(self):
+        response = self.client.get('/latest.atom')
+        self.assertIn('length="%d"' % self.book.file_size,
+                      response.getvalue().decode('utf-8'))
+        response = self.client.get('/latest.json')
+        publication = json.loads(
+            response.getvalue().decode('utf-8'))['publications'][0]
+        self.assertEqual(publication['links'][0]['length'],
+                         self.book.file_size)
+        self.assertEqual(publication['images'][0]['width'],
+                         self.book.cover_width)
+
+    def test_update_file_metadata(self):
+        Book.objects.update(file_size=None, cover_mimetype='',
+                            cover_width=None, cover_height=None)
+        out = StringIO()
+        call_command('update_file_metadata', stdout=out)
+        self.assertIn('1 books updated', out.getvalue())
+        book = Book.objects.get(pk=1)
+        self.assertEqual(book.file_size, self.book.file_size)
+        self.assertEqual(book.cover_width, self.book.cover_width)
+        self.assertGreater(book.a_updated, self.book.a_updated)
+        self.assertEqual(AuthorSummary.objects.get(
+            author=book.a_author).updated, book.a_updated)
+
+        call_command('update_file_metadata', stdout=out)
+        self.assertIn('0 books updated', out.getvalue())
+
+    def test_save_without_file_metadata(self):
+        Book.objects.update(file_size=None, cover_mimetype='')
+        book = Book.objects.get(pk=1)
+        os.remove(book.book_file.path)
+        book.a_title = 'Renamed'
+        book.save()
+        book = Book.objects.get(pk=1)
+        self.assertEqual(book.a_title, 'Renamed')
+        self.assertIsNone(book.file_size)
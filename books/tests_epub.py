@@ -23,6 +23,18 @@ class EpubTest(TestCase):
         self.assertEqual(info.subject, ['English drama'])
         epub.close()
 
+    def test_text(self):
+        epub = Epub("examples/valid/The Dunwich Horror.epub")
+        self.assertEqual(len(epub.get_spine_paths()), 3)
+        chunks = list(epub.iter_text(chunk_size=2000))
+        self.assertTrue(all(len(chunk) <= 2000 for chunk in chunks))
+        self.assertTrue(chunks[0].startswith(
+            "The Project Gutenberg EBook of The Dunwich Horror"))
+        text = ' '.join(chunks)
+        self.assertIn("armigerous families which came from Salem", text)
+        self.assertNotIn("<", text)
+        epub.close()
+
     def test_epub_not_found(self):
         self.assertRaises(FileNotFoundError,
                           Epub, 'examples/invalid/not-found.epub')
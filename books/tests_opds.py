@@ -1,11 +1,27 @@
+import datetime
+import gzip
+import json
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
 from lxml import etree
 
+from taggit.models import Tag
+
+from django.contrib.auth.models import User
 from django.test import TestCase, Client
 from django.core.management import call_command, CommandError
+from django.http import HttpResponse, StreamingHttpResponse
 from django.urls import reverse_lazy
 
+from books import feedcache, fragments, generation, opds, pagination
+from books.atom import AtomFeed, WRITERS, rfc3339_date
+from books.opds import book_item
 from books.epub import Epub
-from books.models import Book, Author, TagGroup
+from books.models import Book, Author, AuthorSummary, Language, Status
+from books.models import TagGroup, TagSummary
 
 
 class OpfsTest(TestCase):
@@ -34,7 +50,7 @@ class OpfsTest(TestCase):
                      'by_title_feed', 'most_downloaded_feed',
                      'tags_listgroups', 'tags_feed'):
             d = c.get(reverse_lazy(opds))
-            parser = etree.fromstring(d.content)
+            parser = etree.fromstring(d.getvalue())
 
     def test_with_parameters(self):
         c = Client()
@@ -42,7 +58,7 @@ class OpfsTest(TestCase):
         # by author
         d = c.get(reverse_lazy('by_title_author_feed',
             kwargs=dict(author_id=1)))
-        parser = etree.fromstring(d.content)
+        parser = etree.fromstring(d.getvalue())
 
         # by tag_feed_atom, with unknow tag
         d = c.get(reverse_lazy('by_tag_feed',
@@ -52,7 +68,808 @@ class OpfsTest(TestCase):
         # by tag_feed_atom, with known tag
         d = c.get(reverse_lazy('by_tag_feed',
             kwargs={'tag': 'horror'}))
-        parser = etree.fromstring(d.content)
+        parser = etree.fromstring(d.getvalue())
 
         d = c.get(reverse_lazy('tag_groups_feed', kwargs={'group_slug': 'lovecraft'}))
-        parser = etree.fromstring(d.content)
+        parser = etree.fromstring(d.getvalue())
+
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+
+class OpenSearchTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+
+    def test_description(self):
+        d = Client().get(reverse_lazy('root_feed'))
+        root = etree.fromstring(d.getvalue())
+        link = root.find(ATOM + 'link[@rel="search"]')
+        self.assertEqual(link.get('href'), '/opensearch.xml')
+
+        d = Client().get(link.get('href'))
+        self.assertEqual(d['Content-Type'],
+                         'application/opensearchdescription+xml')
+        root = etree.fromstring(d.getvalue())
+        templates = [url.get('template') for url in root.findall(
+            '{http://a9.com/-/spec/opensearch/1.1/}Url')]
+        self.assertIn('http://testserver/search.atom?q={searchTerms}'
+                      '&page={startPage?}', templates)
+
+    def test_search_feed(self):
+        c = Client()
+        # warm the per process caches (full-text table, query plans)
+        c.get(reverse_lazy('search_feed'), {'q': 'gutenberg'}).getvalue()
+        feedcache.cache.clear()
+        # the catalogue state for the validators, then the page
+        with self.assertNumQueries(2):
+            d = c.get(reverse_lazy('search_feed'), {'q': 'gutenberg'})
+        root = etree.fromstring(d.getvalue())
+        self.assertEqual(len(root.findall(ATOM + 'entry')), 2)
+        self.assertIsNone(root.find(ATOM + 'link[@rel="next"]'))
+
+        d = c.get(reverse_lazy('search_feed'), {'q': 'dunwich'})
+        root = etree.fromstring(d.getvalue())
+        self.assertEqual([title.text for title in
+                          root.findall(ATOM + 'entry/' + ATOM + 'title')],
+                         ['The Dunwich Horror'])
+
+        d = c.get(reverse_lazy('search_feed'), {'q': ''})
+        root = etree.fromstring(d.getvalue())
+        self.assertEqual(root.findall(ATOM + 'entry'), [])
+
+    def test_search_feed_pages(self):
+        c = Client()
+        with mock.patch('books.views.BOOKS_PER_PAGE', 1):
+            d = c.get(reverse_lazy('search_feed'),
+                      {'q': 'gutenberg', 'page': ''})
+            root = etree.fromstring(d.getvalue())
+            self.assertEqual(len(root.findall(ATOM + 'entry')), 1)
+            self.assertIsNone(root.find(ATOM + 'link[@rel="previous"]'))
+            next_link = root.find(ATOM + 'link[@rel="next"]')
+            self.assertIn('page=2', next_link.get('href'))
+
+            d = c.get(reverse_lazy('search_feed'),
+                      {'q': 'gutenberg', 'page': 2})
+            root = etree.fromstring(d.getvalue())
+            self.assertEqual(len(root.findall(ATOM + 'entry')), 1)
+            self.assertIsNotNone(root.find(ATOM + 'link[@rel="previous"]'))
+            self.assertIsNone(root.find(ATOM + 'link[@rel="next"]'))
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+
+    def test_etag(self):
+        c = Client()
+        d = c.get(reverse_lazy('latest_feed'))
+        self.assertEqual(d.status_code, 200)
+        etag = d['ETag']
+
+        with self.assertNumQueries(1):
+            d = c.get(reverse_lazy('latest_feed'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(d.status_code, 304)
+
+        # other pages have their own validators
+        d = c.get(reverse_lazy('latest_feed'), {'page': 2},
+                  HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(d.status_code, 200)
+
+        book = Book.objects.get(a_title='Five Plays')
+        book.a_title = 'Six Plays'
+        book.save()
+        d = c.get(reverse_lazy('latest_feed'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(d.status_code, 200)
+        self.assertNotEqual(d['ETag'], etag)
+
+        # tag groups are part of the catalogue
+        etag = c.get(reverse_lazy('tags_listgroups'))['ETag']
+        TagGroup.objects.create(name='Theatre', slug='theatre')
+        d = c.get(reverse_lazy('tags_listgroups'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(d.status_code, 200)
+
+    def test_no_last_modified(self):
+        # changes made within a second would not be seen
+        c = Client()
+        d = c.get(reverse_lazy('tags_feed'))
+        self.assertFalse(d.has_header('Last-Modified'))
+        d = c.get(reverse_lazy('tags_feed'),
+                  HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(d.status_code, 200)
+
+    def test_html_pages(self):
+        d = Client().get(reverse_lazy('latest'))
+        self.assertFalse(d.has_header('ETag'))
+
+    def test_downloads(self):
+        c = Client()
+        d = c.get(reverse_lazy('most_downloaded_feed'))
+        self.assertFalse(d.has_header('Last-Modified'))
+        etag = d['ETag']
+        d = c.get(reverse_lazy('most_downloaded_feed'),
+                  HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(d.status_code, 304)
+        generation.count_download()
+        d = c.get(reverse_lazy('most_downloaded_feed'),
+                  HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(d.status_code, 200)
+
+
+class FeedCacheTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+
+    def test_cached_feed(self):
+        c = Client()
+        first = c.get(reverse_lazy('latest_feed'))
+        # rendered entirely, then sent from the cache
+        self.assertFalse(first.streaming)
+        content = first.getvalue()
+        with self.assertNumQueries(1):
+            d = c.get(reverse_lazy('latest_feed'))
+        self.assertEqual(d.getvalue(), content)
+        self.assertEqual(d['Content-Type'], first['Content-Type'])
+        self.assertEqual(d['ETag'], first['ETag'])
+
+        book = Book.objects.get(a_title='Five Plays')
+        book.a_title = 'Six Plays'
+        book.save()
+        d = c.get(reverse_lazy('latest_feed'))
+        self.assertIn(b'Six Plays', d.getvalue())
+
+    def test_compressed(self):
+        c = Client()
+        content = c.get(reverse_lazy('latest_feed')).getvalue()
+        d = c.get(reverse_lazy('latest_feed'),
+                  HTTP_ACCEPT_ENCODING='deflate, gzip')
+        self.assertEqual(d['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', d['Vary'])
+        self.assertEqual(gzip.decompress(d.getvalue()), content)
+        self.assertTrue(d['ETag'].startswith('W/'))
+        d = c.get(reverse_lazy('latest_feed'), HTTP_ACCEPT_ENCODING='gzip',
+                  HTTP_IF_NONE_MATCH=d['ETag'])
+        self.assertEqual(d.status_code, 304)
+
+        d = c.get(reverse_lazy('latest_feed'),
+                  HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(d.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', d['Vary'])
+        self.assertEqual(d.getvalue(), content)
+
+    def test_accepted_encodings(self):
+        self.assertEqual(feedcache.accepted_encodings('gzip, br;q=0.5'),
+                         {'gzip', 'br'})
+        self.assertEqual(feedcache.accepted_encodings('GZIP;q=0, *;q=x'),
+                         set())
+        self.assertEqual(feedcache.accepted_encodings(''), set())
+
+    def test_memory_bound(self):
+        cache = feedcache.FeedCache(10)
+        cache.get('a', 'token')
+        cache.put('a', 'token', b'12345', 'text/plain')
+        cache.put('b', 'token', b'1234', 'text/plain')
+        self.assertEqual(len(cache), 2)
+        cache.put('c', 'token', b'123', 'text/plain')
+        self.assertIsNone(cache.get('a', 'token'))
+        self.assertEqual(cache.size, 7)
+        # too large to be kept
+        cache.put('d', 'token', b'12345678901', 'text/plain')
+        self.assertIsNone(cache.get('d', 'token'))
+        # another generation
+        self.assertIsNone(cache.get('b', 'other'))
+        self.assertEqual(cache.size, 0)
+
+    def test_single_flight(self):
+        cache = feedcache.FeedCache(1000)
+        renders = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def render():
+            renders.append(1)
+            started.set()
+            release.wait(5)
+            return HttpResponse(b'feed', content_type='application/atom+xml')
+
+        responses = []
+
+        def request():
+            responses.append(cache.response('latest', 'token', render))
+
+        threads = [threading.Thread(target=request) for i in range(10)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(renders), 1)
+        self.assertEqual([response.content for response in responses],
+                         [b'feed'] * 10)
+
+    def test_followers_do_not_wait_for_the_transfer(self):
+        cache = feedcache.FeedCache(1000)
+        renders = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def render():
+            renders.append(1)
+            started.set()
+            release.wait(5)
+            return StreamingHttpResponse(
+                iter([b'fe', b'ed']), content_type='application/atom+xml')
+
+        responses = []
+        leader = threading.Thread(target=lambda: responses.append(
+            cache.response('latest', 'token', render)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: responses.append(
+            cache.response('latest', 'token', render)))
+        follower.start()
+        release.set()
+        leader.join()
+        # the leader's client has not read its response yet
+        follower.join(1)
+        self.assertFalse(follower.is_alive())
+        self.assertEqual(len(renders), 1)
+        self.assertEqual([response.content for response in responses],
+                         [b'feed'] * 2)
+
+    def test_too_large(self):
+        cache = feedcache.FeedCache(10)
+        response = cache.response('complete', 'token', lambda:
+                                  StreamingHttpResponse(iter([b'x' * 8] * 3)))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response.getvalue(), b'x' * 24)
+        self.assertIsNone(cache.get('complete', 'token'))
+        response = cache.response(
+            'complete', 'token',
+            lambda: StreamingHttpResponse(iter([b'x' * 8] * 3)), 'gzip')
+        self.assertEqual(gzip.decompress(response.getvalue()), b'x' * 24)
+
+    def test_too_large_concurrent(self):
+        cache = feedcache.FeedCache(10)
+        renders = []
+        release = threading.Event()
+
+        def render():
+            renders.append(1)
+            if len(renders) == 1:
+                release.wait(5)
+            return StreamingHttpResponse(iter([b'x' * 8] * 3))
+
+        responses = []
+
+        def request():
+            responses.append(cache.response('complete', 'token', render))
+
+        leader = threading.Thread(target=request)
+        leader.start()
+        while not renders:
+            leader.join(0.01)
+        follower = threading.Thread(target=request)
+        follower.start()
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        # once too large, rendered without waiting, while the previous
+        # responses are not sent
+        started = time.time()
+        request()
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(len(renders), 3)
+        self.assertEqual([response.getvalue() for response in responses],
+                         [b'x' * 24] * 3)
+
+
+class EntryFragmentTest(TestCase):
+    def setUp(self):
+        fragments.entries.clear()
+        call_command('addepub', 'examples/valid')
+
+    def test_fragment(self):
+        book = Book.objects.get(a_title='The Dunwich Horror')
+        feed = AtomFeed(atom_id='test', title='test')
+        direct = feed.serialize_item(book_item(book))
+        self.assertIn('<entry>', direct)
+
+        d = Client().get(reverse_lazy('latest_feed'))
+        self.assertIn(direct.encode('utf-8'), d.getvalue())
+        self.assertEqual(fragments.entries.get(book.pk, book.a_updated),
+                         direct)
+
+    def test_invalidation(self):
+        c = Client()
+        c.get(reverse_lazy('by_title_feed'))
+        self.assertTrue(len(fragments.entries))
+
+        author = Author.objects.get(a_author='H. P. Lovecraft')
+        author.a_author = 'Howard Phillips Lovecraft'
+        author.save()
+        d = c.get(reverse_lazy('by_title_feed'))
+        self.assertIn(b'Howard Phillips Lovecraft', d.getvalue())
+
+        language = Language.objects.get(code='en')
+        language.label = 'French'
+        language.save()
+        d = c.get(reverse_lazy('by_title_feed'))
+        self.assertIn(b'<dcterms:language>fr</dcterms:language>', d.getvalue())
+
+
+class StreamingFeedTest(TestCase):
+    def test_chunks(self):
+        now = datetime.datetime(2020, 1, 1)
+        items = [AtomFeed.make_item(str(i), 'Entry %d' % i, now)
+                 for i in range(50)]
+        feed = AtomFeed(atom_id='test', title='test', updated=now)
+        for item in items:
+            feed.items.append(item)
+        s = StringIO()
+        feed.write(s, 'UTF-8')
+
+        chunks = list(feed.generate('UTF-8', chunk_size=256))
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual(b''.join(chunks), s.getvalue().encode('utf-8'))
+
+        # items read while the feed is written
+        feed = AtomFeed(atom_id='test', title='test', updated=now)
+        self.assertEqual(b''.join(feed.generate('UTF-8', iter(items))),
+                         s.getvalue().encode('utf-8'))
+
+    def test_tags_feed(self):
+        call_command('addepub', 'examples/valid')
+        Book.objects.get(a_title='Five Plays').tags.add('theatre', 'plays')
+        d = Client().get(reverse_lazy('tags_feed'))
+        root = etree.fromstring(d.getvalue())
+        self.assertEqual(sorted(title.text for title in
+                                root.findall(ATOM + 'entry/' + ATOM + 'title')),
+                         ['English drama', 'plays', 'theatre'])
+
+
+class AtomWriterTest(TestCase):
+    def test_same_document(self):
+        now = datetime.datetime(2020, 1, 1)
+        documents = set()
+        for writer in WRITERS.values():
+            feed = AtomFeed(atom_id='test', title='Tom & "Jerry"',
+                            updated=now, writer=writer, extra_attrs={
+                                'xmlns:dcterms': 'http://purl.org/dc/terms/'},
+                            links=[{'rel': 'self', 'href': '/?a=1&b=2',
+                                    'title': 'it\'s "quoted"\n'}])
+            feed.add_item('1', '<Ünïcode>', now, content='a & b',
+                          authors=[{'name': 'রবীন্দ্রনাথ'}],
+                          dc_language='bn', dc_publisher='')
+            s = StringIO()
+            feed.write(s, 'UTF-8')
+            documents.add(s.getvalue())
+        self.assertEqual(len(documents), 1)
+        etree.fromstring(documents.pop().encode('utf-8'))
+
+
+class Opds2Test(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+        Book.objects.get(a_title='Five Plays').tags.add('theatre')
+        group = TagGroup.objects.create(name='Stage', slug='stage')
+        group.tags.add('theatre')
+
+    def get(self, name, kwargs=None, **params):
+        d = Client().get(reverse_lazy(name, kwargs=kwargs), params)
+        self.assertEqual(d.status_code, 200)
+        self.assertEqual(d['Content-Type'], 'application/opds+json')
+        return json.loads(d.getvalue().decode('utf-8'))
+
+    def test_navigation(self):
+        feed = self.get('root_json')
+        self.assertIn({'rel': 'subsection', 'href': '/latest.json',
+                       'type': 'application/opds+json', 'title': 'Latest'},
+                      feed['navigation'])
+        search = [link for link in feed['links'] if link['rel'] == 'search']
+        self.assertEqual(search[0]['href'], '/search.json{?query}')
+
+        feed = self.get('tags_json')
+        self.assertIn('/tags/theatre.json',
+                      [link['href'] for link in feed['navigation']])
+        feed = self.get('tags_listgroups_json')
+        self.assertEqual([link['href'] for link in feed['navigation']],
+                         ['/tags-groups/stage.json'])
+        feed = self.get('tag_groups_json', {'group_slug': 'stage'})
+        self.assertEqual([link['title'] for link in feed['navigation']],
+                         ['theatre'])
+
+        feed = self.get('by_author_json')
+        author = Author.objects.get(a_author='Lord Dunsany')
+        self.assertIn('/by-author/%d.json' % author.pk,
+                      [link['href'] for link in feed['navigation']])
+
+    def test_publications(self):
+        book = Book.objects.get(a_title='Five Plays')
+        feed = self.get('by_tag_json', {'tag': 'theatre'})
+        publication, = feed['publications']
+        self.assertEqual(publication['metadata']['title'], 'Five Plays')
+        self.assertEqual(publication['metadata']['identifier'],
+                         'urn:uuid:%s' % book.a_id)
+        self.assertEqual(publication['metadata']['author'],
+                         {'name': 'Lord Dunsany'})
+        self.assertEqual(publication['metadata']['language'], 'en')
+        self.assertEqual(publication['links'][0]['href'],
+                         '/book/%d/download' % book.pk)
+        self.assertTrue(publication['images'][0]['href'].endswith('.jpg'))
+
+        feed = self.get('by_title_author_json',
+                        {'author_id': book.a_author_id})
+        self.assertEqual(len(feed['publications']), 1)
+        for name in ('latest_json', 'by_title_json', 'most_downloaded_json'):
+            self.assertEqual(len(self.get(name)['publications']), 2)
+
+        feed = self.get('search_json', query='dunwich')
+        self.assertEqual([p['metadata']['title']
+                          for p in feed['publications']],
+                         ['The Dunwich Horror'])
+
+        feed = self.get('latest_json', q='plays')
+        languages = feed['facets'][0]
+        self.assertEqual(languages['metadata']['title'], 'Language')
+        self.assertEqual(languages['links'][0]['properties'],
+                         {'numberOfItems': 1})
+
+    def test_pages(self):
+        with mock.patch('books.views.BOOKS_PER_PAGE', 1):
+            feed = self.get('latest_json')
+            self.assertEqual(len(feed['publications']), 1)
+            self.assertNotIn('currentPage', feed['metadata'])
+            links = {link['rel']: link['href'] for link in feed['links']}
+            self.assertTrue(links['next'].startswith('/latest.json?cursor='))
+            d = Client().get(links['next'])
+            feed = json.loads(d.getvalue().decode('utf-8'))
+            self.assertIn('previous', [link['rel']
+                                       for link in feed['links']])
+
+            # the numbered pages of the previous links still work
+            feed = self.get('latest_json', page=2)
+            self.assertEqual(feed['metadata']['currentPage'], 2)
+            self.assertIn({'rel': 'previous', 'href': '/latest.json?page=1',
+                           'type': 'application/opds+json'}, feed['links'])
+
+    def test_conditional(self):
+        c = Client()
+        d = c.get(reverse_lazy('latest_json'))
+        d = c.get(reverse_lazy('latest_json'), HTTP_IF_NONE_MATCH=d['ETag'])
+        self.assertEqual(d.status_code, 304)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+        # copies of a book, two with the same title
+        for title in ('Same', 'Same', 'Another'):
+            book = Book.objects.get(a_title='The Dunwich Horror')
+            book.pk = None
+            book.a_id = None
+            book.a_title = title
+            book.file_sha256sum = title + str(Book.objects.count())
+            book.save()
+        # the same date too, the pages are ordered by pk
+        Book.objects.update(time_added=datetime.datetime(2017, 1, 1))
+
+    def ids(self, feed):
+        return [int(publication['links'][0]['href'].split('/')[2])
+                for publication in feed.get('publications', [])]
+
+    def walk(self, url, rel):
+        """Return the ids of the books and the url of the last page."""
+        ids = []
+        while True:
+            d = Client().get(url)
+            feed = json.loads(d.getvalue().decode('utf-8'))
+            ids.extend(self.ids(feed))
+            links = {link['rel']: link['href'] for link in feed['links']}
+            if rel not in links:
+                return ids, url
+            url = links[rel]
+
+    def test_walk(self):
+        orderings = {
+            'latest_json': ('-time_added', '-pk'),
+            'by_title_json': ('a_title', 'pk'),
+            'most_downloaded_json': ('-downloads', '-pk'),
+        }
+        with mock.patch('books.views.BOOKS_PER_PAGE', 2):
+            for name, ordering in orderings.items():
+                expected = list(Book.objects.order_by(
+                    *ordering).values_list('pk', flat=True))
+                ids, last = self.walk(reverse_lazy(name), 'next')
+                self.assertEqual(ids, expected)
+                # back from the last page: 5 books, pages of 2
+                ids, first = self.walk(last, 'previous')
+                self.assertEqual(ids, expected[4:] + expected[2:4]
+                                 + expected[:2])
+
+    def test_queries(self):
+        with mock.patch('books.views.BOOKS_PER_PAGE', 1):
+            ids, last = self.walk(reverse_lazy('by_title_json'), 'next')
+            feedcache.cache.clear()
+            # one query for the page, as for the first one, plus the
+            # catalog state and the published books count of the view
+            with self.assertNumQueries(3):
+                Client().get(last).getvalue()
+
+    def test_invalid_cursor(self):
+        for cursor in ('xxx', 'WyJuIl0', pagination.encode_cursor(
+                'next', Book.objects.first(), ('a_title', 'pk'))):
+            d = Client().get(reverse_lazy('latest_json'), {'cursor': cursor})
+            feed = json.loads(d.getvalue().decode('utf-8'))
+            self.assertEqual(len(feed['publications']), 5)
+
+    def test_cursor_types(self):
+        # ["n",1,2] and ["n",{},1]: values of the wrong types
+        for name in ('latest_feed', 'latest_json', 'most_downloaded_feed'):
+            for cursor in ('WyJuIiwxLDJd', 'WyJuIix7fSwxXQ'):
+                d = Client().get(reverse_lazy(name), {'cursor': cursor})
+                self.assertEqual(d.status_code, 200)
+        self.assertIsNone(pagination.decode_cursor(
+            'WyJuIiwxLDJd', Book, ('-time_added', '-pk')))
+        self.assertIsNone(pagination.decode_cursor(
+            'WyJuIix7fSwxXQ', Book, ('-downloads', '-pk')))
+
+    def test_authors(self):
+        with mock.patch('books.views.AUTHORS_PER_PAGE', 1):
+            ids, last = self.walk(reverse_lazy('by_author_json'), 'next')
+            d = Client().get(last)
+            feed = json.loads(d.getvalue().decode('utf-8'))
+            self.assertEqual([link['title'] for link in feed['navigation']],
+                             [Author.objects.order_by(
+                                 'a_author').last().a_author])
+
+
+class NavFeedTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+        self.book = Book.objects.get(a_title='Five Plays')
+        self.book.tags.add('theatre')
+        group = TagGroup.objects.create(name='Stage', slug='stage')
+        group.tags.add('theatre')
+        self.book.refresh_from_db()
+        feedcache.cache.clear()
+
+    def updated(self, name):
+        """Return the dates of the feed and of its entries."""
+        d = Client().get(reverse_lazy(name))
+        root = etree.fromstring(d.getvalue())
+        ns = {'atom': 'http://www.w3.org/2005/Atom'}
+        return (root.findtext('atom:updated', namespaces=ns),
+                {entry.findtext('atom:id', namespaces=ns):
+                 entry.findtext('atom:updated', namespaces=ns)
+                 for entry in root.findall('atom:entry', namespaces=ns)})
+
+    def test_dates(self):
+        newest = rfc3339_date(Book.objects.latest('a_updated').a_updated)
+        tagged = rfc3339_date(self.book.a_updated)
+        updated, entries = self.updated('root_feed')
+        self.assertEqual(updated, newest)
+        self.assertEqual(entries['latest'], newest)
+        self.assertEqual(entries['tags'], tagged)
+        self.assertEqual(entries['tag-groups'], tagged)
+
+        # the same document until the catalogue changes
+        feedcache.cache.clear()
+        self.assertEqual(self.updated('root_feed'), (updated, entries))
+
+        updated, entries = self.updated('tags_listgroups')
+        self.assertEqual(entries, {'stage': tagged})
+        updated, entries = self.updated('tags_feed')
+        self.assertEqual(entries['theatre'], tagged)
+
+        d = Client().get(reverse_lazy('root_json'))
+        feed = json.loads(d.getvalue().decode('utf-8'))
+        self.assertEqual(feed['metadata']['modified'], newest)
+
+    def test_generation(self):
+        with mock.patch('books.opds.generate_root_catalog',
+                        wraps=opds.generate_root_catalog) as render:
+            for i in range(2):
+                feedcache.cache.clear()
+                Client().get(reverse_lazy('root_feed')).getvalue()
+            self.assertEqual(render.call_count, 1)
+
+            self.book.a_title = 'Five Plays, revised'
+            self.book.save()
+            Client().get(reverse_lazy('root_feed')).getvalue()
+            self.assertEqual(render.call_count, 2)
+        updated, entries = self.updated('root_feed')
+        self.assertEqual(updated, rfc3339_date(
+            Book.objects.get(pk=self.book.pk).a_updated))
+
+
+class AuthorSummaryTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+        self.book = Book.objects.get(a_title='Five Plays')
+        self.author = self.book.a_author
+
+    def summary(self, author):
+        return AuthorSummary.objects.get(pk=author.pk)
+
+    def test_maintained(self):
+        summary = self.summary(self.author)
+        self.assertEqual((summary.sort_key, summary.published_books,
+                          summary.total_books, summary.updated),
+                         ('lord dunsany', 1, 1, self.book.a_updated))
+
+        self.book.a_status = Status.objects.get(status='Draft')
+        self.book.save()
+        summary = self.summary(self.author)
+        self.assertEqual((summary.published_books, summary.total_books,
+                          summary.updated), (0, 1, None))
+
+        other = Author.objects.create(a_author='Édouard Dunsany')
+        self.assertEqual(self.summary(other).sort_key, 'edouard dunsany')
+        self.book.a_author = other
+        self.book.save()
+        self.assertEqual(self.summary(self.author).total_books, 0)
+        self.assertEqual(self.summary(other).total_books, 1)
+
+        self.book.delete()
+        self.assertEqual(self.summary(other).total_books, 0)
+
+    def test_feeds(self):
+        feedcache.cache.clear()
+        d = Client().get(reverse_lazy('by_author_feed'))
+        root = etree.fromstring(d.getvalue())
+        ns = {'atom': 'http://www.w3.org/2005/Atom',
+              'thr': 'http://purl.org/syndication/thread/1.0'}
+        entries = root.findall('atom:entry', namespaces=ns)
+        self.assertEqual([entry.findtext('atom:title', namespaces=ns)
+                          for entry in entries],
+                         ['H. P. Lovecraft', 'Lord Dunsany'])
+        self.assertEqual(entries[1].findtext('atom:updated', namespaces=ns),
+                         rfc3339_date(self.book.a_updated))
+        link = entries[1].find('atom:link', namespaces=ns)
+        self.assertEqual(link.get('{%s}count' % ns['thr']), '1')
+
+        # the authors without published books are not listed
+        self.book.a_status = Status.objects.get(status='Draft')
+        self.book.save()
+        d = Client().get(reverse_lazy('by_author_json'))
+        feed = json.loads(d.getvalue().decode('utf-8'))
+        self.assertEqual([(link['title'], link['properties'])
+                          for link in feed['navigation']],
+                         [('H. P. Lovecraft', {'numberOfItems': 1})])
+
+        # but are to the librarians, dated from the catalogue
+        self.client.force_login(
+            User.objects.create_user('librarian', password='secret'))
+        root = etree.fromstring(self.client.get(
+            reverse_lazy('by_author_feed')).getvalue())
+        entries = root.findall('atom:entry', namespaces=ns)
+        self.assertEqual(entries[1].findtext('atom:updated', namespaces=ns),
+                         rfc3339_date(generation.state()[1]))
+
+
+class TagSummaryTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+        self.plays = Book.objects.get(a_title='Five Plays')
+        self.horror = Book.objects.get(a_title='The Dunwich Horror')
+        self.plays.tags.add('theatre', 'classic')
+        self.horror.tags.add('classic', 'Unused')
+        self.horror.tags.remove('Unused')
+
+    def counts(self, name):
+        summary = TagSummary.objects.get(tag__name=name)
+        return summary.published_books, summary.total_books
+
+    def test_maintained(self):
+        self.assertEqual(self.counts('classic'), (2, 2))
+        self.assertEqual(self.counts('Unused'), (0, 0))
+
+        self.plays.a_status = Status.objects.get(status='Draft')
+        self.plays.save()
+        self.assertEqual(self.counts('classic'), (1, 2))
+        self.assertEqual(self.counts('theatre'), (0, 1))
+
+        self.plays.tags.clear()
+        self.assertEqual(self.counts('classic'), (1, 1))
+        self.horror.delete()
+        self.assertEqual(self.counts('classic'), (0, 0))
+
+        tag = Tag.objects.get(name='classic')
+        tag.name = 'Éclectic'
+        tag.save()
+        self.assertEqual(TagSummary.objects.get(tag=tag).sort_key,
+                         'eclectic')
+
+    def names(self, name, **params):
+        d = Client().get(reverse_lazy(name), params)
+        feed = json.loads(d.getvalue().decode('utf-8'))
+        links = {link['rel']: link['href'] for link in feed['links']}
+        return [(link['title'], link['properties']['numberOfItems'])
+                for link in feed['navigation']], links
+
+    def test_feeds(self):
+        feedcache.cache.clear()
+        names, links = self.names('tags_json')
+        # the tags without published books are hidden
+        self.assertEqual(names, [('classic', 2), ('English drama', 1),
+                                 ('theatre', 1)])
+        names, links = self.names('tags_json', sort='count')
+        self.assertEqual(names[0], ('classic', 2))
+
+        feedcache.cache.clear()
+        with mock.patch('books.views.TAGS_PER_PAGE', 2):
+            names, links = self.names('tags_json')
+            self.assertEqual(len(names), 2)
+            d = Client().get(links['next'])
+            feed = json.loads(d.getvalue().decode('utf-8'))
+            self.assertEqual([link['title'] for link in feed['navigation']],
+                             ['theatre'])
+
+            d = Client().get(reverse_lazy('tags'), {'page': 2})
+            self.assertContains(d, '2 of 2')
+            self.assertContains(d, 'theatre')
+
+        d = Client().get(reverse_lazy('tags_feed'))
+        root = etree.fromstring(d.getvalue())
+        ns = {'atom': 'http://www.w3.org/2005/Atom',
+              'thr': 'http://purl.org/syndication/thread/1.0'}
+        counts = [link.get('{%s}count' % ns['thr']) for link in root.findall(
+            'atom:entry/atom:link', namespaces=ns)]
+        self.assertEqual(counts, ['2', '1', '1'])
+
+
+class CompleteFeedTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+        self.draft = Book.objects.get(a_title='Five Plays')
+        self.draft.a_status_id = 2
+        self.draft.save()
+        feedcache.cache.clear()
+
+    def entries(self, content):
+        root = etree.fromstring(content)
+        return root, [entry.findtext(ATOM + 'title')
+                      for entry in root.findall(ATOM + 'entry')]
+
+    def test_complete(self):
+        d = Client().get(reverse_lazy('complete_feed'))
+        self.assertTrue(d.streaming)
+        root, titles = self.entries(d.getvalue())
+        self.assertEqual(titles, ['The Dunwich Horror'])
+        # streamed to each request, not cached
+        self.assertEqual(len(feedcache.cache), 0)
+        self.assertIsNotNone(root.find(
+            '{http://purl.org/syndication/history/1.0}complete'))
+        self.assertIsNone(root.find(ATOM + 'link[@rel="next"]'))
+
+        # linked from the root catalog
+        d = Client().get(reverse_lazy('root_feed'))
+        root = etree.fromstring(d.getvalue())
+        link = root.find(ATOM + 'link[@rel="%s"]' % opds.CRAWLABLE)
+        self.assertEqual(link.get('href'), str(reverse_lazy('complete_feed')))
+
+    def test_chunks(self):
+        self.client.force_login(
+            User.objects.create_user('librarian', password='secret'))
+        expected = list(Book.objects.order_by(
+            '-time_added', '-pk').values_list('a_title', flat=True))
+        with mock.patch('books.views.COMPLETE_FEED_CHUNK_SIZE', 1):
+            d = self.client.get(reverse_lazy('complete_feed'))
+            root, titles = self.entries(d.getvalue())
+        self.assertEqual(titles, expected)
+
+    def test_streamed_compressed(self):
+        content = Client().get(reverse_lazy('complete_feed')).getvalue()
+        d = Client().get(reverse_lazy('complete_feed'),
+                         HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(d.streaming)
+        self.assertEqual(d['Content-Encoding'], 'gzip')
+        self.assertTrue(d['ETag'].startswith('W/'))
+        self.assertEqual(gzip.decompress(d.getvalue()), content)
+        d = Client().get(reverse_lazy('complete_feed'),
+                         HTTP_ACCEPT_ENCODING='gzip',
+                         HTTP_IF_NONE_MATCH=d['ETag'])
+        self.assertEqual(d.status_code, 304)
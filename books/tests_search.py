@@ -0,0 +1,620 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from lxml import etree
+
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, Client
+from django.core.management import call_command
+from django.urls import reverse_lazy
+
+from taggit.models import Tag
+
+from books import autocomplete, benchmark, bitmaps, booktext, fulltext
+from books import fuzzy, generation, resultcache, searchquery
+from books.models import (Book, Author, AuthorSummary, BookText, Status,
+                          TagGroup, TagSummary, Trigram)
+from books.search import simple_search, advanced_search
+
+
+class FullTextSearchTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+        self.dunwich = Book.objects.get(a_title='The Dunwich Horror')
+        self.plays = Book.objects.get(a_title='Five Plays')
+
+    def titles(self, queryset):
+        return sorted(book.a_title for book in queryset)
+
+    def test_index_available(self):
+        self.assertTrue(fulltext.is_available())
+
+    def test_advanced_search(self):
+        books = Book.objects.all()
+        self.assertEqual(self.titles(advanced_search(books, 'dunwich')),
+                         ['The Dunwich Horror'])
+        self.assertEqual(self.titles(advanced_search(books, 'lord')),
+                         ['Five Plays'])
+        self.assertEqual(self.titles(advanced_search(books, 'author:lovecr')),
+                         ['The Dunwich Horror'])
+        self.assertEqual(self.titles(advanced_search(books, 'title:lovecraft')),
+                         [])
+        self.assertEqual(
+            self.titles(advanced_search(books, 'gutenberg AND author:dunsany')),
+            ['Five Plays'])
+        self.assertEqual(self.titles(advanced_search(books, 'lang:en')),
+                         ['Five Plays', 'The Dunwich Horror'])
+
+    def test_query_language(self):
+        self.plays.a_title = 'Five Plays: drama'
+        self.plays.save()
+        books = Book.objects.all()
+        for use_fts in (True, False):
+            with mock.patch('books.fulltext.is_available',
+                            return_value=use_fts):
+                self.assertEqual(
+                    self.titles(advanced_search(books, 'horror OR plays')),
+                    ['Five Plays: drama', 'The Dunwich Horror'])
+                self.assertEqual(
+                    self.titles(advanced_search(books, 'gutenberg NOT horror')),
+                    ['Five Plays: drama'])
+                self.assertEqual(
+                    self.titles(advanced_search(books, '-horror')),
+                    ['Five Plays: drama'])
+                self.assertEqual(
+                    self.titles(advanced_search(books, 'title:"dunwich horror"')),
+                    ['The Dunwich Horror'])
+                self.assertEqual(
+                    self.titles(advanced_search(books, 'title:"horror dunwich"')),
+                    [])
+                self.assertEqual(
+                    self.titles(advanced_search(
+                        books, 'author:(lord OR lovecraft) lang:en')),
+                    ['Five Plays: drama', 'The Dunwich Horror'])
+                self.assertEqual(
+                    self.titles(advanced_search(
+                        books, 'identifier:http://www.gutenberg.org/ebooks/41311')),
+                    ['Five Plays: drama'])
+                self.assertEqual(
+                    self.titles(advanced_search(books, 'identifier:41311')),
+                    [])
+                self.assertEqual(
+                    self.titles(advanced_search(books, 'lang:fr OR plays')),
+                    ['Five Plays: drama'])
+                # a colon in a title is not a field
+                self.assertEqual(
+                    self.titles(advanced_search(books, 'Plays: drama')),
+                    ['Five Plays: drama'])
+
+    def test_query_parser(self):
+        self.assertEqual(str(searchquery.parse('a b OR c NOT d')),
+                         '((a AND b) OR (c AND NOT d))')
+        self.assertEqual(str(searchquery.parse('Title:"x y" ((z')),
+                         '(title:"x y" AND z)')
+        self.assertEqual(str(searchquery.parse('author:(a OR b))')),
+                         '(author:a OR author:b)')
+        self.assertEqual(str(searchquery.parse('war and peace: x')),
+                         '(war AND and AND peace: AND x)')
+        self.assertIsNone(searchquery.parse('  AND OR ()'))
+
+    def test_query_plan(self):
+        plan = searchquery.get_plan('horror lang:en  identifier:x')
+        self.assertIs(plan, searchquery.get_plan(' horror lang:en identifier:x'))
+        self.assertEqual(len(plan.exact), 2)
+        self.assertEqual(plan.expression, '"horror"*')
+        self.assertEqual(plan.like, [])
+
+        plan = searchquery.get_plan('horror (lang:en OR title:x)')
+        self.assertEqual(plan.expression, '"horror"*')
+        self.assertEqual(len(plan.like), 1)
+
+    def test_simple_search(self):
+        books = Book.objects.all()
+        self.assertEqual(
+            self.titles(simple_search(books, 'plays', search_title=True)),
+            ['Five Plays'])
+        self.assertEqual(
+            self.titles(simple_search(books, 'plays', search_author=True)),
+            [])
+
+    def test_ranked(self):
+        self.plays.a_summary = 'dunwich'
+        self.plays.save()
+        books = advanced_search(Book.objects.all(), 'dunwich', ranked=True)
+        self.assertEqual([book.a_title for book in books],
+                         ['The Dunwich Horror', 'Five Plays'])
+
+    def test_index_follows_changes(self):
+        books = Book.objects.all()
+        author = Author.objects.get(a_author='Lord Dunsany')
+        author.a_author = 'Edward Plunkett'
+        author.save()
+        self.assertEqual(self.titles(advanced_search(books, 'plunkett')),
+                         ['Five Plays'])
+
+        self.dunwich.delete()
+        self.assertEqual(self.titles(advanced_search(books, 'dunwich')), [])
+
+        call_command('rebuild_search_index')
+        self.assertEqual(self.titles(advanced_search(books, 'plunkett')),
+                         ['Five Plays'])
+
+    def test_like_fallback(self):
+        books = Book.objects.all()
+        with mock.patch('books.fulltext.is_available', return_value=False):
+            self.assertEqual(self.titles(advanced_search(books, 'unwic')),
+                             ['The Dunwich Horror'])
+            self.assertEqual(
+                self.titles(simple_search(books, 'plays', search_title=True)),
+                ['Five Plays'])
+
+    def test_like_words(self):
+        self.plays.a_title = 'The War of the Worlds'
+        self.plays.save()
+        self.dunwich.a_title = 'War and Peace'
+        self.dunwich.save()
+        books = Book.objects.order_by('a_title')
+        with mock.patch('books.fulltext.is_available', return_value=False):
+            # starting with the word, or with it in the middle
+            self.assertEqual(
+                self.titles(simple_search(books, 'war', search_title=True)),
+                ['The War of the Worlds', 'War and Peace'])
+            self.assertEqual(
+                [book.a_title for book in simple_search(
+                    books, 'war', search_title=True, ranked=True)],
+                ['War and Peace', 'The War of the Worlds'])
+            # the words at the start of the titles use the index
+            found = simple_search(books, 'war', search_title=True)
+            self.assertIn('"a_title_normalized" >=', str(found.query))
+            self.assertEqual(
+                self.titles(simple_search(books, 'ar', search_title=True)),
+                [])
+
+    def test_normalized_columns(self):
+        self.dunwich.a_title = 'Éducation Sentimentale'
+        self.dunwich.save()
+        self.dunwich.a_author.a_author = 'Gustave FLAUBERT'
+        self.dunwich.a_author.save()
+        self.assertEqual(Book.objects.get(pk=self.dunwich.pk)
+                         .a_title_normalized, 'education sentimentale')
+        self.assertEqual(Author.objects.get(pk=self.dunwich.a_author.pk)
+                         .a_author_normalized, 'gustave flaubert')
+
+        books = Book.objects.all()
+        with mock.patch('books.fulltext.is_available', return_value=False):
+            found = simple_search(books, 'EDUC', search_title=True)
+            self.assertEqual(self.titles(found), ['Éducation Sentimentale'])
+            self.assertEqual(
+                self.titles(simple_search(books, 'flaubert',
+                                          search_author=True)),
+                ['Éducation Sentimentale'])
+            self.assertEqual(
+                self.titles(advanced_search(books, 'title:sentimentale')),
+                ['Éducation Sentimentale'])
+
+            self.dunwich.a_title = 'हिन्दी कहानियाँ'
+            self.dunwich.save()
+            self.assertEqual(
+                self.titles(simple_search(books, 'कहानियाँ',
+                                          search_title=True)),
+                ['हिन्दी कहानियाँ'])
+
+    def test_search_views(self):
+        c = Client()
+        for view in ('latest', 'by_title', 'by_author', 'latest_feed',
+                     'by_author_feed'):
+            d = c.get(reverse_lazy(view), {'q': 'dunwich'})
+            self.assertEqual(d.status_code, 200)
+        d = c.get(reverse_lazy('latest'),
+                  {'q': 'dunwich', 'search-title': 'on'})
+        self.assertEqual(list(d.context['book_list']), [self.dunwich])
+
+
+class SuggestionsTest(TestCase):
+    def setUp(self):
+        autocomplete.index.reset()
+        call_command('addepub', 'examples/valid')
+        self.dunwich = Book.objects.get(a_title='The Dunwich Horror')
+
+    def suggestions(self, q):
+        d = Client().get(reverse_lazy('search_suggestions'), {'q': q})
+        self.assertEqual(d.status_code, 200)
+        return [(item['type'], item['label']) for item in d.json()['results']]
+
+    def test_lookup(self):
+        self.assertEqual(self.suggestions('dun'),
+                         [('author', 'Lord Dunsany'),
+                          ('book', 'The Dunwich Horror')])
+        self.assertEqual(self.suggestions('HOR dunw'),
+                         [('book', 'The Dunwich Horror')])
+        self.assertEqual(self.suggestions('english'),
+                         [('tag', 'English drama')])
+        self.assertEqual(self.suggestions('xyz'), [])
+        self.assertEqual(self.suggestions(''), [])
+
+    def test_updates(self):
+        self.assertEqual(self.suggestions('dunwich'),
+                         [('book', 'The Dunwich Horror')])
+        self.dunwich.a_title = 'The Colour Out of Space'
+        self.dunwich.save()
+        self.assertEqual(self.suggestions('dunwich'), [])
+        self.assertEqual(self.suggestions('colour'),
+                         [('book', 'The Colour Out of Space')])
+
+        self.dunwich.a_status = Status.objects.get(status='Draft')
+        self.dunwich.save()
+        self.assertEqual(self.suggestions('colour'), [])
+
+        self.dunwich.delete()
+        self.assertEqual(self.suggestions('colour'), [])
+
+    def test_public_authors_and_tags(self):
+        # only suggested to the anonymous users with published books
+        smith = Author.objects.create(a_author='Clark Ashton Smith')
+        self.assertEqual(self.suggestions('ashton'), [])
+        self.dunwich.a_author = smith
+        self.dunwich.save()
+        self.assertEqual(self.suggestions('ashton'),
+                         [('author', 'Clark Ashton Smith')])
+        self.dunwich.tags.add('weird fiction')
+        self.assertEqual(self.suggestions('weird'),
+                         [('tag', 'weird fiction')])
+
+        self.dunwich.a_status = Status.objects.get(status='Draft')
+        self.dunwich.save()
+        self.assertEqual(self.suggestions('ashton'), [])
+        self.assertEqual(self.suggestions('weird'), [])
+        # rebuilt index
+        autocomplete.index.reset()
+        self.assertEqual(self.suggestions('weird'), [])
+        self.assertEqual(autocomplete.index.get().lookup('weird'),
+                         [('tag', Tag.objects.get(name='weird fiction').pk,
+                           'weird fiction')])
+
+
+class BitmapIndexTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+        self.dunwich = Book.objects.get(a_title='The Dunwich Horror')
+        self.plays = Book.objects.get(a_title='Five Plays')
+
+    def titles(self, params=None, **kwargs):
+        d = Client().get(reverse_lazy('latest', **kwargs), params or {})
+        self.assertEqual(d.status_code, 200)
+        return [book.a_title for book in d.context['book_list']]
+
+    def test_ids_desc(self):
+        bits = (1 << 3) | (1 << 5) | (1 << 9000) | (1 << 9001)
+        self.assertEqual(bitmaps.ids_desc(bits, 0, 10), [9001, 9000, 5, 3])
+        self.assertEqual(bitmaps.ids_desc(bits, 1, 3), [9000, 5])
+        self.assertEqual(bitmaps.ids_desc(bits, 3, 10), [3])
+        self.assertEqual(bitmaps.ids_desc(bits, 4, 10), [])
+        self.assertEqual(bitmaps.ids_desc(0, 0, 10), [])
+
+    def test_select(self):
+        index = bitmaps.build_index()
+        self.assertEqual(index.book_counts(), (2, 0))
+        plays = 1 << index.positions[self.plays.pk]
+        both = (1 << index.positions[self.dunwich.pk]) | plays
+        self.assertEqual(index.select(language_code='en'), both)
+        self.assertEqual(index.select(language_code='fr'), 0)
+        self.assertEqual(index.select(tag='English drama'), plays)
+        self.assertEqual(index.select(tag='Unknown'), 0)
+
+    def test_time_order(self):
+        # the latest book imported with an older date
+        latest = Book.objects.order_by('-pk').first()
+        Book.objects.filter(pk=latest.pk).update(
+            time_added=datetime.datetime(2000, 1, 1))
+        generation.bump()
+        expected = list(Book.objects.order_by(
+            '-time_added', '-pk').values_list('a_title', flat=True))
+        self.assertEqual(expected[-1], latest.a_title)
+        self.assertEqual(self.titles(), expected)
+
+        index = bitmaps.build_index()
+        self.assertRaises(generation.OutOfSync, index.set_book, 1000, 1,
+                          None, datetime.datetime(2001, 1, 1))
+
+    def test_lists_match_queries(self):
+        self.assertEqual(self.titles(),
+                         [book.a_title for book in Book.objects.all()])
+        self.assertEqual(self.titles({'lang': 'en', 'tag': 'English drama'}),
+                         ['Five Plays'])
+        d = Client().get(reverse_lazy('by_tag', args=['English drama']))
+        self.assertEqual(list(d.context['book_list']), [self.plays])
+
+    def test_incremental_updates(self):
+        self.assertEqual(len(self.titles()), 2)
+        self.dunwich.tags.add('Horror')
+        self.assertEqual(self.titles({'tag': 'Horror'}),
+                         ['The Dunwich Horror'])
+        self.dunwich.tags.clear()
+        self.assertEqual(self.titles({'tag': 'Horror'}), [])
+
+        self.dunwich.a_status = Status.objects.get(status='Draft')
+        self.dunwich.save()
+        self.assertEqual(self.titles(), ['Five Plays'])
+        self.assertEqual(self.titles({'status': self.dunwich.a_status_id}),
+                         [])
+        self.plays.delete()
+        self.assertEqual(self.titles(), [])
+
+    def test_other_process_changes(self):
+        self.assertEqual(len(self.titles()), 2)
+        # An update made by another process: bypass the signals, and
+        # bump the generation as that process would.
+        Book.objects.filter(pk=self.dunwich.pk).update(
+            a_status=Status.objects.get(status='Draft'))
+        self.assertEqual(len(self.titles()), 2)
+        generation.bump()
+        self.assertEqual(self.titles(), ['Five Plays'])
+
+    def test_tag_group(self):
+        group = TagGroup.objects.create(name='Theatre', slug='theatre')
+        group.tags.add('English drama')
+        self.assertEqual(self.titles({'group': 'theatre'}), ['Five Plays'])
+        self.assertEqual(self.titles({'group': 'unknown'}), [])
+
+        d = Client().get(reverse_lazy('latest'),
+                         {'q': 'gutenberg', 'group': 'theatre'})
+        self.assertEqual([book.a_title for book in d.context['book_list']],
+                         ['Five Plays'])
+
+
+class ResultCacheTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+        self.dunwich = Book.objects.get(a_title='The Dunwich Horror')
+        self.plays = Book.objects.get(a_title='Five Plays')
+
+    def search(self, params):
+        d = Client().get(reverse_lazy('latest'), params)
+        self.assertEqual(d.status_code, 200)
+        return [book.a_title for book in d.context['book_list']]
+
+    def test_cached_pages(self):
+        with mock.patch('books.views.BOOKS_PER_PAGE', 1):
+            with mock.patch('books.views.advanced_search',
+                            wraps=advanced_search) as search:
+                first = self.search({'q': 'gutenberg'})
+                second = self.search({'q': '  gutenberg ', 'page': 2})
+                self.assertEqual(search.call_count, 1)
+                self.assertEqual(sorted(first + second),
+                                 ['Five Plays', 'The Dunwich Horror'])
+                self.assertEqual(self.search({'q': 'gutenberg',
+                                              'lang': 'en'}), first)
+                self.assertEqual(search.call_count, 2)
+
+                self.plays.a_title = 'Six Plays'
+                self.plays.save()
+                self.search({'q': 'gutenberg'})
+                self.assertEqual(search.call_count, 3)
+
+    def test_lru(self):
+        cache = resultcache.ResultCache(2, 100)
+        cache.get('a', 'token')
+        cache.put('a', 'token', [1, 2], None)
+        cache.put('b', 'token', [3], None)
+        self.assertEqual(cache.get('a', 'token').ids.tolist(), [1, 2])
+        cache.put('c', 'token', [], None)
+        self.assertIsNone(cache.get('b', 'token'))
+        self.assertEqual(cache.get('a', 'token').ids.tolist(), [1, 2])
+        # results computed for a previous generation are not kept
+        cache.put('d', 'old token', [4], None)
+        self.assertIsNone(cache.get('d', 'token'))
+        self.assertIsNone(cache.get('a', 'new token'))
+        self.assertEqual(len(cache), 0)
+
+    def test_ids_bound(self):
+        cache = resultcache.ResultCache(10, 5)
+        cache.get('a', 'token')
+        cache.put('a', 'token', [1, 2, 3], None)
+        cache.put('b', 'token', [4, 5], None)
+        self.assertEqual(cache.ids_count, 5)
+        cache.put('c', 'token', [6], None)
+        self.assertIsNone(cache.get('a', 'token'))
+        self.assertEqual(cache.ids_count, 3)
+        # larger than the whole cache, returned but not kept
+        results = cache.put('d', 'token', range(6), None)
+        self.assertEqual(len(results.ids), 6)
+        self.assertIsNone(cache.get('d', 'token'))
+        self.assertEqual(len(cache), 2)
+
+    def test_keys(self):
+        params = QueryDict('q=dunwich%20%20horror&page=3&lang=en')
+        self.assertEqual(
+            resultcache.make_key(params, 'latest', {'qtype': 'feed'}),
+            resultcache.make_key(QueryDict('lang=en&q=dunwich horror'),
+                                 'latest'))
+        self.assertNotEqual(
+            resultcache.make_key(params, 'latest', authenticated=True),
+            resultcache.make_key(params, 'latest'))
+        self.assertNotEqual(
+            resultcache.make_key(params, 'by-title', {'author_id': '1'}),
+            resultcache.make_key(params, 'by-title'))
+
+
+class BookTextTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+        self.dunwich = Book.objects.get(a_title='The Dunwich Horror')
+
+    def search(self, q):
+        d = Client().get(reverse_lazy('latest'),
+                         {'q': q, 'search-text': 'on'})
+        self.assertEqual(d.status_code, 200)
+        return d.context['book_list']
+
+    def test_search_text(self):
+        self.assertEqual(BookText.objects.count(), 2)
+        # only in the text of the book
+        self.assertEqual(list(Book.objects.filter(a_summary__icontains=
+                                                  'armigerous')), [])
+        books = self.search('armigerous')
+        self.assertEqual(list(books), [self.dunwich])
+        self.assertIn('<mark>armigerous</mark>', books[0].text_snippet)
+        self.assertEqual(list(self.search('xyzzy')), [])
+
+        self.dunwich.delete()
+        self.assertEqual(list(self.search('armigerous')), [])
+
+    def test_resume_command(self):
+        BookText.objects.filter(book=self.dunwich).delete()
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % booktext.TEXT_TABLE)
+        self.assertEqual(booktext.pending_books(Book.objects).count(), 1)
+
+        out = StringIO()
+        call_command('index_book_text', stdout=out)
+        self.assertIn("1 books indexed", out.getvalue())
+        self.assertEqual(list(self.search('armigerous')), [self.dunwich])
+
+        call_command('index_book_text', stdout=out)
+        self.assertIn("0 books indexed", out.getvalue())
+        call_command('index_book_text', '--rebuild', stdout=out)
+        self.assertIn("2 books indexed", out.getvalue())
+
+    def test_command_batches(self):
+        out = StringIO()
+        with mock.patch('books.management.commands.index_book_text'
+                        '.BATCH_SIZE', 1):
+            call_command('index_book_text', '--rebuild', '--limit', '1',
+                         stdout=out)
+            self.assertIn("1 books indexed", out.getvalue())
+            call_command('index_book_text', stdout=out)
+            self.assertIn("1 books indexed", out.getvalue())
+        self.assertEqual(booktext.pending_books(Book.objects).count(), 0)
+
+
+class FuzzySearchTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+        self.dunwich = Book.objects.get(a_title='The Dunwich Horror')
+        self.plays = Book.objects.get(a_title='Five Plays')
+
+    def search(self, params):
+        d = Client().get(reverse_lazy('latest'), params)
+        self.assertEqual(d.status_code, 200)
+        return list(d.context['book_list']), d.context['approximate']
+
+    def test_trigrams(self):
+        self.assertEqual(fuzzy.trigrams('Lé'), {'  l', ' le', 'le '})
+        self.assertEqual(fuzzy.trigrams(''), set())
+        self.assertEqual(Trigram.objects.filter(
+            kind='book', object_id=self.dunwich.pk).count(),
+            len(fuzzy.trigrams('The Dunwich Horror')))
+        similar = fuzzy.similar('Lovcraft', kinds=['author'])
+        self.assertEqual([pk for kind, pk, similarity in similar],
+                         [self.dunwich.a_author_id])
+
+    def test_fallback(self):
+        self.assertEqual(self.search({'q': 'Lovecraft'}),
+                         ([self.dunwich], False))
+        self.assertEqual(self.search({'q': 'Lovcraft'}),
+                         ([self.dunwich], True))
+        self.assertEqual(self.search({'q': 'dunwitch horor'}),
+                         ([self.dunwich], True))
+        self.assertEqual(self.search({'q': 'Dunsay', 'search-title': 'on'}),
+                         ([], False))
+        self.assertEqual(self.search({'q': 'Dunsay', 'search-author': 'on'}),
+                         ([self.plays], True))
+        self.assertEqual(self.search({'q': 'zzzzzz'}), ([], False))
+
+    def test_index_follows_changes(self):
+        self.dunwich.a_title = 'The Colour Out of Space'
+        self.dunwich.save()
+        self.assertEqual(self.search({'q': 'color out of spice',
+                                      'search-title': 'on'}),
+                         ([self.dunwich], True))
+        self.dunwich.delete()
+        self.assertFalse(Trigram.objects.filter(
+            kind='book', object_id=self.dunwich.pk).exists())
+
+
+class FacetsTest(TestCase):
+    def setUp(self):
+        call_command('addepub', 'examples/valid')
+
+    def facets(self, response):
+        return dict((group['param'],
+                     [(facet['label'], facet['count'])
+                      for facet in group['values']])
+                    for group in response.context['facets'])
+
+    def test_html_facets(self):
+        c = Client()
+        d = c.get(reverse_lazy('latest'))
+        self.assertIsNone(d.context['facets'])
+        self.assertEqual(d.context['published_books'], 2)
+
+        d = c.get(reverse_lazy('latest'), {'q': 'gutenberg'})
+        facets = self.facets(d)
+        self.assertEqual(facets['lang'], [('English', 2)])
+        self.assertEqual(facets['tag'], [('English drama', 1)])
+        self.assertEqual(sorted(facets['author']),
+                         [('H. P. Lovecraft', 1), ('Lord Dunsany', 1)])
+        self.assertNotIn('status', facets)
+
+        d = c.get(reverse_lazy('latest'),
+                  {'q': 'gutenberg', 'tag': 'English drama'})
+        self.assertEqual([book.a_title for book in d.context['book_list']],
+                         ['Five Plays'])
+        self.assertEqual(self.facets(d)['tag'], [('English drama', 1)])
+        self.assertEqual(d.context['facet_filters'], 'tag=English+drama')
+
+    def test_opds_facets(self):
+        d = Client().get(reverse_lazy('latest_feed'), {'q': 'gutenberg'})
+        root = etree.fromstring(d.getvalue())
+        links = root.findall('{http://www.w3.org/2005/Atom}link'
+                             '[@rel="http://opds-spec.org/facet"]')
+        counts = dict((link.get('title'), link.get(
+            '{http://purl.org/syndication/thread/1.0}count'))
+                      for link in links)
+        self.assertEqual(counts['English'], '2')
+        self.assertEqual(counts['English drama'], '1')
+
+        # a facet selects the first page of the filtered list
+        d = Client().get(reverse_lazy('latest_feed'),
+                         {'q': 'gutenberg', 'cursor': 'WyJuIl0'})
+        root = etree.fromstring(d.getvalue())
+        for link in root.findall('{http://www.w3.org/2005/Atom}link'
+                                 '[@rel="http://opds-spec.org/facet"]'):
+            self.assertNotIn('cursor=', link.get('href'))
+
+
+class BenchmarkTest(TestCase):
+    def test_benchmark(self):
+        corpus = benchmark.generate_corpus(books=40, authors=8, tags=6,
+                                           summary_words=(5, 10))
+        self.assertEqual(Book.objects.count(), 40)
+        self.assertEqual(corpus['books'], 40)
+        # and listed by author and tag as the views list them
+        self.assertEqual(AuthorSummary.objects.filter(
+            total_books__gt=0).count(), Book.objects.values(
+                'a_author').distinct().count())
+        self.assertTrue(TagSummary.objects.filter(total_books__gt=0).exists())
+        # the synthetic books are searchable
+        book = Book.objects.first()
+        self.assertIn(book, advanced_search(Book.objects.all(),
+                                            book.a_title.split()[0]))
+
+        queries = benchmark.make_queries(30, seed=1)
+        self.assertEqual(queries, benchmark.make_queries(30, seed=1))
+        report = benchmark.run_queries(queries)
+        self.assertEqual(report['overall']['count'], 30)
+        self.assertLessEqual(report['overall']['p50_ms'],
+                             report['overall']['p99_ms'])
+        self.assertEqual(benchmark.compare(report, report)['p95_ms'], 1.0)
+
+    def test_percentile(self):
+        self.assertEqual(benchmark.percentile([3, 1, 2], 0.5), 2)
+        self.assertEqual(benchmark.percentile(range(100), 0.99), 98)
+        self.assertIsNone(benchmark.percentile([], 0.5))
+
+    def test_writers(self):
+        report = benchmark.run_writers(entries=20, repeat=1)
+        self.assertTrue(report['identical'])
+        self.assertEqual(sorted(report['writers']), ['sax', 'template'])
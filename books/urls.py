@@ -41,6 +41,23 @@ urlpatterns = [
      {'qtype': u'feed'}, 'by_tag_feed'),
     url(r'^by-popularity.atom$', views.most_downloaded,
      {'qtype': u'feed'}, 'most_downloaded_feed'),
+    url(r'^complete.atom$', views.complete_feed, {}, 'complete_feed'),
+
+    # Book list OPDS 2.0 JSON:
+    url(r'^catalog.json$', views.root,
+     {'qtype': u'json'}, 'root_json'),
+    url(r'^latest.json$', views.latest,
+     {'qtype': u'json'}, 'latest_json'),
+    url(r'^by-title.json$', views.by_title,
+     {'qtype': u'json'}, 'by_title_json'),
+    url(r'^by-author.json$', views.by_author,
+     {'qtype': u'json'}, 'by_author_json'),
+    url(r'^by-author/(?P<author_id>\d+).json$', views.by_title,
+     {'qtype': u'json'}, 'by_title_author_json'),
+    url(r'^tags/(?P<tag>.+).json$', views.by_tag,
+     {'qtype': u'json'}, 'by_tag_json'),
+    url(r'^by-popularity.json$', views.most_downloaded,
+     {'qtype': u'json'}, 'most_downloaded_json'),
 
     # Tag groups:
     url(r'^tags-groups.atom$', views.tags_listgroups,
@@ -49,11 +66,29 @@ urlpatterns = [
      {}, 'tag_groups'),
     url(r'^tags-groups/(?P<group_slug>[-\w]+).atom$', views.tags,
      {'qtype': u'feed'}, 'tag_groups_feed'),
+    url(r'^tags-groups.json$', views.tags_listgroups,
+     {'qtype': u'json'}, 'tags_listgroups_json'),
+    url(r'^tags-groups/(?P<group_slug>[-\w]+).json$', views.tags,
+     {'qtype': u'json'}, 'tag_groups_json'),
 
     # Tag list:
     url(r'^tags/$', views.tags, {}, 'tags'),
     url(r'^tags.atom$', views.tags,
      {'qtype': u'feed'}, 'tags_feed'),
+    url(r'^tags.json$', views.tags,
+     {'qtype': u'json'}, 'tags_json'),
+
+    # OPDS search:
+    url(r'^opensearch.xml$', views.opensearch,
+     {}, 'opensearch'),
+    url(r'^search.atom$', views.search_feed,
+     {}, 'search_feed'),
+    url(r'^search.json$', views.search_feed,
+     {'qtype': u'json'}, 'search_json'),
+
+    # Search box suggestions:
+    url(r'^suggestions.json$', views.search_suggestions,
+     {}, 'search_suggestions'),
 
     # Add, view, edit and remove books:
     url(r'^book/add$', views.BookAddView.as_view(), name='book_add'),
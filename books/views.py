@@ -15,17 +15,22 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import base64
+import binascii
 import os
 
 from django.conf import settings
 from django.core.urlresolvers import reverse
+from django.http import JsonResponse
 from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.http import Http404
 from django.shortcuts import render
 from django.shortcuts import get_object_or_404
 from django.shortcuts import redirect
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator, InvalidPage, EmptyPage
+from django.db.models import F, Max
 
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import UpdateView
@@ -41,18 +46,58 @@ from django.core.exceptions import ObjectDoesNotExist
 
 from sendfile import sendfile
 
+from books import autocomplete, bitmaps, booktext, generation, opds2
+from books import navfeeds, resultcache
+from books.conditional import conditional_feed, FEED_TYPES
+from books.facets import book_counts, apply_filters, is_filtered
+from books.facets import compute_facets, selected_qstring
+from books.fuzzy import similar_books
+from books.pagination import keyset_iterator, keyset_page, peek_page
 from books.search import simple_search, advanced_search
+from books.searchquery import parse, positive_terms
 from books.forms import BookForm, AddLanguageForm
-from books.models import TagGroup, Book, Author
+from books.models import TagGroup, Book, AuthorSummary, TagSummary
 # FIXME: move opds in dedicated app
 from books.opds import page_qstring
 from books.opds import generate_catalog
 from books.opds import generate_author_catalog
-from books.opds import generate_root_catalog
 from books.opds import generate_tags_catalog
-from books.opds import generate_taggroups_catalog
-
-from books.app_settings import BOOK_PUBLISHED
+from books.opds import generate_complete_catalog
+
+from books.app_settings import BOOK_PUBLISHED, AUTOCOMPLETE_RESULTS
+from books.app_settings import SEARCH_CACHE_SIZE, TAGS_PER_PAGE
+from books.app_settings import SEARCH_CACHE_IDS
+from books.app_settings import COMPLETE_FEED_CHUNK_SIZE
+
+# Ids of the books found by the recent searches:
+search_cache = resultcache.ResultCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_IDS)
+
+# Orderings of the feeds paginated by keyset, by list, the primary key
+# last (see books.pagination and the indexes of the Book model):
+KEYSET_ORDERINGS = {
+    'latest': ('-time_added', '-pk'),
+    'by-tag': ('-time_added', '-pk'),
+    'by-title': ('a_title', 'pk'),
+    'most-downloaded': ('-downloads', '-pk'),
+    'by-author': ('sort_key', 'pk'),
+}
+
+# Orderings of the tag lists, by (sort, authenticated):
+TAG_ORDERINGS = {
+    ('name', False): ('sort_key', 'pk'),
+    ('name', True): ('sort_key', 'pk'),
+    ('count', False): ('-published_books', '-pk'),
+    ('count', True): ('-total_books', '-pk'),
+}
+
+
+def _keyset_paginated(request, qtype, q):
+    """
+    Whether a list is paginated by keyset: the feeds are, unless they
+    are search results, or a numbered page is asked.  The HTML pages
+    are numbered.
+    """
+    return qtype in FEED_TYPES and q is None and 'page' not in request.GET
 
 
 class BookDetailView(DetailView):
@@ -89,36 +134,105 @@ def download_book(request, book_id):
     # TODO, currently the downloads counter is incremented when the
     # download is requested, without knowing if the file sending was
     # successfull:
-    book.downloads += 1
-    book.save()
-    return sendfile(request, filename, attachment=True)
-
+    # Counted with an UPDATE so the catalogue generation is unchanged:
+    Book.objects.filter(pk=book.pk).update(downloads=F('downloads') + 1)
+    generation.count_download()
+    response = sendfile(request, filename, attachment=True)
+    # the checksum of the file, computed when the book was added
+    response['Digest'] = 'sha-256=' + base64.b64encode(
+        binascii.unhexlify(book.file_sha256sum)).decode('ascii')
+    response['ETag'] = '"%s"' % book.file_sha256sum
+    return response
+
+@conditional_feed
 def tags(request, qtype=None, group_slug=None):
+    """
+    List the tags, or the tags of a group, by name or by number of
+    books (?sort=count), from their TagSummary.  The anonymous users
+    only see the tags of published books.
+    """
     context = {'list_by': 'by-tag'}
+    authenticated = request.user.is_authenticated()
 
+    summaries = TagSummary.objects.select_related('tag')
+    if not authenticated:
+        summaries = summaries.filter(published_books__gt=0)
     if group_slug is not None:
         tag_group = get_object_or_404(TagGroup, slug=group_slug)
         context.update({'tag_group': tag_group})
-        context.update({'tag_list': tag_group.tags.all()})
-    else:
-        context.update({'tag_list': Tag.objects.all()})
+        summaries = summaries.filter(tag__in=tag_group.tags.all())
 
-    tag_groups = TagGroup.objects.all()
-    context.update({'tag_group_list': tag_groups})
+    sort = 'count' if request.GET.get('sort') == 'count' else 'name'
+    ordering = TAG_ORDERINGS[sort, authenticated]
+
+    if _keyset_paginated(request, qtype, None):
+        page_obj = keyset_page(summaries, ordering,
+                               request.GET.get('cursor'), TAGS_PER_PAGE)
+    else:
+        paginator = Paginator(summaries.order_by(*ordering), TAGS_PER_PAGE)
+        try:
+            page_obj = paginator.page(int(request.GET.get('page', '1')))
+        except (ValueError, EmptyPage, InvalidPage):
+            page_obj = paginator.page(paginator.num_pages)
 
     # Return OPDS Atom Feed:
     if qtype == 'feed':
-        catalog = generate_tags_catalog(context['tag_list'])
-        return HttpResponse(catalog, content_type='application/atom+xml')
+        catalog = generate_tags_catalog(request, page_obj, navfeeds.dates())
+        return StreamingHttpResponse(catalog,
+                                     content_type='application/atom+xml')
+    if qtype == 'json':
+        return _json_catalog(opds2.generate_tags_catalog(request, page_obj))
 
     # Return HTML page:
+    context.update({
+        'tag_list': page_obj.object_list,
+        'paginator': paginator,
+        'page_obj': page_obj,
+        'sort': sort,
+        'tag_group_list': TagGroup.objects.all(),
+    })
     return render(request, 'books/tag_list.html',
                   context)
 
-def tags_listgroups(request):
-    tag_groups = TagGroup.objects.all()
-    catalog = generate_taggroups_catalog(tag_groups)
-    return HttpResponse(catalog, content_type='application/atom+xml')
+def search_suggestions(request):
+    """Return as JSON the titles, authors and tags completing q"""
+    q = request.GET.get('q', '')
+    public_only = not request.user.is_authenticated()
+
+    results = []
+    for kind, pk, label in autocomplete.lookup(q, AUTOCOMPLETE_RESULTS,
+                                               public_only):
+        if kind == 'book':
+            url = reverse('book_detail', kwargs=dict(pk=pk))
+        elif kind == 'author':
+            url = reverse('books_by_author', kwargs=dict(author_id=pk))
+        else:
+            url = reverse('by_tag', kwargs=dict(tag=label))
+        results.append({'type': kind, 'label': label, 'url': url})
+    return JsonResponse({'q': q, 'results': results})
+
+def _json_catalog(catalog):
+    return HttpResponse(catalog, content_type=opds2.CONTENT_TYPE)
+
+def _nav_feed(name):
+    content, content_type = navfeeds.feed(name)
+    return HttpResponse(content, content_type=content_type)
+
+@conditional_feed(feed_only=True)
+def tags_listgroups(request, qtype='feed'):
+    if qtype == 'json':
+        return _nav_feed('tags_listgroups_json')
+    return _nav_feed('tags_listgroups')
+
+def _similar_books(queryset, q, search_all, search_title, search_author):
+    """Return the ids of the books whose title or author look like q."""
+    kinds = []
+    if search_all or search_title:
+        kinds.append('book')
+    if search_all or search_author:
+        kinds.append('author')
+    text = ' '.join(term.text for term in positive_terms(parse(q)))
+    return similar_books(queryset, text, kinds)
 
 def _book_list(request, queryset, qtype=None, list_by='latest', **kwargs):
     """
@@ -130,43 +244,99 @@ def _book_list(request, queryset, qtype=None, list_by='latest', **kwargs):
     search_all = request.GET.get('search-all') == 'on'
     search_title = request.GET.get('search-title') == 'on'
     search_author = request.GET.get('search-author') == 'on'
+    search_text = request.GET.get('search-text') == 'on'
 
     user = request.user
     if not user.is_authenticated():
         queryset = queryset.filter(a_status = BOOK_PUBLISHED)
+    queryset = apply_filters(queryset, request.GET)
 
-    published_books_count = Book.objects.filter(a_status = BOOK_PUBLISHED).count()
-    unpublished_books_count = Book.objects.exclude(a_status = BOOK_PUBLISHED).count()
+    published_books_count, unpublished_books_count = book_counts()
 
     # If no search options are specified, assumes search all, the
     # advanced search will be used:
-    if not search_all and not search_title and not search_author:
+    if not search_all and not search_title and not search_author \
+            and not search_text:
         search_all = True
 
     # If search queried, modify the queryset with the result of the
-    # search:
+    # search.  Searching from the latest books list sorts the results
+    # by relevance.  The results are cached for the next pages:
+    facets = None
+    object_list = None
+    approximate = False
     if q is not None:
-        if search_all:
-            queryset = advanced_search(queryset, q)
-        else:
-            queryset = simple_search(queryset, q,
+        key = resultcache.make_key(request.GET, list_by,
+                                   request.resolver_match.kwargs,
+                                   user.is_authenticated())
+        token = generation.current()
+        results = search_cache.get(key, token)
+        if results is None:
+            ranked = list_by == 'latest'
+            if search_text:
+                found = booktext.search(queryset, q, ranked)
+            elif search_all:
+                found = advanced_search(queryset, q, ranked)
+            else:
+                found = simple_search(queryset, q,
+                                      search_title, search_author, ranked)
+            ids = list(found.values_list('pk', flat=True))
+            # Nothing found, the query may be misspelled: list the
+            # books with a similar title or author name
+            if not ids and not search_text:
+                ids = _similar_books(queryset, q, search_all,
                                      search_title, search_author)
-
-    paginator = Paginator(queryset, BOOKS_PER_PAGE)
-    page = int(request.GET.get('page', '1'))
-
-    try:
-        page_obj = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-        page_obj = paginator.page(paginator.num_pages)
+                if ids:
+                    approximate = True
+                    found = queryset.filter(pk__in=ids)
+            results = search_cache.put(
+                key, token, ids,
+                compute_facets(found, request.GET,
+                               with_status=user.is_authenticated()),
+                approximate)
+        object_list = resultcache.BookIdList(results.ids)
+        facets = results.facets
+        approximate = results.approximate
+    elif is_filtered(request.GET):
+        facets = compute_facets(queryset, request.GET,
+                                with_status=user.is_authenticated())
+
+    if _keyset_paginated(request, qtype, q):
+        page_obj = keyset_page(queryset, KEYSET_ORDERINGS[list_by],
+                               request.GET.get('cursor'), BOOKS_PER_PAGE)
+    else:
+        # The latest books, and the books of a tag, are listed from the
+        # in-memory bitmaps unless a search or an author is selected:
+        if q is None and list_by in ('latest', 'by-tag'):
+            object_list = bitmaps.book_list(request.GET,
+                                            not user.is_authenticated(),
+                                            tag=kwargs.get('tag'))
+        if object_list is None:
+            object_list = queryset
+
+        paginator = Paginator(object_list, BOOKS_PER_PAGE)
+        page = int(request.GET.get('page', '1'))
+
+        try:
+            page_obj = paginator.page(page)
+        except (EmptyPage, InvalidPage):
+            page_obj = paginator.page(paginator.num_pages)
+
+    # Show where the text of the books matches:
+    if search_text:
+        booktext.add_snippets(page_obj.object_list, q)
 
     # Build the query string:
     qstring = page_qstring(request)
 
     # Return OPDS Atom Feed:
     if qtype == 'feed':
-        catalog = generate_catalog(request, page_obj)
-        return HttpResponse(catalog, content_type='application/atom+xml')
+        catalog = generate_catalog(request, page_obj, facets)
+        return StreamingHttpResponse(catalog,
+                                     content_type='application/atom+xml')
+    if qtype == 'json':
+        return _json_catalog(opds2.generate_catalog(request, page_obj,
+                                                    facets))
 
     # Return HTML page:
     extra_context = dict(kwargs)
@@ -179,13 +349,17 @@ def _book_list(request, queryset, qtype=None, list_by='latest', **kwargs):
         'page_obj': page_obj,
         'search_title': search_title,
         'search_author': search_author, 'list_by': list_by,
+        'search_text': search_text,
+        'approximate': approximate,
         'qstring': qstring,
+        'facets': facets,
+        'facet_filters': selected_qstring(request.GET),
         'allow_public_add_book': settings.ALLOW_PUBLIC_ADD_BOOKS
     })
     return render(request, 'books/book_list.html',
                   context=extra_context)
 
-def _author_list(request, queryset_, qtype=None, list_by='latest', **kwargs):
+def _author_list(request, qtype=None, list_by='latest', **kwargs):
     """
     Filter the authors, paginate the result, and return either a HTML
     author list, or a atom+xml OPDS catalog.
@@ -195,13 +369,14 @@ def _author_list(request, queryset_, qtype=None, list_by='latest', **kwargs):
     search_title = request.GET.get('search-title') == 'on'
     search_author = request.GET.get('search-author') == 'on'
 
-    queryset = Book.objects.all()
     user = request.user
-    if not user.is_authenticated():
-        queryset = queryset.filter(a_status = BOOK_PUBLISHED)
+    summaries = AuthorSummary.objects.select_related('author')
+    if user.is_authenticated():
+        summaries = summaries.filter(total_books__gt=0)
+    else:
+        summaries = summaries.filter(published_books__gt=0)
 
-    published_books_count = Book.objects.filter(a_status = BOOK_PUBLISHED).count()
-    unpublished_books_count = Book.objects.exclude(a_status = BOOK_PUBLISHED).count()
+    published_books_count, unpublished_books_count = book_counts()
 
     # If no search options are specified, assumes search all, the
     # advanced search will be used:
@@ -211,30 +386,41 @@ def _author_list(request, queryset_, qtype=None, list_by='latest', **kwargs):
     # If search queried, modify the queryset with the result of the
     # search:
     if q is not None:
+        books = Book.objects.all()
+        if not user.is_authenticated():
+            books = books.filter(a_status=BOOK_PUBLISHED)
         if search_all:
-            queryset = advanced_search(queryset, q)
+            books = advanced_search(books, q)
         else:
-            queryset = simple_search(queryset, q,
-                                     search_title, search_author)
-
-    books = queryset.values_list('a_author', flat=True)
-    queryset = Author.objects.all().order_by('a_author').filter(pk__in=books)
-
-    paginator = Paginator(queryset, AUTHORS_PER_PAGE)
-    page = int(request.GET.get('page', '1'))
+            books = simple_search(books, q, search_title, search_author)
+        summaries = summaries.filter(
+            pk__in=books.order_by().values('a_author'))
+    queryset = summaries.order_by('sort_key', 'pk')
+
+    if _keyset_paginated(request, qtype, q):
+        page_obj = keyset_page(queryset, KEYSET_ORDERINGS[list_by],
+                               request.GET.get('cursor'), AUTHORS_PER_PAGE)
+    else:
+        paginator = Paginator(queryset, AUTHORS_PER_PAGE)
+        page = int(request.GET.get('page', '1'))
 
-    try:
-        page_obj = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-        page_obj = paginator.page(paginator.num_pages)
+        try:
+            page_obj = paginator.page(page)
+        except (EmptyPage, InvalidPage):
+            page_obj = paginator.page(paginator.num_pages)
 
     # Build the query string:
     qstring = page_qstring(request)
 
     # Return OPDS Atom Feed:
     if qtype == 'feed':
-        catalog = generate_author_catalog(request, page_obj)
-        return HttpResponse(catalog, content_type='application/atom+xml')
+        catalog = generate_author_catalog(request, page_obj,
+                                          navfeeds.dates())
+        return StreamingHttpResponse(catalog,
+                                     content_type='application/atom+xml')
+    if qtype == 'json':
+        return _json_catalog(opds2.generate_author_catalog(request,
+                                                           page_obj))
 
     # Return HTML page:
     extra_context = dict(kwargs)
@@ -257,25 +443,80 @@ def _author_list(request, queryset_, qtype=None, list_by='latest', **kwargs):
 def home(request):
     return redirect('latest')
 
+@conditional_feed
 def root(request, qtype=None):
     """Return the root catalog for navigation"""
-    root_catalog = generate_root_catalog()
-    return HttpResponse(root_catalog, content_type='application/atom+xml')
+    if qtype == 'json':
+        return _nav_feed('root_json')
+    return _nav_feed('root_feed')
+
+def opensearch(request):
+    """OpenSearch description of the search feed."""
+    context = {
+        'feed_url': request.build_absolute_uri(reverse('search_feed')),
+        'html_url': request.build_absolute_uri(reverse('latest')),
+    }
+    return render(request, 'books/opensearch.xml', context=context,
+                  content_type='application/opensearchdescription+xml')
+
+@conditional_feed(feed_only=True)
+def search_feed(request, qtype='feed'):
+    """
+    OPDS search results, most relevant first.
 
+    Pages are read with one query: the next page is detected by
+    reading one more book, there is no COUNT.
+    """
+    queryset = Book.objects.select_related('a_author', 'dc_language')
+    if not request.user.is_authenticated():
+        queryset = queryset.filter(a_status=BOOK_PUBLISHED)
+    # the OPDS 2.0 search link is templated with `query`
+    q = request.GET.get('q') or request.GET.get('query', '')
+    if q.strip():
+        queryset = advanced_search(queryset, q, ranked=True)
+    else:
+        queryset = queryset.none()
+    page_obj = peek_page(queryset, request.GET.get('page'), BOOKS_PER_PAGE)
+    if qtype == 'json':
+        return _json_catalog(opds2.generate_catalog(request, page_obj))
+    catalog = generate_catalog(request, page_obj)
+    return StreamingHttpResponse(catalog, content_type='application/atom+xml')
+
+@conditional_feed(feed_only=True, cached=False)
+def complete_feed(request):
+    """
+    Complete acquisition feed: all the books the user can see, streamed
+    while they are read by chunks, for the mirrors harvesting the
+    catalogue in one request.  Too large to be cached, each request
+    streams its own copy, without waiting for the others.
+    """
+    queryset = Book.objects.select_related('a_author', 'dc_language')
+    if not request.user.is_authenticated():
+        queryset = queryset.filter(a_status=BOOK_PUBLISHED)
+    updated = queryset.aggregate(Max('a_updated'))['a_updated__max'] \
+        or generation.state()[1]
+    books = keyset_iterator(queryset, KEYSET_ORDERINGS['latest'],
+                            COMPLETE_FEED_CHUNK_SIZE)
+    catalog = generate_complete_catalog(books, updated)
+    return StreamingHttpResponse(catalog, content_type='application/atom+xml')
+
+@conditional_feed
 def latest(request, qtype=None):
-    queryset = Book.objects.all()
+    queryset = Book.objects.order_by(*KEYSET_ORDERINGS['latest'])
     return _book_list(request, queryset, qtype, list_by='latest')
 
+@conditional_feed
 def by_title(request, qtype=None, author_id=None):
     queryset = Book.objects.all().order_by('a_title')
     if author_id:
         queryset = queryset.filter(a_author=author_id)
     return _book_list(request, queryset, qtype, list_by='by-title')
 
+@conditional_feed
 def by_author(request, qtype=None):
-    queryset = Author.objects.all().order_by('a_author')
-    return _author_list(request, queryset, qtype, list_by='by-author')
+    return _author_list(request, qtype, list_by='by-author')
 
+@conditional_feed
 def by_tag(request, tag, qtype=None):
     """ displays a book list by the tag argument """
     # get the Tag object
@@ -285,10 +526,12 @@ def by_tag(request, tag, qtype=None):
         raise Http404()
 
     # Get a list of books that have the requested tag
-    queryset = Book.objects.filter(tags=tag_instance)
+    queryset = Book.objects.filter(tags=tag_instance).order_by(
+        *KEYSET_ORDERINGS['by-tag'])
     return _book_list(request, queryset, qtype, list_by='by-tag',
                       tag=tag_instance)
 
+@conditional_feed(downloads=True)
 def most_downloaded(request, qtype=None):
     queryset = Book.objects.all().order_by('-downloads')
     return _book_list(request, queryset, qtype, list_by='most-downloaded')